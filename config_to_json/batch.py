@@ -0,0 +1,149 @@
+import os
+import sys
+import glob
+import time
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from config_to_json import (FORMAT_PRETTY, MODULES, OUTPUT_BUFFER_SIZE, OUTPUT_FORMATS, ConfigParser, SourceMap,
+                            write_json_stream)
+
+MB = 1024 * 1024
+# Каталоги обходятся в поисках файлов с этим шаблоном имени, если не задан --pattern
+DEFAULT_PATTERN = '*.conf'
+
+
+def output_for(input_path, relative_path, output_dir):
+    # Без каталога вывода JSON кладётся рядом с исходным файлом
+    if not output_dir:
+        return os.path.splitext(input_path)[0] + '.json'
+    return os.path.join(output_dir, os.path.splitext(relative_path)[0] + '.json')
+
+
+def collect_jobs(inputs, output_dir=None, manifest=None, pattern=DEFAULT_PATTERN):
+    """Список пар (входной файл, выходной файл) из каталогов, шаблонов glob и файла-манифеста.
+
+    В манифесте на каждой строке — входной файл и, через пробел, необязательный выходной;
+    пустые строки и строки, начинающиеся с '#', пропускаются.
+    """
+    jobs = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for path in sorted(glob.glob(os.path.join(item, '**', pattern), recursive=True)):
+                if os.path.isfile(path):
+                    jobs.append((path, output_for(path, os.path.relpath(path, item), output_dir)))
+        else:
+            paths = sorted(glob.glob(item, recursive=True)) if glob.has_magic(item) else [item]
+            for path in paths:
+                jobs.append((path, output_for(path, os.path.basename(path), output_dir)))
+    if manifest:
+        base = os.path.dirname(manifest)
+        with open(manifest, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split()
+                path = os.path.join(base, parts[0])
+                if len(parts) > 1:
+                    jobs.append((path, os.path.join(base, parts[1])))
+                else:
+                    jobs.append((path, output_for(path, parts[0], output_dir)))
+    return jobs
+
+
+def convert_file(job, output_format=FORMAT_PRETTY):
+    """Преобразует один файл; ошибки возвращаются, а не выбрасываются.
+
+    Возвращает (входной файл, размер в байтах, текст ошибки или None).
+    """
+    input_path, output_path = job
+    text = tmp_path = None
+    try:
+        with open(input_path, 'r') as f:
+            text = f.read()
+        result = ConfigParser(path=input_path).parse(text)
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = output_path + '.tmp'
+        with open(tmp_path, 'w', buffering=OUTPUT_BUFFER_SIZE) as f:
+            write_json_stream(result, f, output_format)
+        os.replace(tmp_path, output_path)
+    except Exception as e:
+        if tmp_path is not None:
+            # недописанный вывод не оставляется рядом с результатом
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        # Ошибки без позиции в тексте (вычисление, ввод-вывод) тоже называют свой файл
+        if text is not None and getattr(e, 'source_offset', None) is not None:
+            message = SourceMap(text).format_error(e, input_path)
+        else:
+            message = f'{input_path}: {e}'
+        return input_path, 0 if text is None else len(text), message
+    return input_path, len(text), None
+
+
+def set_module_cache(cache_dir):
+    MODULES.cache_dir = cache_dir
+
+
+def convert_batch(jobs, workers=None, chunksize=None, output_format=FORMAT_PRETTY, module_cache=None):
+    """Преобразует файлы пулом процессов, собирая ошибки по файлам.
+
+    Импортируемые модули разбираются один раз в каждом процессе.
+    Возвращает (список ошибок, общий объём входных данных в байтах).
+    """
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        # Несколько кусков на процесс сглаживают разницу в размерах файлов
+        chunksize = max(1, len(jobs) // (workers * 4))
+    convert = partial(convert_file, output_format=output_format)
+    if workers == 1 or len(jobs) <= 1:
+        set_module_cache(module_cache)
+        return collect_results(map(convert, jobs))
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_module_cache, initargs=(module_cache,)) as pool:
+        return collect_results(pool.map(convert, jobs, chunksize=chunksize))
+
+
+def collect_results(results):
+    errors = []
+    total_bytes = 0
+    for _, size, error in results:
+        total_bytes += size
+        if error is not None:
+            errors.append(error)
+    return errors, total_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert many config files to JSON in parallel')
+    parser.add_argument('inputs', nargs='*', help='Config files, directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', help='Directory for JSON files (default: next to each input)')
+    parser.add_argument('-m', '--manifest', help='File listing inputs (and optional outputs), one per line')
+    parser.add_argument('--pattern', default=DEFAULT_PATTERN, help='File name pattern used inside directories')
+    parser.add_argument('-j', '--workers', type=int, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--chunksize', type=int, help='Files handed to a worker at a time')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default=FORMAT_PRETTY, help='Output format')
+    parser.add_argument('--module-cache', help='Directory for evaluated imported modules, keyed by path and content hash')
+    args = parser.parse_args()
+    if not args.inputs and not args.manifest:
+        parser.error('no inputs given')
+
+    jobs = collect_jobs(args.inputs, args.output_dir, args.manifest, args.pattern)
+    start = time.perf_counter()
+    errors, total_bytes = convert_batch(jobs, args.workers, args.chunksize, args.format, args.module_cache)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    for error in errors:
+        print(f'Error: {error}')
+    print(f'Converted {len(jobs) - len(errors)} of {len(jobs)} files in {elapsed:.2f} s '
+          f'({len(jobs) / elapsed:.1f} files/s, {total_bytes / MB / elapsed:.2f} MB/s)')
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
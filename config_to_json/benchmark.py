@@ -0,0 +1,262 @@
+import argparse
+import os
+import re
+import json
+import time
+import tempfile
+from array import array
+
+from config_to_json import (ConfigParser, ArrayValue, TOKEN_REGEX, TOKEN_LITERALS, COMMENT, NUMBER, NAME, OP,
+                            STRING, MISMATCH, LBRACK, RBRACK, LBRACE, COMMA, OUTPUT_BUFFER_SIZE, OUTPUT_FORMATS,
+                            json_default, write_json_stream)
+
+MB = 1024 * 1024
+
+
+def generate_config(size):
+    # Генерация конфигурации примерно заданного размера в байтах
+    parts = []
+    total = 0
+    i = 0
+    while total < size:
+        block = (
+            f'# block {i}\n'
+            f'var ports_{i} := [{i % 1000}, 443, 80, 8080, {i * 7 % 65536}, 22, 25, 110]\n'
+            f'var first_{i} := {{ ports_{i} sort() 0 index() }}\n'
+            f'(comment\n  generated block {i}\n)\n'
+            f'var total_{i} := {{ first_{i} 10 * 5 + }}\n'
+        )
+        parts.append(block)
+        total += len(block)
+        i += 1
+    return ''.join(parts)
+
+
+def legacy_tokenize(text):
+    # Прежняя реализация: два прохода re.sub и словарь на каждый токен
+    text = re.sub(r'\(comment.*?\)', '', text, flags=re.DOTALL)
+    text = re.sub(r'#.*', '', text)
+    token_specification = [
+        ('NUMBER', r'\d+'), ('VAR', r'var'), ('SORT', r'sort\(\)'), ('INDEX', r'index\(\)'),
+        ('NAME', r'[a-zA-Z_][a-zA-Z0-9_]*'), ('ASSIGN', r':='), ('LBRACE', r'\{'), ('RBRACE', r'\}'),
+        ('LBRACK', r'\['), ('RBRACK', r'\]'), ('COMMA', r','), ('OP', r'[\+\-\*]'),
+        ('SKIP', r'[ \t\n]+'), ('MISMATCH', r'.'),
+    ]
+    tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in token_specification)
+    tokens = []
+    for mo in re.finditer(tok_regex, text):
+        kind = mo.lastgroup
+        value = mo.group()
+        if kind == 'NUMBER':
+            value = int(value)
+        elif kind == 'SKIP':
+            continue
+        elif kind == 'MISMATCH':
+            raise SyntaxError(f'Unexpected character {value!r}')
+        tokens.append({'type': kind, 'value': value})
+    return tokens
+
+
+def tokenize_with_offsets(text):
+    # Лексер, сохраняющий смещение каждого токена (mo.start) в третьем массиве, — то, что
+    # ConfigParser.tokenize не делает: позиция для диагностики восстанавливается только при ошибке
+    types = array('B')
+    values = []
+    offsets = array('Q')
+    add_type = types.append
+    add_value = values.append
+    add_offset = offsets.append
+    literals = TOKEN_LITERALS
+    for mo in TOKEN_REGEX.finditer(text):
+        kind = mo.lastindex
+        if kind == COMMENT:
+            continue
+        if kind == NUMBER:
+            add_value(int(mo.group(kind)))
+        elif kind == NAME or kind == OP:
+            add_value(mo.group(kind))
+        elif kind == STRING:
+            add_value(mo.group(kind)[1:-1])
+        elif kind == MISMATCH:
+            raise SyntaxError(f'Unexpected character {mo.group(kind)!r}')
+        else:
+            add_value(literals[kind])
+        add_type(kind)
+        add_offset(mo.start(kind))
+    return types, values, offsets
+
+
+def tokenize_lazy(text):
+    parser = ConfigParser()
+    parser.tokenize(text)
+    return parser.types, parser.values
+
+
+def bench_offsets(sizes, repeat=5):
+    # Стоимость позиций токенов: лексер без сохранения смещений (ленивое восстановление при ошибке)
+    # против лексера, сохраняющего смещение каждого токена. Прогоны чередуются, берётся лучший
+    for size_mb in sizes:
+        text = generate_config(int(size_mb * MB))
+        types, values = tokenize_lazy(text)
+        if tokenize_with_offsets(text)[:2] != (types, values):
+            raise AssertionError('tokenizers disagree')
+        del types, values
+        best = {tokenize_lazy: float('inf'), tokenize_with_offsets: float('inf')}
+        for _ in range(repeat):
+            for func in best:
+                start = time.perf_counter()
+                result = func(text)
+                best[func] = min(best[func], time.perf_counter() - start)
+                # освобождение токенов не попадает в замер
+                del result
+        lazy, stored = best.values()
+        print(f'{size_mb:>6} MB: lazy offsets {lazy:7.3f} s, stored offsets {stored:7.3f} s, '
+              f'storing costs {(stored / lazy - 1) * 100:+5.1f}%')
+
+
+def generate_template_config(count):
+    # Конфигурация из шаблона: одни и те же выражения над одними и теми же массивами
+    ports = ', '.join(str(i * 7919 % 65536) for i in range(1000))
+    parts = [f'var ports := [{ports}]\n']
+    for i in range(count):
+        parts.append(f'var sorted_{i} := {{ ports sort() }}\n'
+                     f'var first_{i} := {{ ports sort() 0 index() }}\n'
+                     f'var last_{i} := {{ ports sort() {i % 1000} index() }}\n')
+    return ''.join(parts)
+
+
+def bench_expressions(counts):
+    for count in counts:
+        text = generate_template_config(count)
+        parser = ConfigParser()
+        start = time.perf_counter()
+        parser.parse(text)
+        elapsed = time.perf_counter() - start
+        stats = ', '.join(f'{name} {value}' for name, value in parser.cache_info().items())
+        print(f'{count:>8} templates: {elapsed:7.3f} s ({stats})')
+
+
+def generate_array_config(size):
+    # Конфигурация из больших массивов целых и их сортировок
+    parts = []
+    total = 0
+    i = 0
+    while total < size:
+        items = ', '.join(str(j * 7919 % 100003) for j in range(i * 1000, i * 1000 + 5000))
+        block = f'var table_{i} := [{items}]\nvar sorted_{i} := {{ table_{i} sort() }}\n'
+        parts.append(block)
+        total += len(block)
+        i += 1
+    return ''.join(parts)
+
+
+def bench_output(sizes):
+    for size_mb in sizes:
+        result = ConfigParser().parse(generate_array_config(int(size_mb * MB)))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.json')
+            start = time.perf_counter()
+            with open(path, 'w') as f:
+                json.dump(result, f, indent=2, default=json_default)
+            line = f'{size_mb:>6} MB: json.dump {time.perf_counter() - start:7.3f} s'
+            for output_format in OUTPUT_FORMATS:
+                start = time.perf_counter()
+                with open(path, 'w', buffering=OUTPUT_BUFFER_SIZE) as f:
+                    write_json_stream(result, f, output_format)
+                line += f', {output_format} {time.perf_counter() - start:7.3f} s'
+        print(line)
+
+
+class RecursiveConfigParser(ConfigParser):
+    # Прежний разбор значений: рекурсия на каждый уровень вложенности массивов
+
+    def parse_value(self):
+        kind = self.types[self.position]
+        if kind == NUMBER:
+            return self.consume(NUMBER)
+        elif kind == LBRACK:
+            return self.parse_array()
+        elif kind == LBRACE:
+            return self.parse_expression()
+        else:
+            raise SyntaxError(f'Expected value, got {self.token_repr(self.position)}')
+
+    def parse_array(self):
+        self.expect(LBRACK)
+        items = []
+        while self.types[self.position] != RBRACK:
+            value = self.parse_value()
+            items.append(value)
+            if self.types[self.position] == COMMA:
+                self.consume(COMMA)
+            else:
+                break
+        self.expect(RBRACK)
+        return ArrayValue.from_items(items)
+
+
+def generate_nested_config(depth, width, count):
+    # count объявлений: массив глубины depth, на каждом уровне width чисел
+    numbers = ', '.join(str(i) for i in range(width))
+    value = '[' * depth + numbers + ']' * depth
+    return ''.join(f'var nested_{i} := {value}\n' for i in range(count))
+
+
+def bench_nesting(cases):
+    for name, depth, width, count in cases:
+        text = generate_nested_config(depth, width, count)
+        line = f'{name:>5} (depth {depth:>6}, width {width:>5}, x{count:>5}):'
+        for label, parser_class in (('iterative', ConfigParser), ('recursive', RecursiveConfigParser)):
+            parser = parser_class()
+            parser.tokenize(text)
+            start = time.perf_counter()
+            try:
+                parser.parse_statements()
+                line += f' {label} {time.perf_counter() - start:7.3f} s'
+            except RecursionError:
+                line += f' {label} RecursionError'
+        print(line)
+
+
+def bench_tokenize(sizes, legacy):
+    for size_mb in sizes:
+        text = generate_config(int(size_mb * MB))
+        parser = ConfigParser()
+        start = time.perf_counter()
+        parser.tokenize(text)
+        elapsed = time.perf_counter() - start
+        line = (f'{size_mb:>6} MB: {len(parser.types):>10} tokens, '
+                f'{elapsed:7.3f} s, {len(text) / MB / elapsed:6.1f} MB/s')
+        if legacy:
+            start = time.perf_counter()
+            legacy_tokenize(text)
+            line += f', legacy {time.perf_counter() - start:7.3f} s'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ConfigParser benchmarks')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 10, 100], help='Input sizes in MB')
+    parser.add_argument('--legacy', action='store_true', help='Also time the previous tokenizer')
+    parser.add_argument('--offsets', action='store_true', help='Compare lazy token offsets with storing an offset per token')
+    parser.add_argument('--expressions', type=int, nargs='*',
+                        help='Time repeated template expressions (counts of template blocks)')
+    parser.add_argument('--output', action='store_true', help='Time JSON output formats on large integer arrays')
+    parser.add_argument('--nesting', action='store_true',
+                        help='Compare iterative and recursive array parsing on deep and wide inputs')
+    args = parser.parse_args()
+    if args.nesting:
+        bench_nesting([('wide', 1, 5000, 200), ('mixed', 100, 50, 200), ('deep', 400, 1, 1000),
+                       ('deep', 5000, 1, 10), ('deep', 100000, 1, 1)])
+    elif args.output:
+        bench_output(args.sizes)
+    elif args.expressions is not None:
+        bench_expressions(args.expressions or [100, 1000, 10000])
+    elif args.offsets:
+        bench_offsets(args.sizes)
+    else:
+        bench_tokenize(args.sizes, args.legacy)
+
+
+if __name__ == '__main__':
+    main()
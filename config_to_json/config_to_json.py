@@ -1,187 +1,872 @@
+import os
 import re
 import json
 import sys
+import bisect
+import pickle
+import hashlib
+import operator
+from types import MappingProxyType
+from array import array
+from itertools import accumulate, chain
+
+
+# Комментарии. Блок (comment ...) главнее '#': он может начаться внутри строчного комментария
+# и закрыться на другой строке, после чего строчный комментарий продолжается до конца строки
+# (как прежнее удаление блоков, а затем '#', двумя проходами). Незакрытый '(comment' — обычный текст
+BLOCK_COMMENT_PATTERN = r'\(comment(?s:.*?)\)'
+LINE_COMMENT_PATTERN = r'#[^\n(]*(?:(?:%s|\()[^\n(]*)*' % BLOCK_COMMENT_PATTERN
+
+# Определение токенов. Код типа токена — номер группы в TOKEN_REGEX (mo.lastindex),
+# поэтому порядок констант ниже должен совпадать с порядком спецификации.
+TOKEN_SPECIFICATION = [
+    ('COMMENT', BLOCK_COMMENT_PATTERN + '|' + LINE_COMMENT_PATTERN),
+    ('NUMBER', r'\d+'),
+    ('VAR', r'var'),
+    ('IMPORT', r'import(?![a-zA-Z0-9_])'),
+    ('SORT', r'sort\(\)'),
+    ('INDEX', r'index\(\)'),
+    ('NAME', r'[a-zA-Z_][a-zA-Z0-9_]*'),
+    ('ASSIGN', r':='),
+    ('LBRACE', r'\{'),
+    ('RBRACE', r'\}'),
+    ('LBRACK', r'\['),
+    ('RBRACK', r'\]'),
+    ('COMMA', r','),
+    ('STRING', r'"[^"\n]*"'),
+    ('OP', r'[\+\-\*]'),
+    ('MISMATCH', r'[^ \t\n]'),
+]
+(COMMENT, NUMBER, VAR, IMPORT, SORT, INDEX, NAME, ASSIGN, LBRACE, RBRACE, LBRACK, RBRACK,
+ COMMA, STRING, OP, MISMATCH) = range(1, len(TOKEN_SPECIFICATION) + 1)
+TOKEN_NAMES = [None] + [name for name, _ in TOKEN_SPECIFICATION]
+# Пробелы съедаются префиксом, а не отдельным токеном
+TOKEN_REGEX = re.compile('[ \t\n]*(?:%s)' % '|'.join('(%s)' % pattern for _, pattern in TOKEN_SPECIFICATION))
+# Значения токенов с фиксированным текстом — общие строки вместо копии на каждый токен
+TOKEN_LITERALS = {VAR: 'var', IMPORT: 'import', SORT: 'sort()', INDEX: 'index()', ASSIGN: ':=', LBRACE: '{',
+                  RBRACE: '}', LBRACK: '[', RBRACK: ']', COMMA: ','}
+# Потоковый режим: размер читаемого куска и хвост буфера, токены в котором
+# могут продолжиться в следующем куске (длиннее самого длинного литерала)
+STREAM_CHUNK_SIZE = 1 << 20
+STREAM_MARGIN = 16
+
+
+# Инструкции скомпилированных выражений
+EXPR_CONST, EXPR_LOAD, EXPR_ADD, EXPR_SUB, EXPR_MUL, EXPR_SORT, EXPR_INDEX = range(7)
+EXPR_BINARY_OPS = {'+': EXPR_ADD, '-': EXPR_SUB, '*': EXPR_MUL}
+# Предел размера каждого кэша выражений; при переполнении кэш очищается целиком
+EXPRESSION_CACHE_SIZE = 4096
+
+
+class Expression:
+    """Скомпилированное выражение: инструкции (код, аргумент, номер токена) и имена переменных."""
+    __slots__ = ('code', 'names')
+
+    def __init__(self, code, names):
+        self.code = code
+        self.names = names
+
+
+# Число кусков, после которого массив при конкатенации собирается в один кусок,
+# чтобы индексирование оставалось дешёвым
+ARRAY_MAX_CHUNKS = 32
+# Минимальная длина массива целых, начиная с которой он упаковывается в array('q'):
+# для коротких массивов проверка и упаковка дороже выигрыша в памяти
+ARRAY_PACK_MIN = 64
+
+
+def array_storage(items):
+    # Длинные массивы целых в пределах int64 хранятся в array('q'), остальное — в кортеже
+    if len(items) >= ARRAY_PACK_MIN and all(type(item) is int for item in items):
+        try:
+            return array('q', items)
+        except OverflowError:
+            pass
+    return tuple(items)
+
+
+class ArrayValue:
+    """Неизменяемый массив значений конфигурации.
+
+    Элементы хранятся кусками: конкатенация и повторение разделяют куски операндов
+    вместо копирования, отсортированный вид вычисляется один раз и запоминается.
+    """
+    __slots__ = ('chunks', 'length', 'starts', 'sorted_view')
+
+    def __init__(self, chunks=()):
+        self.chunks = chunks
+        self.length = sum(map(len, chunks))
+        self.starts = None
+        self.sorted_view = None
+
+    @classmethod
+    def from_items(cls, items):
+        return cls((array_storage(items),) if items else ())
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return chain.from_iterable(self.chunks)
+
+    def __getitem__(self, index):
+        if type(index) is not int:
+            raise TypeError('array indices must be integers')
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('array index out of range')
+        if len(self.chunks) == 1:
+            return self.chunks[0][index]
+        if self.starts is None:
+            self.starts = list(accumulate(map(len, self.chunks), initial=0))
+        chunk = bisect.bisect_right(self.starts, index) - 1
+        return self.chunks[chunk][index - self.starts[chunk]]
+
+    def __add__(self, other):
+        if not isinstance(other, ArrayValue):
+            return NotImplemented
+        return self.joined(self.chunks + other.chunks)
+
+    def __mul__(self, count):
+        if type(count) is not int:
+            return NotImplemented
+        return self.joined(self.chunks * max(count, 0))
+
+    __rmul__ = __mul__
+
+    @classmethod
+    def joined(cls, chunks):
+        if len(chunks) > ARRAY_MAX_CHUNKS:
+            return cls.from_items(list(chain.from_iterable(chunks)))
+        return cls(chunks)
+
+    def sorted(self):
+        if self.sorted_view is None:
+            view = ArrayValue.from_items(sorted(self))
+            view.sorted_view = view
+            self.sorted_view = view
+        return self.sorted_view
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if not isinstance(other, (ArrayValue, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(map(operator.eq, self, other))
+
+    def __lt__(self, other):
+        if not isinstance(other, ArrayValue):
+            return NotImplemented
+        return tuple(self) < tuple(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'ArrayValue({list(self)!r})'
+
+
+# Предел вложенности массивов по умолчанию
+DEFAULT_MAX_DEPTH = 100000
+# Форматы вывода: pretty (по умолчанию, как json.dump(..., indent=2)), compact и NDJSON
+FORMAT_PRETTY, FORMAT_COMPACT, FORMAT_NDJSON = 'pretty', 'compact', 'ndjson'
+OUTPUT_FORMATS = (FORMAT_PRETTY, FORMAT_COMPACT, FORMAT_NDJSON)
+COMPACT_SEPARATORS = (',', ':')
+# Буфер записи выходного файла
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+def json_default(obj):
+    # Массивы сериализуются как списки, поэтому вывод совпадает с прежним побайтно
+    if isinstance(obj, ArrayValue):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def located(exc_type, message, offset, token_index=0):
+    # Исключение с позицией в исходном тексте: смещение, с которого шёл разбор, и номер токена от него.
+    # Точное смещение токена, строка и столбец вычисляются только при выводе ошибки
+    exc = exc_type(message)
+    exc.source_offset = offset
+    exc.token_index = token_index
+    return exc
+
+
+class SourceMap:
+    """Перевод позиций ошибок в (строка, столбец) бинарным поиском по индексу переводов строк.
+
+    Индекс строится лениво — при первой ошибке, поэтому лексер за него не платит.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.newlines = None
+
+    def token_offset(self, offset, token_index):
+        # Повторный лексический разбор от известного смещения до нужного токена
+        for mo in TOKEN_REGEX.finditer(self.text, offset):
+            kind = mo.lastindex
+            if kind == COMMENT:
+                continue
+            if not token_index:
+                return mo.start(kind)
+            token_index -= 1
+        return len(self.text)
+
+    def locate(self, offset):
+        if self.newlines is None:
+            self.newlines = array('Q', (mo.start() for mo in re.finditer('\n', self.text)))
+        line = bisect.bisect_left(self.newlines, offset)
+        start = self.newlines[line - 1] + 1 if line else 0
+        end = self.newlines[line] if line < len(self.newlines) else len(self.text)
+        return line + 1, offset - start + 1, self.text[start:end]
+
+    def format_error(self, exc, filename='<input>'):
+        offset = getattr(exc, 'source_offset', None)
+        if offset is None:
+            return str(exc)
+        offset = self.token_offset(offset, exc.token_index)
+        line, column, source_line = self.locate(offset)
+        caret = ''.join(c if c == '\t' else ' ' for c in source_line[:column - 1]) + '^'
+        return f'{filename}:{line}:{column}: {exc}\n    {source_line}\n    {caret}'
+
+
+def open_block_comment(buffer, start, end):
+    # В строчном комментарии есть '(comment' без закрывающей скобки в буфере
+    block = buffer.rfind('(comment', start, end)
+    return block >= 0 and buffer.find(')', block) < 0
+
+
+def iter_token_groups(chunks, base=0):
+    # Лексер по кускам текста. Выдаёт токены объявлений группами (типы, значения, смещение):
+    # группа заканчивается перед следующим 'var' или в конце текста,
+    # смещение — позиция первого токена группы в тексте (base — смещение первого куска)
+    buffer = ''
+    chunks = iter(chunks)
+    eof = False
+    literals = TOKEN_LITERALS
+    types = array('B')
+    values = []
+    group_offset = base
+    while not eof:
+        chunk = next(chunks, '')
+        eof = not chunk
+        buffer += chunk
+        limit = len(buffer) - (0 if eof else STREAM_MARGIN)
+        pos = 0
+        for mo in TOKEN_REGEX.finditer(buffer):
+            kind = mo.lastindex
+            if not eof and (mo.end() > limit
+                            or kind == MISMATCH and (buffer.startswith('(comment', mo.start(kind))
+                                                     or buffer[mo.start(kind)] == '"'
+                                                     and '\n' not in buffer[mo.start(kind):])
+                            or kind == COMMENT and buffer[mo.start(kind)] == '#'
+                            and open_block_comment(buffer, mo.start(kind), mo.end())):
+                # Токен, незакрытый комментарий или строка может продолжиться в следующем куске
+                break
+            pos = mo.end()
+            if kind == COMMENT:
+                continue
+            if kind == NUMBER:
+                values.append(int(mo.group(kind)))
+            elif kind == NAME or kind == OP:
+                values.append(mo.group(kind))
+            elif kind == STRING:
+                values.append(mo.group(kind)[1:-1])
+            elif kind == MISMATCH:
+                raise located(SyntaxError, f'Unexpected character {mo.group(kind)!r}', base + mo.start(kind))
+            else:
+                if kind == VAR and types:
+                    yield types, values, group_offset
+                    types = array('B')
+                    values = []
+                    group_offset = base + mo.start(kind)
+                values.append(literals[kind])
+            types.append(kind)
+        buffer = buffer[pos:]
+        base += pos
+    if types:
+        yield types, values, group_offset
+
+
+def array_pieces(value, separator):
+    # Части массива для вывода: готовый текст для кусков из целых (одним join) или элементы
+    for chunk in value.chunks:
+        if type(chunk) is array or all(type(item) is int for item in chunk):
+            yield separator.join(map(str, chunk))
+        else:
+            yield from chunk
+
+
+def encode_pretty(value, indent, parts):
+    # Дописывает в parts текст значения в том же виде, что json.dump(..., indent=2);
+    # indent — отступ строки, на которой значение начинается (None — компактный вывод).
+    # Вложенные массивы обходятся с явным стеком, как и при разборе
+    frames = []
+    while True:
+        if isinstance(value, ArrayValue):
+            if not value.length:
+                parts.append('[]')
+            elif indent is None:
+                parts.append('[')
+                frames.append([array_pieces(value, ','), None, ',', True])
+            else:
+                inner = indent + '  '
+                separator = ',\n' + inner
+                parts.append('[\n' + inner)
+                frames.append([array_pieces(value, separator), indent, separator, True])
+        elif type(value) is str:
+            # готовый текст куска целых
+            parts.append(value)
+        elif type(value) is int:
+            parts.append(str(value))
+        else:
+            parts.append(json.dumps(value, default=json_default))
+        while frames:
+            frame = frames[-1]
+            value = next(frame[0], None)
+            if value is not None:
+                if not frame[3]:
+                    parts.append(frame[2])
+                frame[3] = False
+                indent = None if frame[1] is None else frame[1] + '  '
+                break
+            parts.append(']' if frame[1] is None else '\n' + frame[1] + ']')
+            frames.pop()
+        else:
+            return
+
+
+def pretty_statement(stmt):
+    # Объявление с отступом элемента массива верхнего уровня
+    parts = ['{\n    "var": ', json.dumps(stmt['var']), ',\n    "value": ']
+    encode_pretty(stmt['value'], '    ', parts)
+    parts.append('\n  }')
+    return ''.join(parts)
+
+
+def compact_statement(stmt):
+    # C-кодировщик рекурсивен; слишком глубокие массивы выводятся без рекурсии
+    try:
+        return json.dumps(stmt, separators=COMPACT_SEPARATORS, default=json_default)
+    except RecursionError:
+        parts = ['{"var":', json.dumps(stmt['var']), ',"value":']
+        encode_pretty(stmt['value'], None, parts)
+        parts.append('}')
+        return ''.join(parts)
+
+
+def write_json_stream(statements, f, output_format=FORMAT_PRETTY):
+    """Записывает объявления по мере поступления в выбранном формате.
+
+    pretty побайтно совпадает с json.dump(statements, f, indent=2), compact — с json.dump
+    с разделителями без пробелов (C-кодировщик), ndjson — по объявлению в строке.
+    """
+    if output_format == FORMAT_NDJSON:
+        for stmt in statements:
+            f.write(compact_statement(stmt))
+            f.write('\n')
+        return
+    f.write('[')
+    if output_format == FORMAT_COMPACT:
+        separator = ''
+        for stmt in statements:
+            f.write(separator)
+            f.write(compact_statement(stmt))
+            separator = ','
+        f.write(']')
+        return
+    separator = '\n  '
+    for stmt in statements:
+        f.write(separator)
+        f.write(pretty_statement(stmt))
+        separator = ',\n  '
+    f.write(']' if separator == '\n  ' else '\n]')
+
+
+class Module:
+    """Импортированный модуль: замороженные переменные и отпечаток.
+
+    Отпечаток — хэш текста вместе с отпечатками модулей, которые импортирует сам модуль.
+    """
+    __slots__ = ('path', 'variables', 'digest')
+
+    def __init__(self, path, variables, digest):
+        self.path = path
+        self.variables = MappingProxyType(variables)
+        self.digest = digest
+
+
+class ModuleStore:
+    """Модули процесса: каждый файл разбирается один раз, а его переменные разделяются
+    всеми импортирующими файлами.
+
+    Если задан cache_dir, вычисленные переменные сохраняются на диск под хэшем абсолютного
+    пути и текста модуля и при следующих запусках загружаются без разбора. Путь входит в ключ:
+    импорты разрешаются относительно каталога модуля, и одинаковые тексты в разных каталогах
+    импортируют разные файлы.
+    """
+    CACHE_VERSION = 2
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.modules = {}
+        # Модули, которые сейчас разбираются, — для обнаружения циклов импорта
+        self.loading = []
+
+    def load(self, path, importer=None):
+        # importer — файл верхнего уровня, который сам не загружается через хранилище,
+        # но участвует в обнаружении циклов
+        if importer is not None and not self.loading:
+            self.loading.append(os.path.abspath(importer))
+            try:
+                return self.load(path)
+            finally:
+                self.loading.pop()
+        path = os.path.abspath(path)
+        if path in self.loading:
+            cycle = ' -> '.join(self.loading[self.loading.index(path):] + [path])
+            raise ImportError(f'Import cycle: {cycle}')
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime_ns)
+        cached = self.modules.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        self.loading.append(path)
+        try:
+            module = self._load(path)
+        finally:
+            self.loading.pop()
+        self.modules[path] = (key, module)
+        return module
+
+    def _load(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        content_hash = hashlib.blake2b(data, digest_size=16).digest()
+        cache_key = hashlib.blake2b(path.encode('utf-8', 'surrogateescape') + b'\0' + content_hash,
+                                    digest_size=16).digest()
+        cached = self._read_cache(cache_key)
+        if cached is not None:
+            imports, variables = cached
+            # Запись годится, только если модули, которые она импортировала, не изменились
+            if all(self.load(import_path).digest == digest for import_path, digest in imports):
+                return Module(path, variables, self._digest(content_hash, imports))
+        text = data.decode('utf-8')
+        parser = ConfigParser(path=path)
+        try:
+            parser.parse(text)
+        except Exception as e:
+            raise ImportError(SourceMap(text).format_error(e, path).split('\n')[0]) from e
+        imports = [(module.path, module.digest) for module in parser.imports]
+        self._write_cache(cache_key, imports, parser.variables)
+        return Module(path, parser.variables, self._digest(content_hash, imports))
+
+    @staticmethod
+    def _digest(content_hash, imports):
+        return hashlib.blake2b(content_hash + b''.join(digest for _, digest in imports), digest_size=16).digest()
+
+    def _cache_path(self, cache_key):
+        return os.path.join(self.cache_dir, cache_key.hex() + '.module')
+
+    def _read_cache(self, cache_key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(cache_key), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if entry.get('version') != self.CACHE_VERSION:
+            return None
+        return entry['imports'], entry['variables']
+
+    def _write_cache(self, cache_key, imports, variables):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(cache_key)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({'version': self.CACHE_VERSION, 'imports': imports, 'variables': variables}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+
+# Модули, общие для всех парсеров процесса
+MODULES = ModuleStore()
 
 
 class ConfigParser:
-    def __init__(self):
+    def __init__(self, max_depth=DEFAULT_MAX_DEPTH, path=None):
         self.variables = {}
-        self.tokens = []
+        self.max_depth = max_depth
+        # Путь разбираемого файла (для импортов) и импортированные модули
+        self.path = path
+        self.imports = []
+        # Токены хранятся в параллельных массивах: коды типов и значения.
+        # Смещения токенов не хранятся: для диагностики достаточно смещения начала
+        # разобранного текста и номера токена, точная позиция восстанавливается при ошибке
+        self.types = array('B')
+        self.values = []
+        self.base_offset = 0
         self.position = 0
+        # Кэши выражений: скомпилированные выражения по тексту и результаты по версиям
+        # переменных (версия меняется при каждом присваивании)
+        self.version = 0
+        self.versions = {}
+        self.expressions = {}
+        self.results = {}
+        self.compile_hits = self.compile_misses = 0
+        self.eval_hits = self.eval_misses = 0
+        # Если задано множество, в него собираются имена переменных из разобранных выражений
+        self.references = None
 
     def parse(self, text):
         self.tokenize(text)
         return self.parse_statements()
 
     def tokenize(self, text):
-        # Удаление комментариев
-        text = self.remove_comments(text)
-        # Определение токенов
-        token_specification = [
-            ('NUMBER', r'\d+'),
-            ('VAR', r'var'),
-            ('SORT', r'sort\(\)'),
-            ('INDEX', r'index\(\)'),
-            ('NAME', r'[a-zA-Z_][a-zA-Z0-9_]*'),
-            ('ASSIGN', r':='),
-            ('LBRACE', r'\{'),
-            ('RBRACE', r'\}'),
-            ('LBRACK', r'\['),
-            ('RBRACK', r'\]'),
-            ('COMMA', r','),
-            ('OP', r'[\+\-\*]'),
-            ('SKIP', r'[ \t\n]+'),
-            ('MISMATCH', r'.'),
-        ]
-        tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in token_specification)
-        self.tokens = []
-        for mo in re.finditer(tok_regex, text):
-            kind = mo.lastgroup
-            value = mo.group()
-            if kind == 'NUMBER':
-                value = int(value)
-            elif kind == 'SKIP':
+        types = array('B')
+        values = []
+        add_type = types.append
+        add_value = values.append
+        literals = TOKEN_LITERALS
+        for mo in TOKEN_REGEX.finditer(text):
+            kind = mo.lastindex
+            if kind == COMMENT:
                 continue
-            elif kind == 'MISMATCH':
-                raise SyntaxError(f'Unexpected character {value!r}')
-            self.tokens.append({'type': kind, 'value': value})
+            if kind == NUMBER:
+                add_value(int(mo.group(kind)))
+            elif kind == NAME or kind == OP:
+                add_value(mo.group(kind))
+            elif kind == STRING:
+                add_value(mo.group(kind)[1:-1])
+            elif kind == MISMATCH:
+                raise located(SyntaxError, f'Unexpected character {mo.group(kind)!r}', mo.start(kind))
+            else:
+                add_value(literals[kind])
+            add_type(kind)
+        self.types = types
+        self.values = values
+        self.base_offset = 0
+
+    def parse_stream(self, chunks):
+        """Разбирает текст, поступающий кусками, и выдаёт объявления по одному.
+
+        В памяти держатся только токены текущего объявления.
+        """
+        for types, values, offset in iter_token_groups(chunks):
+            self.types, self.values, self.base_offset, self.position = types, values, offset, 0
+            while self.position < len(self.types):
+                stmt = self.parse_statement()
+                if stmt is not None:
+                    yield stmt
+
+    def token_repr(self, position):
+        return f'{TOKEN_NAMES[self.types[position]]} {self.values[position]!r}'
 
-    def remove_comments(self, text):
-        # Удаление многострочных комментариев
-        text = re.sub(r'\(comment.*?\)', '', text, flags=re.DOTALL)
-        # Удаление однострочных комментариев
-        text = re.sub(r'#.*', '', text)
-        return text
+    def error(self, exc_type, message, position=None):
+        # Ошибка, привязанная к токену; за концом ввода — к последнему токену
+        if position is None:
+            position = self.position
+        position = max(min(position, len(self.types) - 1), 0)
+        return located(exc_type, message, self.base_offset, position)
 
     def parse_statements(self):
         statements = []
-        while self.position < len(self.tokens):
+        while self.position < len(self.types):
             stmt = self.parse_statement()
             if stmt is not None:
                 statements.append(stmt)
         return statements
 
     def parse_statement(self):
-        token = self.tokens[self.position]
-        if token['type'] == 'VAR':
+        kind = self.types[self.position]
+        if kind == VAR:
             return self.parse_var_declaration()
+        elif kind == IMPORT:
+            return self.parse_import()
         else:
-            raise SyntaxError(f'Unexpected token {token}')
+            raise self.error(SyntaxError, f'Unexpected token {self.token_repr(self.position)}')
+
+    def parse_import(self):
+        # import "file.conf": переменные модуля становятся видны в текущем файле;
+        # путь отсчитывается от каталога импортирующего файла
+        self.expect(IMPORT)
+        position = self.position
+        target = self.expect(STRING)
+        base = os.path.dirname(self.path) if self.path else ''
+        try:
+            module = MODULES.load(os.path.join(base, target), self.path)
+        except (OSError, ImportError) as e:
+            raise self.error(ImportError, f'Cannot import {target!r}: {e}', position)
+        self.imports.append(module)
+        for name, value in module.variables.items():
+            self.assign(name, value)
+        return None
 
     def parse_var_declaration(self):
-        self.expect('VAR')
-        name = self.expect('NAME')['value']
-        self.expect('ASSIGN')
+        self.expect(VAR)
+        name = self.expect(NAME)
+        self.expect(ASSIGN)
         value = self.parse_value()
-        self.variables[name] = value
+        self.assign(name, value)
         return {'var': name, 'value': value}
 
+    def assign(self, name, value):
+        self.variables[name] = value
+        self.version += 1
+        self.versions[name] = self.version
+
     def parse_value(self):
-        token = self.tokens[self.position]
-        if token['type'] == 'NUMBER':
-            return self.consume('NUMBER')['value']
-        elif token['type'] == 'LBRACK':
-            return self.parse_array()
-        elif token['type'] == 'LBRACE':
-            return self.parse_expression()
-        else:
-            raise SyntaxError(f'Expected value at position {self.position}')
-
-    def parse_array(self):
-        self.expect('LBRACK')
-        array = []
-        while self.tokens[self.position]['type'] != 'RBRACK':
-            value = self.parse_value()
-            array.append(value)
-            if self.tokens[self.position]['type'] == 'COMMA':
-                self.consume('COMMA')
+        # Массивы разбираются без рекурсии: элементы незакрытых массивов лежат на явном стеке,
+        # поэтому глубина вложенности ограничена только памятью и self.max_depth
+        types = self.types
+        count = len(types)
+        stack = []
+        while True:
+            if self.position >= count:
+                raise self.error(SyntaxError, 'Unexpected end of input, expected value')
+            kind = types[self.position]
+            if kind == NUMBER:
+                value = self.values[self.position]
+                self.position += 1
+            elif kind == LBRACE:
+                value = self.parse_expression()
+            elif kind == LBRACK:
+                if len(stack) >= self.max_depth:
+                    raise self.error(SyntaxError, f'Array nesting exceeds maximum depth {self.max_depth}')
+                self.position += 1
+                if self.position < count and types[self.position] == RBRACK:
+                    self.position += 1
+                    value = ArrayValue()
+                else:
+                    stack.append([])
+                    continue
             else:
-                break
-        self.expect('RBRACK')
-        return array
+                raise self.error(SyntaxError, f'Expected value, got {self.token_repr(self.position)}')
+            # Значение готово: добавляем его в массив и закрываем завершившиеся массивы
+            while stack:
+                stack[-1].append(value)
+                if self.position < count and types[self.position] == COMMA:
+                    self.position += 1
+                    if self.position >= count or types[self.position] != RBRACK:
+                        break
+                self.expect(RBRACK)
+                value = ArrayValue.from_items(stack.pop())
+            else:
+                return value
 
     def parse_expression(self):
-        self.expect('LBRACE')
+        # Выражение компилируется один раз на каждый различный текст, а результат
+        # запоминается по (выражение, версии переменных, на которые оно ссылается)
+        start = self.position
+        self.expect(LBRACE)
+        types = self.types
+        try:
+            end = types.index(RBRACE, self.position)
+        except ValueError:
+            end = len(types)
+        key = (types[self.position:end].tobytes(), tuple(self.values[self.position:end]))
+        expression = self.expressions.get(key)
+        if expression is None:
+            self.compile_misses += 1
+            expression = self.compile_expression(start, end)
+            if len(self.expressions) >= EXPRESSION_CACHE_SIZE:
+                self.expressions.clear()
+            self.expressions[key] = expression
+        else:
+            self.compile_hits += 1
+        self.position = end
+        self.expect(RBRACE)
+        if self.references is not None:
+            self.references.update(expression.names)
+        versions = self.versions
+        memo_key = (expression, tuple([versions.get(name) for name in expression.names]))
+        try:
+            value = self.results[memo_key]
+        except KeyError:
+            self.eval_misses += 1
+            value = self.evaluate(expression, start + 1)
+            if len(self.results) >= EXPRESSION_CACHE_SIZE:
+                self.results.clear()
+            self.results[memo_key] = value
+        else:
+            self.eval_hits += 1
+        return value
+
+    def compile_expression(self, start, end):
+        # Перевод постфиксной записи в список инструкций с проверкой глубины стека,
+        # поэтому ошибки вроде нехватки операндов находятся до вычисления
+        code = []
+        names = []
+        depth = 0
+        types = self.types
+        values = self.values
+        for position in range(start + 1, end):
+            kind = types[position]
+            if kind == NUMBER:
+                code.append((EXPR_CONST, values[position], position - start - 1))
+                depth += 1
+                continue
+            if kind == NAME:
+                name = values[position]
+                code.append((EXPR_LOAD, name, position - start - 1))
+                if name not in names:
+                    names.append(name)
+                depth += 1
+                continue
+            if kind == OP:
+                opcode, operands = EXPR_BINARY_OPS[values[position]], 2
+            elif kind == SORT:
+                opcode, operands = EXPR_SORT, 1
+            elif kind == INDEX:
+                opcode, operands = EXPR_INDEX, 2
+            else:
+                raise self.error(SyntaxError, f'Unexpected token {self.token_repr(position)}', position)
+            if depth < operands:
+                raise self.error(SyntaxError, f'Not enough operands for {self.token_repr(position)}', position)
+            code.append((opcode, None, position - start - 1))
+            depth -= operands - 1
+        if end < len(types) and depth != 1:
+            raise self.error(SyntaxError, 'Invalid expression', start)
+        return Expression(tuple(code), tuple(names))
+
+    def evaluate(self, expression, base):
+        # base — номер первого токена выражения: по нему ошибки привязываются к токенам
         stack = []
-        while self.tokens[self.position]['type'] != 'RBRACE':
-            token = self.tokens[self.position]
-            if token['type'] == 'NUMBER':
-                stack.append(self.consume('NUMBER')['value'])
-            elif token['type'] == 'NAME':
-                name = self.consume('NAME')['value']
-                value = self.variables.get(name)
+        push = stack.append
+        pop = stack.pop
+        for opcode, argument, offset in expression.code:
+            if opcode == EXPR_CONST:
+                push(argument)
+            elif opcode == EXPR_LOAD:
+                value = self.variables.get(argument)
                 if value is None:
-                    raise NameError(f'Undefined variable {name}')
-                stack.append(value)
-            elif token['type'] == 'OP':
-                op = self.consume('OP')['value']
-                b = stack.pop()
-                a = stack.pop()
-                if op == '+':
-                    result = a + b
-                elif op == '-':
-                    result = a - b
-                elif op == '*':
-                    result = a * b
-                stack.append(result)
-            elif token['type'] == 'SORT':
-                self.consume('SORT')
-                array = stack.pop()
-                if isinstance(array, list):
-                    stack.append(sorted(array))
-                else:
-                    raise TypeError('sort() can only be applied to arrays')
-            elif token['type'] == 'INDEX':
-                self.consume('INDEX')
-                index = stack.pop()
-                array = stack.pop()
-                if isinstance(array, list) and isinstance(index, int):
-                    try:
-                        stack.append(array[index])
-                    except IndexError:
-                        raise IndexError(f'Index {index} out of range')
-                else:
-                    raise TypeError('index() requires an array and an integer index')
+                    raise self.error(NameError, f'Undefined variable {argument}', base + offset)
+                push(value)
+            elif opcode == EXPR_SORT:
+                array = pop()
+                if not isinstance(array, ArrayValue):
+                    raise self.error(TypeError, 'sort() can only be applied to arrays', base + offset)
+                push(array.sorted())
+            elif opcode == EXPR_INDEX:
+                index = pop()
+                array = pop()
+                if not (isinstance(array, ArrayValue) and isinstance(index, int)):
+                    raise self.error(TypeError, 'index() requires an array and an integer index', base + offset)
+                try:
+                    push(array[index])
+                except IndexError:
+                    raise self.error(IndexError, f'Index {index} out of range', base + offset)
             else:
-                raise SyntaxError(f'Unexpected token {token}')
-        self.expect('RBRACE')
-        if len(stack) != 1:
-            raise SyntaxError('Invalid expression')
+                b = pop()
+                a = pop()
+                try:
+                    if opcode == EXPR_ADD:
+                        push(a + b)
+                    elif opcode == EXPR_SUB:
+                        push(a - b)
+                    else:
+                        push(a * b)
+                except TypeError as e:
+                    raise self.error(TypeError, str(e), base + offset)
         return stack[0]
 
+    def cache_info(self):
+        return {'compile_hits': self.compile_hits, 'compile_misses': self.compile_misses,
+                'eval_hits': self.eval_hits, 'eval_misses': self.eval_misses}
+
     def expect(self, token_type):
-        if self.position >= len(self.tokens):
-            raise SyntaxError(f'Unexpected end of input, expected {token_type}')
-        token = self.tokens[self.position]
-        if token['type'] == token_type:
+        if self.position >= len(self.types):
+            raise self.error(SyntaxError, f'Unexpected end of input, expected {TOKEN_NAMES[token_type]}')
+        if self.types[self.position] == token_type:
             self.position += 1
-            return token
+            return self.values[self.position - 1]
         else:
-            raise SyntaxError(f'Expected token {token_type}, got {token}')
+            raise self.error(SyntaxError, f'Expected token {TOKEN_NAMES[token_type]}, '
+                                          f'got {self.token_repr(self.position)}')
 
     def consume(self, token_type):
         return self.expect(token_type)
 
 
+def convert_stream(input_path, output_path, config_parser=None, output_format=FORMAT_PRETTY):
+    if config_parser is None:
+        config_parser = ConfigParser(path=input_path)
+    tmp_path = output_path + '.tmp'
+    try:
+        with open(input_path, 'r') as src, open(tmp_path, 'w', buffering=OUTPUT_BUFFER_SIZE) as dst:
+            chunks = iter(lambda: src.read(STREAM_CHUNK_SIZE), '')
+            write_json_stream(config_parser.parse_stream(chunks), dst, output_format)
+        os.replace(tmp_path, output_path)
+        print('Conversion successful.')
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if hasattr(e, 'source_offset'):
+            with open(input_path, 'r') as f:
+                print(f'Error: {SourceMap(f.read()).format_error(e, input_path)}')
+        else:
+            print(f'Error: {e}')
+
+
+def convert(input_path, output_path, config_parser, output_format=FORMAT_PRETTY):
+    with open(input_path, 'r') as f:
+        text = f.read()
+    try:
+        result = config_parser.parse(text)
+        with open(output_path, 'w', buffering=OUTPUT_BUFFER_SIZE) as f:
+            write_json_stream(result, f, output_format)
+        print('Conversion successful.')
+    except Exception as e:
+        print(f'Error: {SourceMap(text).format_error(e, input_path)}')
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(description='Config to JSON converter')
     parser.add_argument('-i', '--input', required=True, help='Input config file')
     parser.add_argument('-o', '--output', required=True, help='Output JSON file')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read the input in chunks and write each declaration as soon as it is parsed')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Keep a per-declaration cache next to the output and re-evaluate only '
+                             'declarations affected by edits')
+    parser.add_argument('--cache-stats', action='store_true',
+                        help='Print expression cache hit/miss counters to stderr')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default=FORMAT_PRETTY,
+                        help='Output format: indented JSON (default), compact JSON or one declaration per line')
+    parser.add_argument('--max-depth', type=int, default=DEFAULT_MAX_DEPTH,
+                        help='Maximum array nesting depth')
+    parser.add_argument('--module-cache', help='Directory for evaluated imported modules, keyed by path and content hash')
     args = parser.parse_args()
+    if args.incremental and args.format != FORMAT_PRETTY:
+        parser.error('--incremental supports only the pretty format')
 
-    with open(args.input, 'r') as f:
-        text = f.read()
-
-    config_parser = ConfigParser()
-    try:
-        result = config_parser.parse(text)
-        with open(args.output, 'w') as f:
-            json.dump(result, f, indent=2)
-        print('Conversion successful.')
-    except Exception as e:
-        print(f'Error: {e}')
+    MODULES.cache_dir = args.module_cache
+    config_parser = ConfigParser(args.max_depth, args.input)
+    if args.incremental:
+        from incremental import convert_incremental
+        try:
+            evaluated, total = convert_incremental(args.input, args.output, config_parser)
+            print(f'Conversion successful ({evaluated} of {total} declarations evaluated).')
+        except Exception as e:
+            if hasattr(e, 'source_offset'):
+                with open(args.input, 'r') as f:
+                    print(f'Error: {SourceMap(f.read()).format_error(e, args.input)}')
+            else:
+                print(f'Error: {e}')
+    elif args.stream:
+        convert_stream(args.input, args.output, config_parser, args.format)
+    else:
+        convert(args.input, args.output, config_parser, args.format)
+    if args.cache_stats:
+        print(', '.join(f'{name} {count}' for name, count in config_parser.cache_info().items()), file=sys.stderr)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Значения сохраняются в кэши на диске через pickle, поэтому их классы должны
+    # принадлежать модулю config_to_json, а не __main__
+    import config_to_json
+    config_to_json.main()
\ No newline at end of file
@@ -0,0 +1,228 @@
+import os
+import re
+import pickle
+import hashlib
+
+from config_to_json import (OUTPUT_BUFFER_SIZE, BLOCK_COMMENT_PATTERN, LINE_COMMENT_PATTERN, iter_token_groups,
+                            pretty_statement)
+
+# Кэш объявлений хранится рядом с выходным файлом: <output>.cache
+CACHE_SUFFIX = '.cache'
+CACHE_VERSION = 2
+# Отпечаток переменной, которая ещё не объявлена
+UNDEFINED = b'\0' * 16
+# Начало объявления: 'var' вне комментариев и строк, перед которым нет символа имени. Такое
+# вхождение всегда начинает токен VAR; пропущенные правилом границы (например, '1var') лишь
+# объединяют несколько объявлений в один участок
+DECLARATION_REGEX = re.compile('%s|%s|"[^"\n]*"|(?<![A-Za-z0-9_])(var)'
+                               % (BLOCK_COMMENT_PATTERN, LINE_COMMENT_PATTERN))
+
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def iter_segments(text):
+    # Участки текста от одного начала объявления до следующего; лексический разбор не нужен
+    start = 0
+    for mo in DECLARATION_REGEX.finditer(text):
+        if mo.lastindex and mo.start() > start:
+            yield start, mo.start()
+            start = mo.start()
+    if start < len(text):
+        yield start, len(text)
+
+
+class DeclarationCache:
+    """Кэш участков исходного текста предыдущего запуска.
+
+    Для каждого участка хранятся хэш текста, имена переменных, на которые ссылаются его
+    выражения, отпечаток, объявления (имя, значение) и диапазон байт в выходном файле.
+    Отпечаток — хэш текста вместе с отпечатками объявлений, от которых участок зависит,
+    поэтому он меняется при изменении самого участка или любой его транзитивной зависимости.
+    """
+
+    def __init__(self, entries=(), output_stat=None):
+        self.entries = list(entries)
+        self.output_stat = output_stat
+        # Участки с импортами (deps is None) не переиспользуются
+        self.deps_by_source = {entry[0]: entry[1] for entry in self.entries if entry[1] is not None}
+        self.index_by_fingerprint = {entry[2]: i for i, entry in enumerate(self.entries)}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return cls()
+        if data.get('version') != CACHE_VERSION:
+            return cls()
+        return cls(data['entries'], data['output_stat'])
+
+    @staticmethod
+    def save(path, entries, output_stat):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': CACHE_VERSION, 'output_stat': output_stat, 'entries': entries}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+def output_stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def fingerprint(source_hash, deps, fingerprints):
+    return digest(source_hash + b''.join(fingerprints.get(name, UNDEFINED) for name in deps))
+
+
+def convert_incremental(input_path, output_path, config_parser):
+    """Преобразует конфигурацию, заново разбирая только изменённые объявления и зависящие от них.
+
+    Участки, отпечаток которых есть в кэше, не разбираются и не вычисляются: значения берутся
+    из кэша, а их JSON копируется из прежнего выходного файла, подряд идущие — одним куском.
+    Возвращает (число вычисленных объявлений, общее число объявлений).
+    """
+    cache_path = output_path + CACHE_SUFFIX
+    cache = DeclarationCache.load(cache_path)
+    # Прежний выход годится для копирования, только если он не менялся после записи кэша
+    old_output = None
+    if cache.entries and cache.output_stat == output_stat(output_path):
+        old_output = open(output_path, 'rb')
+
+    with open(input_path, 'r') as f:
+        text = f.read()
+    entries = []
+    # Отпечатки участков, в которых последний раз объявлена каждая переменная
+    fingerprints = {}
+    evaluated = total = 0
+    tmp_path = output_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb', buffering=OUTPUT_BUFFER_SIZE) as out:
+            writer = PatchWriter(out, old_output)
+            for start, end in iter_segments(text):
+                source_hash = digest(text[start:end].encode('utf-8'))
+                deps = cache.deps_by_source.get(source_hash)
+                old_index = None
+                if deps is not None:
+                    segment_fingerprint = fingerprint(source_hash, deps, fingerprints)
+                    old_index = cache.index_by_fingerprint.get(segment_fingerprint)
+                if old_index is not None:
+                    _, _, _, declarations, json_start, json_stop = cache.entries[old_index]
+                    for name, value in declarations:
+                        config_parser.assign(name, value)
+                    if old_output is None:
+                        json_start, json_stop = writer.write_all(declarations)
+                    elif declarations:
+                        json_start, json_stop = writer.copy(json_start, json_stop, len(declarations))
+                else:
+                    declarations = parse_segment(config_parser, text[start:end], start)
+                    evaluated += len(declarations)
+                    deps = tuple(sorted(config_parser.references))
+                    config_parser.references = None
+                    segment_fingerprint = fingerprint(source_hash, deps, fingerprints)
+                    json_start, json_stop = writer.write_all(declarations)
+                    if config_parser.imports:
+                        # Участок с импортами разбирается при каждом запуске (модули всё равно
+                        # загружаются из кэша), а его отпечаток учитывает содержимое модулей
+                        segment_fingerprint = digest(segment_fingerprint + b''.join(
+                            module.digest for module in config_parser.imports))
+                        for module in config_parser.imports:
+                            for name in module.variables:
+                                fingerprints[name] = segment_fingerprint
+                        deps = None
+                for name, _ in declarations:
+                    fingerprints[name] = segment_fingerprint
+                total += len(declarations)
+                entries.append((source_hash, deps, segment_fingerprint, declarations, json_start, json_stop))
+            writer.close()
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        if old_output is not None:
+            old_output.close()
+    DeclarationCache.save(cache_path, entries, output_stat(output_path))
+    return evaluated, total
+
+
+def parse_segment(config_parser, segment, start):
+    # Разбор участка; имена переменных из его выражений собираются в config_parser.references
+    config_parser.references = set()
+    config_parser.imports = []
+    declarations = []
+    for types, values, offset in iter_token_groups([segment], start):
+        config_parser.types, config_parser.values = types, values
+        config_parser.base_offset, config_parser.position = offset, 0
+        while config_parser.position < len(types):
+            stmt = config_parser.parse_statement()
+            if stmt is not None:
+                declarations.append((stmt['var'], stmt['value']))
+    return tuple(declarations)
+
+
+class PatchWriter:
+    """Запись JSON-массива объявлений, побайтно совпадающая с json.dump(..., indent=2).
+
+    Неизменённые объявления копируются из прежнего файла, подряд идущие — одним куском.
+    Методы записи возвращают диапазон байт записанных объявлений без начального разделителя.
+    """
+    SEPARATOR = b',\n  '
+
+    def __init__(self, out, old_output):
+        self.out = out
+        self.old_output = old_output
+        self.position = 0
+        self.count = 0
+        # Непрерывный участок прежнего файла, ожидающий копирования
+        self.run_start = self.run_end = None
+        self._write(b'[')
+
+    def _separator(self):
+        return self.SEPARATOR if self.count else b'\n  '
+
+    def _write(self, data):
+        self.out.write(data)
+        self.position += len(data)
+
+    def copy(self, start, stop, count):
+        if self.count and self.run_end is not None and start == self.run_end + len(self.SEPARATOR):
+            # Разделитель между соседними объявлениями в прежнем файле тот же
+            self.position += stop - self.run_end
+            self.run_end = stop
+        else:
+            self._flush_run()
+            self._write(self._separator())
+            self.run_start, self.run_end = start, stop
+            self.position += stop - start
+        self.count += count
+        return self.position - (stop - start), self.position
+
+    def write_all(self, declarations):
+        self._flush_run()
+        start = None
+        for name, value in declarations:
+            self._write(self._separator())
+            self.count += 1
+            if start is None:
+                start = self.position
+            self._write(pretty_statement({'var': name, 'value': value}).encode('utf-8'))
+        return start, self.position
+
+    def _flush_run(self):
+        if self.run_start is None:
+            return
+        self.old_output.seek(self.run_start)
+        self.out.write(self.old_output.read(self.run_end - self.run_start))
+        self.run_start = self.run_end = None
+
+    def close(self):
+        self._flush_run()
+        self._write(b'\n]' if self.count else b']')
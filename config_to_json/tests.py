@@ -1,5 +1,8 @@
+import io
+import os
 import json
-from config_to_json import ConfigParser
+import tempfile
+from config_to_json import ConfigParser, SourceMap, MODULES, json_default, write_json_stream
 
 
 def run_test(test_number, input_data, expected_output=None, expect_error=False):
@@ -25,7 +28,7 @@ def run_test(test_number, input_data, expected_output=None, expect_error=False):
                 print('Expected output:')
                 print(json.dumps(expected_output, indent=2))
                 print('Actual output:')
-                print(json.dumps(result, indent=2))
+                print(json.dumps(result, indent=2, default=json_default))
                 return False
         else:
             print(f'Test {test_number}: No expected output provided.')
@@ -41,8 +44,251 @@ def run_test(test_number, input_data, expected_output=None, expect_error=False):
             return False
 
 
+def run_stream_test(test_number, input_data, chunk_size):
+    # Потоковый разбор кусками по chunk_size символов должен совпадать с обычным,
+    # а потоковая запись JSON — с json.dump(..., indent=2)
+    try:
+        expected = ConfigParser().parse(input_data)
+        chunks = (input_data[i:i + chunk_size] for i in range(0, len(input_data), chunk_size))
+        output = io.StringIO()
+        write_json_stream(ConfigParser().parse_stream(chunks), output)
+        if output.getvalue() == json.dumps(expected, indent=2, default=json_default):
+            print(f'Test {test_number}: Passed.')
+            return True
+        print(f'Test {test_number}: Failed.')
+        print('Expected output:')
+        print(json.dumps(expected, indent=2, default=json_default))
+        print('Actual output:')
+        print(output.getvalue())
+        return False
+    except Exception as e:
+        print(f'Test {test_number}: Failed with exception.')
+        print(f'Error: {e}')
+        return False
+
+
+def run_location_test(test_number, input_data, expected_location, chunk_size=None):
+    # Ошибка должна указывать на строку и столбец токена как при обычном, так и при потоковом разборе
+    try:
+        if chunk_size is None:
+            ConfigParser().parse(input_data)
+        else:
+            chunks = (input_data[i:i + chunk_size] for i in range(0, len(input_data), chunk_size))
+            list(ConfigParser().parse_stream(chunks))
+    except Exception as e:
+        message = SourceMap(input_data).format_error(e, 'test.conf')
+        if message.startswith(f'test.conf:{expected_location}: '):
+            print(f'Test {test_number}: Passed (expected error).')
+            return True
+        print(f'Test {test_number}: Failed.')
+        print(f'Expected location: {expected_location}')
+        print(f'Actual error: {message}')
+        return False
+    print(f'Test {test_number}: Failed. Expected an error, but parser succeeded.')
+    return False
+
+
+def run_cache_test(test_number, input_data, expected_output, expected_cache_info):
+    # Результат должен совпадать с ожидаемым, а счётчики кэша выражений — с ожидаемыми
+    config_parser = ConfigParser()
+    try:
+        result = config_parser.parse(input_data)
+    except Exception as e:
+        print(f'Test {test_number}: Failed with exception.')
+        print(f'Error: {e}')
+        return False
+    if result == expected_output and config_parser.cache_info() == expected_cache_info:
+        print(f'Test {test_number}: Passed.')
+        return True
+    print(f'Test {test_number}: Failed.')
+    print(f'Expected: {expected_output} {expected_cache_info}')
+    print(f'Actual: {result} {config_parser.cache_info()}')
+    return False
+
+
+def run_incremental_test(test_number, versions, expected_evaluated):
+    # Каждая версия конфигурации преобразуется инкрементально поверх предыдущей: вывод должен
+    # совпадать с полным преобразованием, а число вычисленных объявлений — с ожидаемым
+    from incremental import convert_incremental
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, 'input.txt')
+        output_path = os.path.join(tmp, 'output.json')
+        for input_data, expected in zip(versions, expected_evaluated):
+            with open(input_path, 'w') as f:
+                f.write(input_data)
+            try:
+                evaluated, _ = convert_incremental(input_path, output_path, ConfigParser())
+            except Exception as e:
+                print(f'Test {test_number}: Failed with exception.')
+                print(f'Error: {e}')
+                return False
+            with open(output_path) as f:
+                output = f.read()
+            full = json.dumps(ConfigParser().parse(input_data), indent=2, default=json_default)
+            if output != full or evaluated != expected:
+                print(f'Test {test_number}: Failed.')
+                print(f'Expected {expected} evaluated declarations, output:')
+                print(full)
+                print(f'Actual {evaluated} evaluated declarations, output:')
+                print(output)
+                return False
+    print(f'Test {test_number}: Passed.')
+    return True
+
+
+def run_batch_test(test_number, inputs, workers):
+    # Пакетное преобразование: файлы с ошибками не прерывают остальные, вывод совпадает с обычным
+    from batch import collect_jobs, convert_batch
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, input_data in inputs.items():
+            with open(os.path.join(tmp, name), 'w') as f:
+                f.write(input_data)
+        jobs = collect_jobs([tmp], os.path.join(tmp, 'out'))
+        errors, _ = convert_batch(jobs, workers)
+        failed = []
+        for name, input_data in inputs.items():
+            output_path = os.path.join(tmp, 'out', os.path.splitext(name)[0] + '.json')
+            try:
+                expected = json.dumps(ConfigParser().parse(input_data), indent=2, default=json_default)
+            except Exception:
+                if os.path.exists(output_path) or not any(name in error for error in errors):
+                    failed.append(name)
+                continue
+            with open(output_path) as f:
+                if f.read() != expected:
+                    failed.append(name)
+    if failed or len(jobs) != len(inputs):
+        print(f'Test {test_number}: Failed. Wrong output for {failed}, errors: {errors}')
+        return False
+    print(f'Test {test_number}: Passed.')
+    return True
+
+
+def run_batch_error_test(test_number):
+    # Ошибка без позиции в тексте (здесь — запись вывода поверх каталога) называет входной файл,
+    # а недописанный временный файл удаляется
+    from batch import convert_file
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, 'a.conf')
+        with open(input_path, 'w') as f:
+            f.write('var x := 10\n')
+        output_path = os.path.join(tmp, 'a.json')
+        os.mkdir(output_path)
+        _, _, error = convert_file((input_path, output_path))
+        leftovers = os.path.exists(output_path + '.tmp')
+    if error is not None and error.startswith(f'{input_path}: ') and not leftovers:
+        print(f'Test {test_number}: Passed.')
+        return True
+    print(f'Test {test_number}: Failed. Error: {error!r}, temporary file left: {leftovers}')
+    return False
+
+
+def run_format_test(test_number, input_data):
+    # Каждый формат вывода должен совпадать с соответствующим вызовом json.dumps
+    from config_to_json import FORMAT_COMPACT, FORMAT_NDJSON, FORMAT_PRETTY
+    result = ConfigParser().parse(input_data)
+    plain = json.loads(json.dumps(result, default=json_default))
+    expected = {
+        FORMAT_PRETTY: json.dumps(plain, indent=2),
+        FORMAT_COMPACT: json.dumps(plain, separators=(',', ':')),
+        FORMAT_NDJSON: ''.join(json.dumps(stmt, separators=(',', ':')) + '\n' for stmt in plain),
+    }
+    for output_format, text in expected.items():
+        output = io.StringIO()
+        write_json_stream(result, output, output_format)
+        if output.getvalue() != text:
+            print(f'Test {test_number}: Failed ({output_format}).')
+            print('Expected output:')
+            print(text)
+            print('Actual output:')
+            print(output.getvalue())
+            return False
+    print(f'Test {test_number}: Passed.')
+    return True
+
+
+def run_depth_test(test_number, depth, max_depth):
+    # Вложенность глубже предела рекурсии интерпретатора разбирается и выводится,
+    # а превышение max_depth сообщается как синтаксическая ошибка
+    from config_to_json import FORMAT_COMPACT
+    input_data = 'var d := ' + '[' * depth + '1, []' + ']' * depth
+    try:
+        result = ConfigParser(max_depth).parse(input_data)
+    except SyntaxError as e:
+        if depth > max_depth and 'maximum depth' in str(e):
+            print(f'Test {test_number}: Passed (expected error).')
+            return True
+        print(f'Test {test_number}: Failed with exception.')
+        print(f'Error: {e}')
+        return False
+    output = io.StringIO()
+    write_json_stream(result, output, FORMAT_COMPACT)
+    expected = '[{"var":"d","value":' + '[' * depth + '1,[]' + ']' * depth + '}]'
+    if depth <= max_depth and output.getvalue() == expected:
+        print(f'Test {test_number}: Passed.')
+        return True
+    print(f'Test {test_number}: Failed.')
+    return False
+
+
+def run_import_test(test_number, files, main_file, expected_output=None, expected_error=None):
+    # Файлы записываются во временный каталог; main_file разбирается с импортами относительно него
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, input_data in files.items():
+            with open(os.path.join(tmp, name), 'w') as f:
+                f.write(input_data)
+        path = os.path.join(tmp, main_file)
+        try:
+            result = ConfigParser(path=path).parse(files[main_file])
+        except Exception as e:
+            if expected_error is not None and expected_error in str(e):
+                print(f'Test {test_number}: Passed (expected error).')
+                return True
+            print(f'Test {test_number}: Failed with exception.')
+            print(f'Error: {e}')
+            return False
+    if expected_output is not None and result == expected_output:
+        print(f'Test {test_number}: Passed.')
+        return True
+    print(f'Test {test_number}: Failed.')
+    print(f'Expected: {expected_output if expected_error is None else expected_error}')
+    print(f'Actual: {result}')
+    return False
+
+
+def run_module_cache_test(test_number, files, expected):
+    # Одинаковые тексты модулей в разных каталогах импортируют свои соседние файлы:
+    # files — {каталог: {имя: текст}}, в каждом каталоге разбирается main.conf
+    # с общим дисковым кэшем модулей
+    with tempfile.TemporaryDirectory() as tmp:
+        MODULES.cache_dir = os.path.join(tmp, 'modules')
+        results = {}
+        try:
+            for directory, directory_files in files.items():
+                os.makedirs(os.path.join(tmp, directory))
+                for name, input_data in directory_files.items():
+                    with open(os.path.join(tmp, directory, name), 'w') as f:
+                        f.write(input_data)
+                path = os.path.join(tmp, directory, 'main.conf')
+                results[directory] = ConfigParser(path=path).parse(directory_files['main.conf'])
+        except Exception as e:
+            print(f'Test {test_number}: Failed with exception.')
+            print(f'Error: {e}')
+            return False
+        finally:
+            MODULES.cache_dir = None
+            MODULES.modules.clear()
+    if results == expected:
+        print(f'Test {test_number}: Passed.')
+        return True
+    print(f'Test {test_number}: Failed.')
+    print(f'Expected: {expected}')
+    print(f'Actual: {results}')
+    return False
+
+
 def main():
-    total_tests = 12
+    total_tests = 30
     passed_tests = 0
 
     # Тест 1: Объявление переменных с числами
@@ -201,6 +447,154 @@ def main():
     if run_test(12, test12_input, test12_expected_output):
         passed_tests += 1
 
+    # Тест 13: Потоковый разбор с границами кусков внутри токенов и комментариев
+    test13_input = test6_input + test10_input + test11_input + test12_input
+    if run_stream_test(13, test13_input, 3):
+        passed_tests += 1
+
+    # Тест 14: Потоковый разбор пустой конфигурации
+    if run_stream_test(14, '  # только комментарий\n', 1):
+        passed_tests += 1
+
+    # Тесты 15-17: Строка и столбец ошибки
+    test15_input = 'var x := 10\n(comment\n  skip\n) var y := [1, (comment c) 2,,]\n'
+    if run_location_test(15, test15_input, '4:30'):
+        passed_tests += 1
+
+    if run_location_test(16, test15_input, '4:30', chunk_size=5):
+        passed_tests += 1
+
+    test17_input = 'var x := 10\nvar y := { x\n\tz + }\n'
+    if run_location_test(17, test17_input, '3:2', chunk_size=4):
+        passed_tests += 1
+
+    # Тест 18: Повторные выражения берутся из кэша, присваивание переменной его инвалидирует
+    test18_input = '''
+    var a := [3, 1, 2]
+    var s1 := { a sort() }
+    var s2 := { a sort() }
+    var a := [9, 8]
+    var s3 := { a sort() }
+    var m := { a sort() 1 index() }
+    '''
+    test18_expected_output = [
+        {"var": "a", "value": [3, 1, 2]},
+        {"var": "s1", "value": [1, 2, 3]},
+        {"var": "s2", "value": [1, 2, 3]},
+        {"var": "a", "value": [9, 8]},
+        {"var": "s3", "value": [8, 9]},
+        {"var": "m", "value": 9}
+    ]
+    test18_cache_info = {'compile_hits': 2, 'compile_misses': 2, 'eval_hits': 1, 'eval_misses': 3}
+    if run_cache_test(18, test18_input, test18_expected_output, test18_cache_info):
+        passed_tests += 1
+
+    # Тест 19: Конкатенация, повторение и сортировка массивов
+    test19_input = '''
+    var a := [3, 1]
+    var b := [[2], 0]
+    var c := { a b + a + }
+    var d := { a 2 * }
+    var e := { c 4 index() }
+    var f := { d sort() }
+    '''
+    test19_expected_output = [
+        {"var": "a", "value": [3, 1]},
+        {"var": "b", "value": [[2], 0]},
+        {"var": "c", "value": [3, 1, [2], 0, 3, 1]},
+        {"var": "d", "value": [3, 1, 3, 1]},
+        {"var": "e", "value": 3},
+        {"var": "f", "value": [1, 1, 3, 3]}
+    ]
+    if run_test(19, test19_input, test19_expected_output):
+        passed_tests += 1
+
+    # Тест 20: Инкрементальное преобразование пересчитывает изменённое объявление и зависящие от него
+    test20_base = '''
+    var ports := [80, 443]
+    var other := [1, 2]
+    var sorted := { ports sort() }
+    var first := { sorted 0 index() }
+    var size := { other 0 index() }
+    '''
+    test20_versions = [
+        test20_base,
+        test20_base,
+        test20_base.replace('[80, 443]', '[8080, 22]'),
+        test20_base.replace('[80, 443]', '[8080, 22]').replace('var size', '# size\n    var size'),
+        test20_base.replace('[80, 443]', '[8080, 22]').replace('var sorted', 'var ports := [5]\n    var sorted'),
+    ]
+    if run_incremental_test(20, test20_versions, [5, 0, 3, 1, 3]):
+        passed_tests += 1
+
+    # Тест 21: Пакетное преобразование пулом процессов с файлом, содержащим ошибку
+    test21_inputs = {'a.conf': test1_input, 'b.conf': test6_input, 'c.conf': test7_input, 'd.conf': test12_input}
+    if run_batch_test(21, test21_inputs, 2):
+        passed_tests += 1
+
+    # Тест 22: Форматы вывода, в том числе большие массивы целых, вложенные и пустые массивы
+    big = ', '.join(str(i * 37 % 1000) for i in range(200))
+    test22_input = f'''
+    var big := [{big}]
+    var mixed := [1, [], [2, [3, 4]], {{ big sort() 5 index() }}]
+    var joined := {{ big mixed + big sort() + }}
+    var empty := []
+    '''
+    if run_format_test(22, test22_input):
+        passed_tests += 1
+
+    # Тесты 23-24: Глубокая вложенность массивов и ограничение глубины
+    if run_depth_test(23, 5000, 10000):
+        passed_tests += 1
+
+    if run_depth_test(24, 11, 10):
+        passed_tests += 1
+
+    # Тесты 25-26: Импорт модулей и обнаружение циклов импорта
+    test25_files = {
+        'common.conf': 'var ports := [443, 80]\nimport "base.conf"\n',
+        'base.conf': 'var base := 1000\n',
+        'main.conf': 'import "common.conf"\nvar first := { ports sort() 0 index() }\nvar port := { base first + }\n',
+    }
+    test25_expected_output = [
+        {"var": "first", "value": 80},
+        {"var": "port", "value": 1080}
+    ]
+    if run_import_test(25, test25_files, 'main.conf', test25_expected_output):
+        passed_tests += 1
+
+    test26_files = {'a.conf': 'var x := 1\nimport "b.conf"\n', 'b.conf': 'import "a.conf"\n'}
+    if run_import_test(26, test26_files, 'a.conf', expected_error='Import cycle'):
+        passed_tests += 1
+
+    # Тесты 27-28: Блочный комментарий, начатый в строчном, главнее него и закрывается на другой строке;
+    # остаток строки после него по-прежнему закомментирован
+    test27_input = 'var a := 1 # note (comment\n  var b := 2\n) var c := 3\nvar d := [1, # (comment x) 2\n 3]\n'
+    test27_expected_output = [
+        {"var": "a", "value": 1},
+        {"var": "d", "value": [1, 3]}
+    ]
+    if run_test(27, test27_input, test27_expected_output):
+        passed_tests += 1
+
+    if run_stream_test(28, test27_input, 4):
+        passed_tests += 1
+
+    # Тест 29: Дисковый кэш модулей не путает одинаковые модули из разных каталогов
+    test29_mid = 'import "base.conf"\nvar m := 10\n'
+    test29_main = 'import "mid.conf"\nvar r := { base m + }\n'
+    test29_files = {
+        'd1': {'base.conf': 'var base := 1\n', 'mid.conf': test29_mid, 'main.conf': test29_main},
+        'd2': {'base.conf': 'var base := 2\n', 'mid.conf': test29_mid, 'main.conf': test29_main},
+    }
+    test29_expected = {'d1': [{"var": "r", "value": 11}], 'd2': [{"var": "r", "value": 12}]}
+    if run_module_cache_test(29, test29_files, test29_expected):
+        passed_tests += 1
+
+    # Тест 30: Ошибка пакетного преобразования без позиции называет файл
+    if run_batch_error_test(30):
+        passed_tests += 1
+
     print(f'\nTotal tests passed: {passed_tests} out of {total_tests}')
 
 
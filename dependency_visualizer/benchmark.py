@@ -0,0 +1,77 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+from visualizer import build_commit_graph
+
+
+def generate_repo(repo_path: str, commits: int, files: int = 2000, changes: int = 3) -> None:
+    """
+    Generates a linear repository through git fast-import: each commit changes a few files
+    spread over a two-level directory tree.
+
+    Args:
+        repo_path: Path to the new repository.
+        commits: Number of commits.
+        files: Number of distinct files.
+        changes: Files changed by each commit.
+    """
+    subprocess.run(['git', 'init', '-q', repo_path], check=True)
+    paths = [f'src/module{i % 40}/part{i % 9}/file{i}.txt'.encode() for i in range(files)]
+    rnd = random.Random(commits)
+    importer = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=repo_path, stdin=subprocess.PIPE)
+    write = importer.stdin.write
+    for i in range(1, commits + 1):
+        message = f'commit {i}'.encode()
+        write(b'commit refs/heads/master\nmark :%d\nauthor Dev %d <dev%d@example.com> %d +0000\n'
+              b'committer Dev <dev@example.com> %d +0000\ndata %d\n%s\n'
+              % (i, i % 10, i % 10, 1600000000 + i, 1600000000 + i, len(message), message))
+        if i > 1:
+            write(b'from :%d\n' % (i - 1))
+        for path in rnd.sample(paths, changes):
+            content = b'%s changed in commit %d\n' % (path, i)
+            write(b'M 100644 inline %s\ndata %d\n%s\n' % (path, len(content), content))
+    importer.stdin.close()
+    if importer.wait() != 0:
+        raise RuntimeError('git fast-import failed')
+    subprocess.run(['git', 'repack', '-a', '-d', '-q'], cwd=repo_path, check=True)
+
+
+def bench_workers(repo_path: str, file_name: str, workers_list, cached: bool) -> None:
+    # Последовательный прогон — база для оценки ускорения
+    baseline = None
+    for workers in workers_list:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, 'output.png.cache') if cached else None
+            start = time.perf_counter()
+            graph = build_commit_graph(repo_path, file_name, cache_path, workers=workers)
+            elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f'{workers:>3} workers: {len(graph):>6} commits in graph, {elapsed:7.2f} s, '
+              f'speedup x{baseline / elapsed:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Commit graph build benchmarks')
+    parser.add_argument('--repo', help='Existing repository (default: generate one)')
+    parser.add_argument('--commits', type=int, default=50000, help='Commits in the generated repository')
+    parser.add_argument('--file', default='src/module3/part3/file3.txt', help='File to build the graph for')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to compare')
+    parser.add_argument('--cached', action='store_true', help='Fill a fresh commit cache (diffs every commit)')
+    args = parser.parse_args()
+    print(f'CPU count: {os.cpu_count()}')
+    if args.repo:
+        bench_workers(args.repo, args.file, args.workers, args.cached)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        generate_repo(tmp, args.commits)
+        print(f'Generated {args.commits} commits in {time.perf_counter() - start:.2f} s')
+        bench_workers(tmp, args.file, args.workers, args.cached)
+
+
+if __name__ == '__main__':
+    main()
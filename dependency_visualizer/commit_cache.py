@@ -0,0 +1,191 @@
+import os
+import sqlite3
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from history import CommitHeader
+
+# Кэш хранится рядом с выходным файлом: <output>.cache
+CACHE_SUFFIX = '.cache'
+CACHE_VERSION = 1
+# Фильтр Блума изменённых путей коммита, как в commit-graph git: 10 бит на путь, 7 хэш-функций
+BLOOM_BITS_PER_PATH = 10
+BLOOM_HASHES = 7
+# Для коммитов, меняющих больше путей, фильтр не строится и всегда проверяется список путей
+BLOOM_MAX_PATHS = 512
+# Разделитель путей и родителей в столбцах таблицы: в путях git не бывает нулевых байт
+SEPARATOR = '\0'
+# Не больше стольких параметров в одном запросе SQLite
+SQL_VARIABLES = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS commits (
+    sha1 TEXT PRIMARY KEY,
+    tree BLOB NOT NULL,
+    parents TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    paths TEXT NOT NULL,
+    bloom BLOB
+)
+'''
+
+
+def bloom_hashes(path: str) -> Tuple[int, int]:
+    # Две независимые 32-битные хэш-функции; остальные получаются двойным хэшированием
+    digest = hashlib.blake2b(path.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest[:4], 'little'), int.from_bytes(digest[4:], 'little') | 1
+
+
+def make_bloom(paths: List[str]) -> Optional[bytes]:
+    """
+    Builds a Bloom filter of changed paths.
+
+    Args:
+        paths: Paths changed by a commit.
+
+    Returns:
+        The filter, or None if the commit changes too many paths for a filter to be useful.
+    """
+    if len(paths) > BLOOM_MAX_PATHS:
+        return None
+    bits = bytearray((len(paths) * BLOOM_BITS_PER_PATH + 7) // 8)
+    size = len(bits) * 8
+    for path in paths:
+        h1, h2 = bloom_hashes(path)
+        for i in range(BLOOM_HASHES):
+            position = (h1 + i * h2) % size
+            bits[position >> 3] |= 1 << (position & 7)
+    return bytes(bits)
+
+
+def bloom_contains(bloom: bytes, hashes: Tuple[int, int]) -> bool:
+    """
+    Checks a path against a Bloom filter. False means the path is certainly not in the filter.
+
+    Args:
+        bloom: Filter built by make_bloom.
+        hashes: bloom_hashes of the path.
+
+    Returns:
+        False if the path was not changed, True if it may have been.
+    """
+    size = len(bloom) * 8
+    if not size:
+        return False
+    h1, h2 = hashes
+    for i in range(BLOOM_HASHES):
+        position = (h1 + i * h2) % size
+        if not bloom[position >> 3] & (1 << (position & 7)):
+            return False
+    return True
+
+
+def chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class CommitCache:
+    """
+    Per-commit parents, author and changed paths of a repository, kept in an SQLite file.
+
+    Commits never change once written, so rows are keyed by commit SHA1 and stay valid across
+    runs; only commits missing from the cache have to be read and diffed.
+    """
+
+    def __init__(self, path: str, bloom: bool = True):
+        self.path = path
+        self.bloom = bloom
+        self.connection = sqlite3.connect(path)
+        try:
+            version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        except sqlite3.DatabaseError:
+            # Повреждённый или чужой файл: кэш строится заново
+            self.connection.close()
+            os.remove(path)
+            self.connection = sqlite3.connect(path)
+            version = None
+        if version != CACHE_VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS commits')
+            self.connection.execute(f'PRAGMA user_version = {CACHE_VERSION}')
+        self.connection.execute(SCHEMA)
+        self.pending: List[tuple] = []
+
+    def __enter__(self) -> 'CommitCache':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.flush()
+        self.close()
+
+    def load_headers(self) -> Dict[str, CommitHeader]:
+        """
+        Returns:
+            Headers of all cached commits by SHA1, without the raw commit content.
+        """
+        headers = {}
+        for sha1, tree, parents, date in self.connection.execute('SELECT sha1, tree, parents, date FROM commits'):
+            headers[sha1] = CommitHeader(sha1, tree, parents.split(SEPARATOR) if parents else [], date, None)
+        return headers
+
+    def add(self, header: CommitHeader, author: str, paths: List[str]) -> None:
+        """
+        Queues a commit for writing; rows are written by flush.
+
+        Args:
+            header: Header of the commit.
+            author: Author of the commit.
+            paths: Paths changed by the commit.
+        """
+        bloom = make_bloom(paths) if self.bloom else None
+        self.pending.append((header.sha1, header.tree, SEPARATOR.join(header.parents), header.date, author,
+                             SEPARATOR.join(paths), bloom))
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?, ?, ?, ?)', self.pending)
+        self.pending = []
+
+    def find(self, path: str) -> Dict[str, Tuple[str, List[str], List[str]]]:
+        """
+        Finds cached commits that change a path. Commits whose Bloom filter rules the path out are
+        skipped without reading their path lists.
+
+        Args:
+            path: Repository path of the file.
+
+        Returns:
+            A dictionary mapping commit SHA1 to (author, parents, changed paths).
+        """
+        self.flush()
+        hashes = bloom_hashes(path)
+        candidates = [sha1 for sha1, bloom in self.connection.execute('SELECT sha1, bloom FROM commits')
+                      if bloom is None or bloom_contains(bloom, hashes)]
+        found = {}
+        for sha1s in chunks(candidates, SQL_VARIABLES):
+            query = ('SELECT sha1, author, parents, paths FROM commits WHERE sha1 IN (%s)'
+                     % ', '.join('?' * len(sha1s)))
+            for sha1, author, parents, paths in self.connection.execute(query, sha1s):
+                paths = paths.split(SEPARATOR) if paths else []
+                # Фильтр Блума даёт ложные срабатывания: окончательно решает список путей
+                if path in paths:
+                    found[sha1] = (author, parents.split(SEPARATOR) if parents else [], paths)
+        return found
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def cache_path_for(output_path: str) -> str:
+    """
+    Args:
+        output_path: Path to the output image.
+
+    Returns:
+        Path to the commit cache kept next to it.
+    """
+    return os.path.abspath(output_path) + CACHE_SUFFIX
@@ -0,0 +1,520 @@
+import os
+import glob
+import mmap
+import zlib
+import struct
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Типы объектов в заголовке записи пакета
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+TYPE_NAMES = {OBJ_COMMIT: 'commit', OBJ_TREE: 'tree', OBJ_BLOB: 'blob', OBJ_TAG: 'tag'}
+TYPE_CODES = {name.encode('ascii'): kind for kind, name in TYPE_NAMES.items()}
+
+IDX_MAGIC = b'\377tOc'
+IDX_HEADER_SIZE = 8
+FANOUT_SIZE = 256 * 4
+SHA1_SIZE = 20
+# Запас сверх размера объекта для первого куска сжатых данных: zlib добавляет заголовок и
+# контрольную сумму, а несжимаемые данные лишь немного длиннее исходных
+INFLATE_SLACK = 64
+# Сколько байт разрешённых объектов-баз держать в памяти: соседние объекты цепочек дельт
+# обычно опираются на одни и те же базы. Вытесняются давно не использованные
+BASE_CACHE_BYTES = 32 * 1024 * 1024
+# Предел цепочки символьных ссылок (HEAD -> refs/heads/...)
+MAX_SYMREF_DEPTH = 5
+# Ссылки под refs/, которые у каждого рабочего дерева свои
+PER_WORKTREE_REFS = ('refs/worktree/', 'refs/bisect/', 'refs/rewritten/')
+# Предел вложенности alternates, как в git
+MAX_ALTERNATES_DEPTH = 5
+
+
+def find_git_dir(repo_path: str) -> str:
+    """
+    Returns the git directory of a working tree or a bare repository.
+
+    Args:
+        repo_path: Path to the Git repository.
+
+    Returns:
+        Path to the directory holding HEAD: for a linked worktree, its own directory under
+        <main git dir>/worktrees.
+    """
+    dot_git = os.path.join(repo_path, '.git')
+    if os.path.isfile(dot_git):
+        # Рабочее дерево git worktree / submodule: в файле .git записано "gitdir: <путь>"
+        with open(dot_git, 'r') as f:
+            line = f.read().strip()
+        if line.startswith('gitdir:'):
+            return os.path.normpath(os.path.join(repo_path, line[7:].strip()))
+    if os.path.isdir(dot_git):
+        return dot_git
+    return repo_path
+
+
+def find_common_dir(git_dir: str) -> str:
+    """
+    Returns the directory shared by all worktrees of a repository (objects, refs, packed-refs).
+
+    Args:
+        git_dir: Git directory returned by find_git_dir.
+
+    Returns:
+        Path named by <git_dir>/commondir, or git_dir itself for the main worktree.
+    """
+    try:
+        with open(os.path.join(git_dir, 'commondir'), 'r') as f:
+            common = f.read().strip()
+    except FileNotFoundError:
+        return git_dir
+    return os.path.normpath(os.path.join(git_dir, common))
+
+
+def find_object_dirs(objects_dir: str) -> List[str]:
+    """
+    Lists an objects directory followed by its alternates (clones made with --shared or
+    --reference), including alternates of alternates.
+
+    Args:
+        objects_dir: The repository's own objects directory.
+
+    Returns:
+        Object directories in search order.
+    """
+    dirs = [os.path.normpath(objects_dir)]
+    frontier = dirs[:]
+    for _ in range(MAX_ALTERNATES_DEPTH):
+        found = []
+        for directory in frontier:
+            for alternate in read_alternates(directory):
+                if alternate not in dirs:
+                    dirs.append(alternate)
+                    found.append(alternate)
+        frontier = found
+    return dirs
+
+
+def read_alternates(objects_dir: str) -> List[str]:
+    # Пути в objects/info/alternates задаются относительно каталога объектов, где лежит файл
+    try:
+        with open(os.path.join(objects_dir, 'info', 'alternates'), 'r') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    alternates = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            alternate = os.path.normpath(os.path.join(objects_dir, line))
+            if os.path.isdir(alternate):
+                alternates.append(alternate)
+    return alternates
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """
+    Applies a git delta (copy/insert instructions) to a base object.
+
+    Args:
+        base: Content of the base object.
+        delta: Delta data.
+
+    Returns:
+        Content of the resulting object.
+    """
+    pos = 0
+    # Размеры базы и результата — переменной длины, по 7 бит в байте
+    sizes = []
+    for _ in range(2):
+        size = shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        sizes.append(size)
+    base_size, result_size = sizes
+    if base_size != len(base):
+        raise ValueError('Delta base size mismatch')
+
+    out = []
+    end = len(delta)
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            # Копирование из базы: биты 0-3 — байты смещения, биты 4-6 — байты размера
+            offset = size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            out.append(base[offset:offset + size])
+        elif op:
+            # Вставка op байт из самой дельты
+            out.append(delta[pos:pos + op])
+            pos += op
+        else:
+            raise ValueError('Invalid delta instruction')
+    result = b''.join(out)
+    if len(result) != result_size:
+        raise ValueError('Delta result size mismatch')
+    return result
+
+
+class PackFile:
+    """A .pack file with its v2 .idx, both mapped into memory."""
+
+    def __init__(self, idx_path: str):
+        self.idx_path = idx_path
+        self.pack_path = idx_path[:-4] + '.pack'
+        with open(idx_path, 'rb') as f:
+            self.idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.pack_path, 'rb') as f:
+            self.pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.idx[:4] != IDX_MAGIC or struct.unpack('>I', self.idx[4:8])[0] != 2:
+            raise ValueError(f"Unsupported pack index '{idx_path}'")
+        self.fanout = struct.unpack('>256I', self.idx[IDX_HEADER_SIZE:IDX_HEADER_SIZE + FANOUT_SIZE])
+        self.count = self.fanout[255]
+        self.names_start = IDX_HEADER_SIZE + FANOUT_SIZE
+        # За таблицей имён идут CRC32 (по 4 байта), 31-битные смещения и 64-битные смещения
+        self.offsets_start = self.names_start + self.count * (SHA1_SIZE + 4)
+        self.large_offsets_start = self.offsets_start + self.count * 4
+
+    def find(self, binsha: bytes) -> Optional[int]:
+        """
+        Finds the offset of an object in the pack by binary search within its fanout bucket.
+
+        Args:
+            binsha: Binary SHA1 of the object.
+
+        Returns:
+            Offset of the object in the .pack file, or None.
+        """
+        first = binsha[0]
+        lo = self.fanout[first - 1] if first else 0
+        hi = self.fanout[first]
+        idx = self.idx
+        start = self.names_start
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = start + mid * SHA1_SIZE
+            name = idx[pos:pos + SHA1_SIZE]
+            if name < binsha:
+                lo = mid + 1
+            elif name > binsha:
+                hi = mid
+            else:
+                return self.offset_at(mid)
+        return None
+
+    def offset_at(self, index: int) -> int:
+        pos = self.offsets_start + index * 4
+        offset = struct.unpack('>I', self.idx[pos:pos + 4])[0]
+        if offset & 0x80000000:
+            pos = self.large_offsets_start + (offset & 0x7fffffff) * 8
+            offset = struct.unpack('>Q', self.idx[pos:pos + 8])[0]
+        return offset
+
+    def read_header(self, offset: int) -> Tuple[int, int, int, Optional[int], Optional[bytes]]:
+        """
+        Reads the header of a pack entry.
+
+        Returns:
+            (type, inflated size, offset of the data, base offset for OFS_DELTA, base SHA1 for REF_DELTA)
+        """
+        pack = self.pack
+        entry_offset = offset
+        byte = pack[offset]
+        offset += 1
+        kind = (byte >> 4) & 7
+        size = byte & 0x0f
+        shift = 4
+        while byte & 0x80:
+            byte = pack[offset]
+            offset += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+        base_offset = base_sha = None
+        if kind == OBJ_OFS_DELTA:
+            # Смещение базы назад от начала записи, в собственной кодировке git
+            byte = pack[offset]
+            offset += 1
+            distance = byte & 0x7f
+            while byte & 0x80:
+                byte = pack[offset]
+                offset += 1
+                distance = ((distance + 1) << 7) | (byte & 0x7f)
+            base_offset = entry_offset - distance
+        elif kind == OBJ_REF_DELTA:
+            base_sha = pack[offset:offset + SHA1_SIZE]
+            offset += SHA1_SIZE
+        return kind, size, offset, base_offset, base_sha
+
+    def inflate(self, offset: int, size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        pack = self.pack
+        parts = []
+        chunk = size + INFLATE_SLACK
+        while not decompressor.eof:
+            if offset >= len(pack):
+                raise ValueError(f"Truncated pack '{self.pack_path}'")
+            parts.append(decompressor.decompress(pack[offset:offset + chunk]))
+            offset += chunk
+        data = b''.join(parts)
+        if len(data) != size:
+            raise ValueError(f"Corrupt entry in pack '{self.pack_path}'")
+        return data
+
+    def close(self) -> None:
+        self.idx.close()
+        self.pack.close()
+
+
+class ObjectStore:
+    """
+    Reads objects of a Git repository without running git: loose objects are inflated with zlib,
+    packed ones are looked up in .idx v2 files and their delta chains are resolved from the mapped .pack.
+    """
+
+    def __init__(self, repo_path: str):
+        self.git_dir = find_git_dir(repo_path)
+        self.common_dir = find_common_dir(self.git_dir)
+        self.objects_dir = os.path.join(self.common_dir, 'objects')
+        if not os.path.isdir(self.objects_dir):
+            raise FileNotFoundError(f"Not a git repository: '{repo_path}'")
+        self.object_dirs = find_object_dirs(self.objects_dir)
+        self.packs: List[PackFile] = []
+        self.pack_paths = set()
+        self.base_cache: OrderedDict[Tuple[str, int], Tuple[int, bytes]] = OrderedDict()
+        self.base_cache_bytes = 0
+        self.load_packs()
+
+    def load_packs(self) -> bool:
+        """
+        Opens packs that appeared since the last scan (after git gc or fetch).
+
+        Returns:
+            True if new packs were found.
+        """
+        found = False
+        for objects_dir in self.object_dirs:
+            for idx_path in sorted(glob.glob(os.path.join(objects_dir, 'pack', '*.idx'))):
+                if idx_path not in self.pack_paths and os.path.exists(idx_path[:-4] + '.pack'):
+                    self.packs.append(PackFile(idx_path))
+                    self.pack_paths.add(idx_path)
+                    found = True
+        return found
+
+    def read(self, sha1: str) -> Tuple[str, bytes]:
+        """
+        Reads an object.
+
+        Args:
+            sha1: Full hex SHA1 of the object.
+
+        Returns:
+            (object type, raw content)
+        """
+        try:
+            binsha = bytes.fromhex(sha1)
+        except ValueError:
+            binsha = b''
+        if len(binsha) != SHA1_SIZE:
+            raise FileNotFoundError(f"Object '{sha1}' not found.")
+        result = self.read_binsha(binsha)
+        if result is None:
+            raise FileNotFoundError(f"Object '{sha1}' not found.")
+        kind, data = result
+        return TYPE_NAMES[kind], data
+
+    def read_binsha(self, binsha: bytes) -> Optional[Tuple[int, bytes]]:
+        result = self.read_packed(binsha)
+        if result is None:
+            result = self.read_loose(binsha)
+        if result is None and self.load_packs():
+            # Объект мог переехать из loose в новый пакет во время работы
+            result = self.read_packed(binsha)
+        return result
+
+    def read_loose(self, binsha: bytes) -> Optional[Tuple[int, bytes]]:
+        hexsha = binsha.hex()
+        for objects_dir in self.object_dirs:
+            try:
+                with open(os.path.join(objects_dir, hexsha[:2], hexsha[2:]), 'rb') as f:
+                    raw = zlib.decompress(f.read())
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            return None
+        # Заголовок: "<тип> <размер>\0"
+        header_end = raw.index(b'\0')
+        type_name, size = raw[:header_end].split(b' ')
+        data = raw[header_end + 1:]
+        if int(size) != len(data):
+            raise ValueError(f"Corrupt loose object '{hexsha}'")
+        kind = TYPE_CODES.get(type_name)
+        if kind is None:
+            raise ValueError(f"Unknown object type in '{hexsha}'")
+        return kind, data
+
+    def read_packed(self, binsha: bytes) -> Optional[Tuple[int, bytes]]:
+        for pack in self.packs:
+            offset = pack.find(binsha)
+            if offset is not None:
+                return self.read_pack_entry(pack, offset)
+        return None
+
+    def read_pack_entry(self, pack: PackFile, offset: int) -> Tuple[int, bytes]:
+        """
+        Reads an entry of a pack, resolving its delta chain iteratively.
+
+        Args:
+            pack: Pack containing the entry.
+            offset: Offset of the entry.
+
+        Returns:
+            (object type, content)
+        """
+        # Спускаемся по цепочке до объекта без дельты или до закэшированной базы,
+        # затем применяем дельты в обратном порядке
+        deltas = []
+        while True:
+            base_key = (pack.pack_path, offset)
+            cached = self.base_cache.get(base_key)
+            if cached is not None:
+                self.base_cache.move_to_end(base_key)
+                kind, data = cached
+                break
+            kind, size, data_offset, base_offset, base_sha = pack.read_header(offset)
+            if kind in TYPE_NAMES:
+                data = pack.inflate(data_offset, size)
+                break
+            deltas.append(((pack.pack_path, offset), pack.inflate(data_offset, size)))
+            if kind == OBJ_OFS_DELTA:
+                offset = base_offset
+            elif kind == OBJ_REF_DELTA:
+                base = self.find_packed(base_sha)
+                if base is None:
+                    # База "тонкого" пакета может лежать отдельно как loose-объект
+                    result = self.read_loose(base_sha)
+                    if result is None:
+                        raise FileNotFoundError(f"Delta base '{base_sha.hex()}' not found.")
+                    kind, data = result
+                    base_key = None
+                    break
+                pack, offset = base
+            else:
+                raise ValueError(f"Unknown pack entry type {kind} in '{pack.pack_path}'")
+        if deltas and base_key is not None:
+            self.cache_base(base_key, kind, data)
+        for delta_key, delta in reversed(deltas):
+            data = apply_delta(data, delta)
+            self.cache_base(delta_key, kind, data)
+        return kind, data
+
+    def find_packed(self, binsha: bytes) -> Optional[Tuple[PackFile, int]]:
+        for pack in self.packs:
+            offset = pack.find(binsha)
+            if offset is not None:
+                return pack, offset
+        return None
+
+    def cache_base(self, key: Tuple[str, int], kind: int, data: bytes) -> None:
+        old = self.base_cache.pop(key, None)
+        if old is not None:
+            self.base_cache_bytes -= len(old[1])
+        self.base_cache[key] = (kind, data)
+        self.base_cache_bytes += len(data)
+        while self.base_cache_bytes > BASE_CACHE_BYTES:
+            _, (_, evicted) = self.base_cache.popitem(last=False)
+            self.base_cache_bytes -= len(evicted)
+
+    def resolve_ref(self, name: str = 'HEAD') -> str:
+        """
+        Resolves a reference (HEAD, a branch or a full ref name) to a commit SHA1.
+
+        Args:
+            name: Reference name.
+
+        Returns:
+            Hex SHA1 the reference points to.
+        """
+        for _ in range(MAX_SYMREF_DEPTH):
+            candidates = [name] if name == 'HEAD' or name.startswith('refs/') else \
+                [f'refs/heads/{name}', f'refs/tags/{name}', f'refs/remotes/{name}']
+            value = None
+            for ref in candidates:
+                value = self.read_ref(ref)
+                if value is not None:
+                    break
+            if value is None:
+                raise FileNotFoundError(f"Reference '{name}' not found.")
+            if not value.startswith('ref:'):
+                return value
+            name = value[4:].strip()
+        raise ValueError(f"Reference '{name}' is too deeply nested.")
+
+    def read_ref(self, ref: str) -> Optional[str]:
+        # HEAD и ссылки вне refs/ (а также refs/worktree/, refs/bisect/) у каждого рабочего дерева
+        # свои, остальные ссылки и packed-refs общие для всех рабочих деревьев
+        per_worktree = not ref.startswith('refs/') or ref.startswith(PER_WORKTREE_REFS)
+        try:
+            with open(os.path.join(self.git_dir if per_worktree else self.common_dir, ref), 'r') as f:
+                return f.read().strip()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            pass
+        # Упакованные ссылки: строки "<sha1> <ref>", строки '^' относятся к аннотированным тегам
+        try:
+            with open(os.path.join(self.common_dir, 'packed-refs'), 'r') as f:
+                for line in f:
+                    if line[:1] not in ('#', '^'):
+                        sha1, _, packed = line.rstrip('\n').partition(' ')
+                        if packed == ref:
+                            return sha1
+        except FileNotFoundError:
+            pass
+        return None
+
+    def close(self) -> None:
+        for pack in self.packs:
+            pack.close()
+        self.packs = []
+        self.pack_paths = set()
+        self.base_cache = OrderedDict()
+        self.base_cache_bytes = 0
+
+
+# Хранилища открываются один раз на репозиторий и процесс
+_stores: Dict[str, ObjectStore] = {}
+
+
+def open_store(repo_path: str) -> ObjectStore:
+    """
+    Returns the object store of a repository, opening it on first use.
+
+    Args:
+        repo_path: Path to the Git repository.
+
+    Returns:
+        An ObjectStore instance.
+    """
+    key = os.path.abspath(repo_path)
+    store = _stores.get(key)
+    if store is None:
+        store = _stores[key] = ObjectStore(repo_path)
+    return store
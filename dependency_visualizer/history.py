@@ -0,0 +1,231 @@
+import heapq
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from git_objects import ObjectStore, OBJ_COMMIT, OBJ_TREE
+
+# Режим записи дерева, указывающей на поддерево
+TREE_MODE = b'40000'
+# Сколько разобранных деревьев держать в памяти: у соседних коммитов большая часть
+# каталогов общая
+TREE_CACHE_SIZE = 4096
+
+TreeEntries = Dict[str, Tuple[bytes, bytes]]
+
+
+class CommitHeader:
+    """Fields of a commit needed to walk the history; data is None for commits taken from a cache."""
+
+    __slots__ = ('sha1', 'tree', 'parents', 'date', 'data', 'parent_tree')
+
+    def __init__(self, sha1: str, tree: bytes, parents: List[str], date: int, data: Optional[bytes]):
+        self.sha1 = sha1
+        self.tree = tree
+        self.parents = parents
+        self.date = date
+        self.data = data
+        # Корневое дерево первого родителя — с ним сравнивает commit.stats; заполняется при обходе
+        self.parent_tree: Optional[bytes] = None
+
+
+def parse_commit_header(sha1: str, data: bytes) -> CommitHeader:
+    """
+    Parses the header of a raw commit object.
+
+    Args:
+        sha1: SHA1 of the commit.
+        data: Raw content of the commit.
+
+    Returns:
+        A CommitHeader instance.
+    """
+    tree = b''
+    parents = []
+    date = 0
+    end = data.find(b'\n\n')
+    for line in data[:end if end >= 0 else len(data)].split(b'\n'):
+        if line.startswith(b'tree '):
+            tree = bytes.fromhex(line[5:].decode('ascii'))
+        elif line.startswith(b'parent '):
+            parents.append(line[7:].decode('ascii'))
+        elif line.startswith(b'committer '):
+            # Формат: "Имя <email> timestamp timezone"
+            date = int(line.rsplit(b' ', 2)[1])
+    return CommitHeader(sha1, tree, parents, date, data)
+
+
+def parse_tree(data: bytes) -> TreeEntries:
+    """
+    Parses a raw tree object.
+
+    Args:
+        data: Raw content of the tree.
+
+    Returns:
+        A dictionary mapping entry names to (mode, binary SHA1).
+    """
+    entries = {}
+    pos = 0
+    end = len(data)
+    while pos < end:
+        # Запись: "<режим> <имя>\0<20 байт SHA1>"
+        space = data.index(b' ', pos)
+        nul = data.index(b'\0', space)
+        entries[data[space + 1:nul].decode('utf-8', errors='replace')] = (data[pos:space], data[nul + 1:nul + 21])
+        pos = nul + 21
+    return entries
+
+
+class TreeReader:
+    """Reads and caches parsed trees of an object store."""
+
+    def __init__(self, store: ObjectStore):
+        self.store = store
+        self.cache: Dict[bytes, TreeEntries] = {}
+
+    def read(self, binsha: Optional[bytes]) -> TreeEntries:
+        # None — пустое дерево (родитель корневого коммита или отсутствующий каталог)
+        if binsha is None:
+            return {}
+        entries = self.cache.get(binsha)
+        if entries is None:
+            result = self.store.read_binsha(binsha)
+            if result is None or result[0] != OBJ_TREE:
+                raise FileNotFoundError(f"Tree '{binsha.hex()}' not found.")
+            entries = parse_tree(result[1])
+            if len(self.cache) >= TREE_CACHE_SIZE:
+                self.cache.clear()
+            self.cache[binsha] = entries
+        return entries
+
+
+def subtree(entry: Optional[Tuple[bytes, bytes]]) -> Optional[bytes]:
+    # SHA1 поддерева для записи-каталога, None для файлов и отсутствующих записей
+    if entry is not None and entry[0] == TREE_MODE:
+        return entry[1]
+    return None
+
+
+def changed_paths(trees: TreeReader, old_tree: Optional[bytes], new_tree: Optional[bytes]) -> List[str]:
+    """
+    Lists files that differ between two trees.
+
+    Subtrees with the same SHA1 on both sides are skipped without being read.
+
+    Args:
+        trees: Tree reader of the repository.
+        old_tree: Binary SHA1 of the old root tree, or None for an empty tree.
+        new_tree: Binary SHA1 of the new root tree.
+
+    Returns:
+        Sorted list of changed file paths.
+    """
+    paths = []
+    stack = [('', old_tree, new_tree)]
+    while stack:
+        prefix, old_sha, new_sha = stack.pop()
+        if old_sha == new_sha:
+            continue
+        old_entries = trees.read(old_sha)
+        new_entries = trees.read(new_sha)
+        for name in old_entries.keys() | new_entries.keys():
+            old_entry = old_entries.get(name)
+            new_entry = new_entries.get(name)
+            if old_entry == new_entry:
+                continue
+            path = prefix + name
+            old_subtree = subtree(old_entry)
+            new_subtree = subtree(new_entry)
+            # Файл, заменённый каталогом (и наоборот), — это удаление одного и добавление другого
+            if old_entry is not None and old_subtree is None or new_entry is not None and new_subtree is None:
+                paths.append(path)
+            if old_subtree is not None or new_subtree is not None:
+                stack.append((path + '/', old_subtree, new_subtree))
+    paths.sort()
+    return paths
+
+
+def path_changed(trees: TreeReader, old_tree: Optional[bytes], new_tree: Optional[bytes], parts: List[str]) -> bool:
+    """
+    Checks whether a file differs between two trees, reading only the directories on its path.
+
+    Args:
+        trees: Tree reader of the repository.
+        old_tree: Binary SHA1 of the old root tree, or None for an empty tree.
+        new_tree: Binary SHA1 of the new root tree.
+        parts: Components of the file path.
+
+    Returns:
+        True if the file was added, removed or modified.
+    """
+    last = len(parts) - 1
+    for i, name in enumerate(parts):
+        if old_tree == new_tree:
+            return False
+        old_entry = trees.read(old_tree).get(name)
+        new_entry = trees.read(new_tree).get(name)
+        if i == last:
+            # Каталог с таким именем файлом не считается
+            if subtree(old_entry) is not None:
+                old_entry = None
+            if subtree(new_entry) is not None:
+                new_entry = None
+            return old_entry != new_entry
+        old_tree = subtree(old_entry)
+        new_tree = subtree(new_entry)
+    return False
+
+
+def walk_commits(store: ObjectStore, head: str,
+                 known: Optional[Dict[str, CommitHeader]] = None) -> Iterator[CommitHeader]:
+    """
+    Walks the history reachable from a commit, newest commits first (the order of git rev-list).
+
+    Each commit is read once: it is parsed when first reached and kept until it is yielded.
+    The root tree of its first parent is filled in before the commit is yielded.
+
+    Args:
+        store: Object store of the repository.
+        head: SHA1 of the starting commit.
+        known: Headers of commits that need not be read from the store (for example, cached ones).
+
+    Yields:
+        CommitHeader instances.
+    """
+    pending: Dict[str, CommitHeader] = {}
+    queue: List[Tuple[int, int, str]] = []
+    counter = 0
+
+    def push(sha1: str) -> None:
+        nonlocal counter
+        header = known.get(sha1) if known else None
+        if header is None:
+            header = read_commit_header(store, sha1)
+        pending[sha1] = header
+        heapq.heappush(queue, (-header.date, counter, sha1))
+        counter += 1
+
+    seen = {head}
+    push(head)
+    while queue:
+        _, _, sha1 = heapq.heappop(queue)
+        header = pending.pop(sha1)
+        for parent in header.parents:
+            if parent not in seen:
+                seen.add(parent)
+                push(parent)
+        if header.parents:
+            first = pending.get(header.parents[0])
+            if first is None:
+                # Родитель уже выдан раньше потомка (сбитые часы у автора коммита)
+                first = known.get(header.parents[0]) if known else None
+                if first is None:
+                    first = read_commit_header(store, header.parents[0])
+            header.parent_tree = first.tree
+        yield header
+
+
+def read_commit_header(store: ObjectStore, sha1: str) -> CommitHeader:
+    result = store.read_binsha(bytes.fromhex(sha1))
+    if result is None or result[0] != OBJ_COMMIT:
+        raise FileNotFoundError(f"Commit '{sha1}' not found.")
+    return parse_commit_header(sha1, result[1])
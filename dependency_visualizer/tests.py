@@ -1,40 +1,105 @@
+import os
+import tempfile
+import subprocess
 import unittest
 from unittest.mock import patch, MagicMock
+from commit_cache import BLOOM_MAX_PATHS, bloom_contains, bloom_hashes, make_bloom
+from git_objects import ObjectStore
+from history import changed_paths
 from visualizer import (
     read_object,
     parse_commit,
     CommitNode,
     build_commit_graph,
-    generate_dot
+    generate_dot,
+    iter_dot,
+    no_escape,
+    write_dot_file
 )
 
 
+def git(repo_path, *args):
+    return subprocess.run(['git', *args], cwd=repo_path, stdout=subprocess.PIPE, check=True).stdout
+
+
+def make_repo(repo_path, commits):
+    # Репозиторий, в котором большой файл понемногу растёт, чтобы git хранил его версии дельтами
+    git(repo_path, 'init', '-q')
+    git(repo_path, 'config', 'user.name', 'John Doe')
+    git(repo_path, 'config', 'user.email', 'john@example.com')
+    for i in range(commits):
+        with open(os.path.join(repo_path, 'file1.txt'), 'w') as f:
+            f.write(''.join(f'line {j}\n' for j in range((i + 1) * 100)))
+        os.makedirs(os.path.join(repo_path, 'src'), exist_ok=True)
+        with open(os.path.join(repo_path, 'src', 'file2.txt'), 'w') as f:
+            f.write(f'version {i}\n')
+        git(repo_path, 'add', '-A')
+        git(repo_path, 'commit', '-q', '-m', f'commit {i}')
+
+
 class TestGitCommitVisualizer(unittest.TestCase):
 
-    @patch('subprocess.run')
-    def test_read_object(self, mock_run):
-        # Настройка
-        mock_run.side_effect = [
-            MagicMock(returncode=0, stdout='tree 123456\nparent abcdef\n', stderr=''),  # git cat-file
-            MagicMock(returncode=0, stdout='commit', stderr='')  # git cat-file -t
-        ]
+    def test_read_object(self):
+        # Настройка: коммит лежит в репозитории loose-объектом
+        with tempfile.TemporaryDirectory() as repo_path:
+            make_repo(repo_path, 1)
+            sha1 = git(repo_path, 'rev-parse', 'HEAD').decode().strip()
 
-        sha1 = 'abc123'
-        obj = read_object('/Users/timofey/Desktop/конф_упр/my_rep', sha1)
+            obj = read_object(repo_path, sha1)
 
-        # Проверка
-        self.assertEqual(obj.sha1, sha1)
-        self.assertEqual(obj.content, 'tree 123456\nparent abcdef\n')
+            # Проверка
+            self.assertEqual(obj.sha1, sha1)
+            self.assertEqual(obj.type, 'commit')
+            self.assertEqual(obj.content, git(repo_path, 'cat-file', 'commit', sha1).decode())
+            with self.assertRaises(FileNotFoundError):
+                read_object(repo_path, '0' * 40)
+
+    def test_read_packed_objects(self):
+        # Настройка: все объекты упакованы, часть хранится дельтами по смещению и по имени базы
+        for ofs_delta in ('true', 'false'):
+            with tempfile.TemporaryDirectory() as repo_path:
+                make_repo(repo_path, 30)
+                git(repo_path, '-c', f'repack.useDeltaBaseOffset={ofs_delta}', 'repack', '-a', '-d', '-f', '-q')
+                listing = git(repo_path, 'cat-file', '--batch-all-objects', '--batch-check').decode().split('\n')
+                store = ObjectStore(repo_path)
 
-    @patch('git.Repo')
-    def test_parse_commit(self, mock_repo):
-        # Подготовка мока репозитория
-        mock_commit = MagicMock()
-        mock_commit.stats.files = {'file1.txt': {}, 'file2.txt': {}}
+                # Проверка
+                for line in filter(None, listing):
+                    sha1, obj_type, _ = line.split()
+                    self.assertEqual(store.read(sha1), (obj_type, git(repo_path, 'cat-file', obj_type, sha1)))
+                store.close()
 
-        # Настройка
-        mock_repo.return_value.commit.return_value = mock_commit
+    def test_read_worktree_and_alternates(self):
+        # Настройка: связанное рабочее дерево с собственной веткой и клон с --shared,
+        # объекты которого лежат в исходном репозитории
+        with tempfile.TemporaryDirectory() as tmp:
+            repo_path = os.path.join(tmp, 'repo')
+            os.mkdir(repo_path)
+            make_repo(repo_path, 3)
+            git(repo_path, 'repack', '-a', '-d', '-q')
+            worktree_path = os.path.join(tmp, 'worktree')
+            git(repo_path, 'worktree', 'add', '-q', '-b', 'feature', worktree_path)
+            with open(os.path.join(worktree_path, 'file1.txt'), 'w') as f:
+                f.write('feature\n')
+            git(worktree_path, 'commit', '-q', '-a', '-m', 'feature commit')
+            clone_path = os.path.join(tmp, 'clone')
+            git(tmp, 'clone', '-q', '--shared', repo_path, clone_path)
 
+            # Проверка: HEAD рабочего дерева — его ветка, объекты читаются из общего каталога
+            for path in (worktree_path, clone_path):
+                store = ObjectStore(path)
+                head = git(path, 'rev-parse', 'HEAD').decode().strip()
+                self.assertEqual(store.resolve_ref('HEAD'), head)
+                for sha1 in git(path, 'rev-list', '--objects', '--all').decode().split('\n'):
+                    if sha1:
+                        sha1 = sha1.split()[0]
+                        obj_type = git(path, 'cat-file', '-t', sha1).decode().strip()
+                        self.assertEqual(store.read(sha1), (obj_type, git(path, 'cat-file', obj_type, sha1)))
+                store.close()
+            self.assertNotEqual(ObjectStore(worktree_path).resolve_ref('HEAD'),
+                                ObjectStore(repo_path).resolve_ref('HEAD'))
+
+    def test_parse_commit(self):
         commit_content = (
             "tree 123456\n"
             "parent abcdef\n"
@@ -46,41 +111,115 @@ class TestGitCommitVisualizer(unittest.TestCase):
         obj.content = commit_content
         obj.sha1 = 'abc123'
 
-        commit_node = parse_commit(obj, '/Users/timofey/Desktop/конф_упр/my_rep')
+        commit_node = parse_commit(obj, ['file1.txt', 'file2.txt'])
 
         # Проверка
         self.assertEqual(commit_node.author, 'John Doe <john@example.com>')
+        self.assertEqual(commit_node.parents, ['abcdef'])
         self.assertIn('file1.txt', commit_node.files)
         self.assertIn('file2.txt', commit_node.files)
 
-    @patch('git.Repo')
-    @patch('visualizer.read_object')
-    def test_build_commit_graph(self, mock_read_object, mock_repo):
-        # Настройка мока репозитория
-        mock_commit = MagicMock()
-        mock_commit.hexsha = 'abc123'
-        mock_commit.stats.files = {'file1.txt': {}, 'file2.txt': {}}
+    def test_build_commit_graph(self):
+        # Настройка: file1.txt добавлен в первом коммите и удалён в третьем, второй его не трогает
+        with tempfile.TemporaryDirectory() as repo_path:
+            make_repo(repo_path, 1)
+            with open(os.path.join(repo_path, 'src', 'file2.txt'), 'w') as f:
+                f.write('changed\n')
+            git(repo_path, 'commit', '-q', '-a', '-m', 'change file2')
+            os.remove(os.path.join(repo_path, 'file1.txt'))
+            os.makedirs(os.path.join(repo_path, 'docs', 'api'))
+            with open(os.path.join(repo_path, 'docs', 'api', 'index.txt'), 'w') as f:
+                f.write('docs\n')
+            git(repo_path, 'add', '-A')
+            git(repo_path, 'commit', '-q', '-m', 'move file1 to docs')
+            first, second, third = git(repo_path, 'rev-list', '--reverse', 'HEAD').decode().split()
 
-        mock_repo.return_value.iter_commits.return_value = [mock_commit]
+            graph = build_commit_graph(repo_path, 'file1.txt')
 
-        obj = MagicMock()
-        obj.sha1 = 'abc123'
-        obj.content = 'tree ...'
+            # Проверка
+            self.assertEqual(list(graph), [third, first])
+            self.assertEqual(graph[third].files, ['docs/api/index.txt', 'file1.txt'])
+            self.assertEqual(graph[third].parents, [second])
+            self.assertEqual(graph[third].author, 'John Doe <john@example.com>')
+            self.assertEqual(graph[first].files, ['file1.txt', 'src/file2.txt'])
+            self.assertEqual(list(build_commit_graph(repo_path, 'src/file2.txt')), [second, first])
+            # Каталог — не файл, а несуществующий файл не менялся ни разу
+            self.assertEqual(build_commit_graph(repo_path, 'src'), {})
+            self.assertEqual(build_commit_graph(repo_path, 'docs/missing.txt'), {})
 
-        mock_read_object.return_value = obj
+    def test_build_commit_graph_from_worktree(self):
+        # Настройка: граф строится из связанного рабочего дерева и из клона с --shared
+        with tempfile.TemporaryDirectory() as tmp:
+            repo_path = os.path.join(tmp, 'repo')
+            os.mkdir(repo_path)
+            make_repo(repo_path, 3)
+            worktree_path = os.path.join(tmp, 'worktree')
+            git(repo_path, 'worktree', 'add', '-q', '-b', 'feature', worktree_path)
+            with open(os.path.join(worktree_path, 'file1.txt'), 'w') as f:
+                f.write('feature\n')
+            git(worktree_path, 'commit', '-q', '-a', '-m', 'feature commit')
+            clone_path = os.path.join(tmp, 'clone')
+            git(tmp, 'clone', '-q', '--shared', worktree_path, clone_path)
 
-        # Настройка возвращаемого значения parse_commit
-        mock_commit_node = CommitNode(sha1='abc123', author='John Doe <john@example.com>', parents=[],
-                                      files=['file1.txt', 'file2.txt'])
-        mock_read_object.return_value = obj
+            # Проверка: коммиты ветки рабочего дерева, в порядке git rev-list
+            for path in (worktree_path, clone_path):
+                expected = git(path, 'rev-list', 'HEAD', '--', 'file1.txt').decode().split()
+                self.assertEqual(len(expected), 4)
+                self.assertEqual(list(build_commit_graph(path, 'file1.txt')), expected)
+                cache_path = os.path.join(tmp, 'output.png.cache')
+                self.assertEqual(list(build_commit_graph(path, 'file1.txt', cache_path)), expected)
 
-        with patch('visualizer.parse_commit', return_value=mock_commit_node):
-            graph = build_commit_graph('/Users/timofey/Desktop/конф_упр/my_rep', 'file1.txt')
+    def test_build_cached_commit_graph(self):
+        with tempfile.TemporaryDirectory() as repo_path:
+            make_repo(repo_path, 5)
+            cache_path = os.path.join(repo_path, 'output.png.cache')
+            expected = build_commit_graph(repo_path, 'file1.txt')
 
-        # Проверка
-        self.assertIn('abc123', graph)
-        self.assertEqual(len(graph), 1)
-        self.assertIn('file1.txt', graph['abc123'].files)  # Проверка на наличие файла
+            # Первый запуск заполняет кэш, второй читает из него все коммиты
+            for _ in range(2):
+                graph = build_commit_graph(repo_path, 'file1.txt', cache_path)
+                self.assertEqual(list(graph), list(expected))
+                for sha1, node in graph.items():
+                    self.assertEqual((node.author, node.parents, node.files),
+                                     (expected[sha1].author, expected[sha1].parents, expected[sha1].files))
+
+            # Новый коммит: разбирается и сравнивается с родителем только он
+            with open(os.path.join(repo_path, 'src', 'file2.txt'), 'w') as f:
+                f.write('changed\n')
+            git(repo_path, 'commit', '-q', '-a', '-m', 'change file2')
+            with patch('visualizer.changed_paths', wraps=changed_paths) as diff:
+                graph = build_commit_graph(repo_path, 'src/file2.txt', cache_path)
+            self.assertEqual(diff.call_count, 1)
+            self.assertEqual(list(graph), git(repo_path, 'rev-list', 'HEAD').decode().split())
+
+    def test_build_commit_graph_in_pool(self):
+        with tempfile.TemporaryDirectory() as repo_path:
+            make_repo(repo_path, 6)
+            expected = build_commit_graph(repo_path, 'file1.txt', workers=1)
+
+            # Пул запускается и для нескольких коммитов, куски по два коммита
+            with patch('visualizer.MIN_PARALLEL_COMMITS', 0):
+                graph = build_commit_graph(repo_path, 'file1.txt', workers=2, chunksize=2)
+                cached = build_commit_graph(repo_path, 'file1.txt', os.path.join(repo_path, 'output.png.cache'),
+                                            workers=2, chunksize=2)
+
+            # Проверка: результаты пула собраны в порядке обхода
+            for result in (graph, cached):
+                self.assertEqual(list(result), list(expected))
+                self.assertEqual([node.files for node in result.values()],
+                                 [node.files for node in expected.values()])
+
+    def test_bloom_filter(self):
+        paths = [f'src/dir{i}/file{i}.txt' for i in range(100)]
+        bloom = make_bloom(paths)
+
+        # Проверка: ложных отрицаний нет, ложных срабатываний немного
+        for path in paths:
+            self.assertTrue(bloom_contains(bloom, bloom_hashes(path)))
+        false_positives = sum(bloom_contains(bloom, bloom_hashes(f'other/file{i}.txt')) for i in range(1000))
+        self.assertLess(false_positives, 50)
+        self.assertFalse(bloom_contains(make_bloom([]), bloom_hashes('file1.txt')))
+        self.assertIsNone(make_bloom(['file.txt'] * (BLOOM_MAX_PATHS + 1)))
 
     def test_generate_dot(self):
         # Подготовка графа
@@ -99,6 +238,34 @@ class TestGitCommitVisualizer(unittest.TestCase):
         self.assertIn('John Doe <john@example.com>', dot_output)
         self.assertIn('Files: file1.txt, file2.txt', dot_output)
 
+    def test_iter_dot(self):
+        # Подготовка графа: кавычки в имени автора и длинный список файлов
+        node = CommitNode(
+            sha1='abc123',
+            author='John "JD" Doe <john@example.com>',
+            parents=['abcdef'],
+            files=[f'file{i}.txt' for i in range(10)]
+        )
+        parent = CommitNode(sha1='abcdef', author='John Doe <john@example.com>', parents=[], files=['file0.txt'])
+        graph = {'abc123': node, 'abcdef': parent}
+
+        lines = list(iter_dot(graph, max_files=3))
+
+        # Проверка: строки выдаются по одной, подпись экранирована и усечена
+        self.assertEqual(lines[0], 'digraph G {\n')
+        self.assertEqual(lines[-1], '}\n')
+        self.assertIn('  "abc123" [label="abc123\\nJohn \\"JD\\" Doe <john@example.com>\\n '
+                      'Files: file0.txt, file1.txt, file2.txt ... (+7 more)"];\n', lines)
+        self.assertIn('  "abc123" -> "abcdef";\n', lines)
+        self.assertIn('John "JD" Doe', generate_dot(graph, escape=no_escape))
+        self.assertIn('file9.txt', generate_dot(graph))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            dot_path = os.path.join(tmp, 'graph.dot')
+            write_dot_file(iter_dot(graph), dot_path)
+            with open(dot_path, 'r') as f:
+                self.assertEqual(f.read(), generate_dot(graph))
+
 
 if __name__ == '__main__':
     unittest.main()
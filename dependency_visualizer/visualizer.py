@@ -1,7 +1,21 @@
 import os
 import argparse
-from datetime import datetime, timezone, timedelta
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from commit_cache import CommitCache, cache_path_for
+from git_objects import open_store
+from history import CommitHeader, TreeReader, changed_paths, path_changed, walk_commits
+
+# Меньше стольких коммитов разбирается в текущем процессе: запуск пула дороже самой работы
+MIN_PARALLEL_COMMITS = 1000
+# (SHA1, корневое дерево первого родителя, корневое дерево, содержимое коммита)
+CommitJob = Tuple[str, Optional[bytes], bytes, bytes]
+# Буфер записи DOT-файла: строки графа пишутся по мере генерации
+DOT_BUFFER_SIZE = 1024 * 1024
+# Сколько файлов коммита показывать в подписи узла по умолчанию: длинные подписи нечитаемы
+# и замедляют Graphviz
+DEFAULT_MAX_FILES = 50
 
 
 class GitObject:
@@ -39,7 +53,7 @@ def parse_config(config_path, repo_path, output_path, file_name) -> Dict[str, st
 
 def read_object(repo_path: str, sha1: str) -> GitObject:
     """
-    Reads a Git object from the repository using git cat-file.
+    Reads a Git object straight from the repository's object database, without running git.
 
     Args:
         repo_path: Path to the Git repository.
@@ -48,48 +62,28 @@ def read_object(repo_path: str, sha1: str) -> GitObject:
     Returns:
         A GitObject instance.
     """
-    import subprocess
-
-    result = subprocess.run(
-        ['git', 'cat-file', '-p', sha1],
-        cwd=repo_path,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-
-    if result.returncode != 0:
-        raise FileNotFoundError(f"Object '{sha1}' not found.")
-
-    # Determine the type of the object
-    type_result = subprocess.run(
-        ['git', 'cat-file', '-t', sha1],
-        cwd=repo_path,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
+    obj_type, content = open_store(repo_path).read(sha1)
+    return GitObject(sha1, obj_type, content)
 
-    obj_type = type_result.stdout.strip()
 
-    return GitObject(sha1, obj_type, result.stdout.encode('utf-8'))
-
-
-def parse_commit(obj: GitObject, repo_path: str) -> CommitNode:
+def parse_commit(obj: GitObject, files: List[str]) -> CommitNode:
     """
     Parses a Git commit object.
 
     Args:
         obj: GitObject instance representing a commit.
+        files: Files changed by the commit.
 
     Returns:
-        A CommitNode instance.:
+        A CommitNode instance.
     """
-    from git import Repo
     lines = obj.content.split('\n')
     parents = []
     author = ''
     for line in lines:
+        if not line:
+            # Заголовок коммита закончился, дальше сообщение
+            break
         if line.startswith('parent '):
             parents.append(line[7:])
         elif line.startswith('author '):
@@ -100,73 +94,264 @@ def parse_commit(obj: GitObject, repo_path: str) -> CommitNode:
             author_name_email = author_parts[0]
             author = author_name_email
 
-    commit_sha = obj.sha1
-    commit = Repo(repo_path).commit(commit_sha)
-    files = [f for f in commit.stats.files.keys()]
     return CommitNode(obj.sha1, author, parents, files)
 
 
-def build_commit_graph(repo_path: str, file_name: str) -> Dict[str, CommitNode]:
+def split_path(file_name: str) -> List[str]:
     """
-    Builds the commit graph starting from a specific commit.
+    Splits a file name given on the command line into components of a repository path.
+
+    Args:
+        file_name: File name.
+
+    Returns:
+        List of path components.
+    """
+    return [part for part in file_name.replace(os.sep, '/').split('/') if part and part != '.']
+
+
+def process_commit(trees: TreeReader, job: CommitJob, parts: Optional[List[str]]) -> Optional[CommitNode]:
+    """
+    Diffs a commit against its first parent.
+
+    Args:
+        trees: Tree reader of the repository.
+        job: (SHA1, root tree of the first parent, root tree, raw content) of the commit.
+        parts: Components of the file path to filter on, or None to process every commit.
+
+    Returns:
+        A CommitNode instance, or None if the commit does not change the file.
+    """
+    sha1, parent_tree, tree, data = job
+    if parts is not None and not path_changed(trees, parent_tree, tree, parts):
+        return None
+    files = changed_paths(trees, parent_tree, tree)
+    return parse_commit(GitObject(sha1, 'commit', data), files)
+
+
+# Состояние процесса пула: читатель деревьев открывается один раз на процесс, и его кэш
+# переиспользуется соседними коммитами куска
+_worker = {}
+
+
+def init_worker(repo_path: str, parts: Optional[List[str]]) -> None:
+    _worker['trees'] = TreeReader(open_store(repo_path))
+    _worker['parts'] = parts
+
+
+def process_commit_in_worker(job: CommitJob) -> Optional[CommitNode]:
+    return process_commit(_worker['trees'], job, _worker['parts'])
+
+
+def process_commits(repo_path: str, jobs: List[CommitJob], parts: Optional[List[str]],
+                    workers: Optional[int] = None, chunksize: Optional[int] = None) -> Iterator[Optional[CommitNode]]:
+    """
+    Runs process_commit over commits, in a process pool when there are enough of them.
+
+    Commits are handed out in contiguous chunks of the walk, so a worker diffs neighbouring commits
+    that share most of their trees; results come back in the order of the jobs.
+
+    Args:
+        repo_path: Path to the Git repository.
+        jobs: Commits in the order of the walk.
+        parts: Components of the file path to filter on, or None to process every commit.
+        workers: Number of worker processes (default: CPU count).
+        chunksize: Commits handed to a worker at a time.
+
+    Returns:
+        An iterator of process_commit results, one per job.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) < MIN_PARALLEL_COMMITS:
+        trees = TreeReader(open_store(repo_path))
+        return (process_commit(trees, job, parts) for job in jobs)
+    if chunksize is None:
+        # Несколько кусков на процесс сглаживают разницу в размерах коммитов
+        chunksize = max(1, len(jobs) // (workers * 4))
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(repo_path, parts))
+    return iter_and_shutdown(pool, pool.map(process_commit_in_worker, jobs, chunksize=chunksize))
+
+
+def iter_and_shutdown(pool: ProcessPoolExecutor, results: Iterator) -> Iterator:
+    with pool:
+        yield from results
+
+
+def commit_job(header: CommitHeader) -> CommitJob:
+    return header.sha1, header.parent_tree, header.tree, header.data
+
+
+def build_commit_graph(repo_path: str, file_name: str, cache_path: Optional[str] = None,
+                       bloom: bool = True, workers: Optional[int] = None,
+                       chunksize: Optional[int] = None) -> Dict[str, CommitNode]:
+    """
+    Builds the commit graph of the commits that change a file.
+
+    History is walked once from HEAD. Without a cache each commit's root tree is compared with the
+    tree of its first parent only along the directories of file_name, and the full list of changed
+    files is computed only for the matching commits. Diffing is spread over a process pool.
 
     Args:
         repo_path: Path to the Git repository.
         file_name: File name.
+        cache_path: Path to the commit cache; see build_cached_commit_graph.
+        bloom: Whether to store Bloom filters of changed paths for new cached commits.
+        workers: Number of worker processes (default: CPU count).
+        chunksize: Commits handed to a worker at a time.
 
     Returns:
         A dictionary mapping commits SHA1 to CommitNode.
     """
-    from git import Repo
-    repo = Repo(repo_path)
-    commits_sha1 = []
-    for commit in repo.iter_commits():
-        if file_name in commit.stats.files:
-            commits_sha1.append(commit.hexsha)
+    if cache_path is not None:
+        return build_cached_commit_graph(repo_path, file_name, cache_path, bloom, workers, chunksize)
+    store = open_store(repo_path)
+    jobs = [commit_job(header) for header in walk_commits(store, store.resolve_ref('HEAD'))]
+    graph = {}
+    for node in process_commits(repo_path, jobs, split_path(file_name), workers, chunksize):
+        if node is not None:
+            graph[node.sha1] = node
+    return graph
+
+
+def build_cached_commit_graph(repo_path: str, file_name: str, cache_path: str, bloom: bool = True,
+                              workers: Optional[int] = None,
+                              chunksize: Optional[int] = None) -> Dict[str, CommitNode]:
+    """
+    Builds the commit graph using a persistent cache of parents, authors and changed files.
+
+    Only commits missing from the cache are read and diffed (in full, so that the cache can answer
+    queries for any file later); cached commits are walked from their stored headers.
+
+    Args:
+        repo_path: Path to the Git repository.
+        file_name: File name.
+        cache_path: Path to the commit cache.
+        bloom: Whether to store Bloom filters of changed paths for new commits.
+        workers: Number of worker processes (default: CPU count).
+        chunksize: Commits handed to a worker at a time.
 
+    Returns:
+        A dictionary mapping commits SHA1 to CommitNode.
+    """
+    store = open_store(repo_path)
+    path = '/'.join(split_path(file_name))
+    with CommitCache(cache_path, bloom) as cache:
+        order = []
+        new_headers = []
+        for header in walk_commits(store, store.resolve_ref('HEAD'), cache.load_headers()):
+            order.append(header.sha1)
+            if header.data is not None:
+                new_headers.append(header)
+        jobs = [commit_job(header) for header in new_headers]
+        for header, node in zip(new_headers, process_commits(repo_path, jobs, None, workers, chunksize)):
+            cache.add(header, node.author, node.files)
+        found = cache.find(path)
     graph = {}
-    for commit_sh1 in commits_sha1:
-        obj = read_object(repo_path, commit_sh1)
-        commit_node = parse_commit(obj, repo_path)
-        graph[commit_sh1] = commit_node
+    for sha1 in order:
+        if sha1 in found:
+            author, parents, files = found[sha1]
+            graph[sha1] = CommitNode(sha1, author, parents, files)
     return graph
 
 
-def generate_dot(graph: Dict[str, CommitNode]) -> str:
+def escape_label(text: str) -> str:
     """
-    Generates a DOT representation of the commit graph.
+    Escapes text for a double-quoted DOT string.
 
     Args:
-        graph: The commit graph.
+        text: Text of a label.
 
     Returns:
-        A string containing the DOT graph.
+        The text with backslashes, quotes and line breaks escaped.
+    """
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def no_escape(text: str) -> str:
+    return text
+
+
+def node_label(node: CommitNode, max_files: Optional[int] = None,
+               escape: Callable[[str], str] = escape_label) -> str:
     """
-    dot = 'digraph G {\n'
-    dot += '  rankdir=LR;\n'
-    dot += '  node [shape=box, style=filled, color="lightblue"];\n'  # Добавлены стили для узлов
-    dot += '  edge [color="gray"];\n'  # Добавлены стили для ребер
+    Builds the label of a commit node.
+
+    Args:
+        node: The commit.
+        max_files: Maximum number of files listed in the label, None for all of them.
+        escape: Function escaping the author and file names.
+
+    Returns:
+        The label text, ready to be put between double quotes.
+    """
+    files = node.files
+    hidden = 0
+    if max_files is not None and len(files) > max_files:
+        hidden = len(files) - max_files
+        files = files[:max_files]
+    # Разделитель экранирования не требует, поэтому список экранируется целиком
+    files_text = escape(', '.join(files))
+    if hidden:
+        files_text += f' ... (+{hidden} more)'
+    return f"{node.sha1[:7]}\\n{escape(node.author)}\\n Files: {files_text}"
+
+
+def iter_dot(graph: Dict[str, CommitNode], max_files: Optional[int] = None,
+             escape: Callable[[str], str] = escape_label) -> Iterator[str]:
+    """
+    Generates a DOT representation of the commit graph line by line.
+
+    Args:
+        graph: The commit graph.
+        max_files: Maximum number of files listed in a node label, None for all of them.
+        escape: Function escaping the author and file names in labels.
+
+    Yields:
+        Lines of the DOT graph.
+    """
+    yield 'digraph G {\n'
+    yield '  rankdir=LR;\n'
+    yield '  node [shape=box, style=filled, color="lightblue"];\n'  # Добавлены стили для узлов
+    yield '  edge [color="gray"];\n'  # Добавлены стили для ребер
 
     for sha1, node in graph.items():
-        label = f"{node.sha1[:7]}\\n{node.author}\\n Files: {', '.join(node.files)}"
-        dot += f'  "{sha1}" [label="{label}"];\n'
+        yield f'  "{sha1}" [label="{node_label(node, max_files, escape)}"];\n'
         for parent_sha1 in node.parents:
             if parent_sha1 in graph:
-                dot += f'  "{sha1}" -> "{parent_sha1}";\n'
-    dot += '}\n'
-    return dot
+                yield f'  "{sha1}" -> "{parent_sha1}";\n'
+    yield '}\n'
+
+
+def generate_dot(graph: Dict[str, CommitNode], max_files: Optional[int] = None,
+                 escape: Callable[[str], str] = escape_label) -> str:
+    """
+    Generates a DOT representation of the commit graph.
+
+    Args:
+        graph: The commit graph.
+        max_files: Maximum number of files listed in a node label, None for all of them.
+        escape: Function escaping the author and file names in labels.
+
+    Returns:
+        A string containing the DOT graph.
+    """
+    return ''.join(iter_dot(graph, max_files, escape))
 
 
-def write_dot_file(dot_content: str, dot_path: str) -> None:
+def write_dot_file(dot_content: Union[str, Iterable[str]], dot_path: str) -> None:
     """
     Writes the DOT content to a file.
 
     Args:
-        dot_content: The DOT graph content.
+        dot_content: The DOT graph content, or an iterable of its parts (such as iter_dot)
+            written as they are produced.
         dot_path: Path to the output DOT file.
     """
-    with open(dot_path, 'w') as f:
-        f.write(dot_content)
+    with open(dot_path, 'w', buffering=DOT_BUFFER_SIZE) as f:
+        if isinstance(dot_content, str):
+            f.write(dot_content)
+        else:
+            f.writelines(dot_content)
 
 
 def generate_graph_image(graphviz_path: str, dot_path: str, output_path: str, layout: str = 'dot') -> None:
@@ -193,10 +378,13 @@ def main(args) -> None:
     # Parse configuration
     config = parse_config(args.graphviz_path, args.repo_path, args.output_path, args.file_name)
     # Build commit graph
-    graph = build_commit_graph(config['repo_path'], config["file_name"])
+    cache_path = None if args.no_cache else cache_path_for(config['output_path'])
+    graph = build_commit_graph(config['repo_path'], config["file_name"], cache_path, not args.no_bloom,
+                               args.workers, args.chunksize)
 
     # Generate DOT file
-    dot_content = generate_dot(graph)
+    max_files = args.max_files if args.max_files > 0 else None
+    dot_content = iter_dot(graph, max_files, no_escape if args.raw_labels else escape_label)
     dot_path = os.path.join(os.path.dirname(config['output_path']), 'graph.dot')
     write_dot_file(dot_content, dot_path)
 
@@ -212,5 +400,15 @@ if __name__ == '__main__':
     parser.add_argument('repo_path', help='Path to the repository')
     parser.add_argument('output_path', help='Path to the output file')
     parser.add_argument('file_name', help='File name')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not keep parents, authors and changed files of commits next to the output')
+    parser.add_argument('--no-bloom', action='store_true',
+                        help='Do not store Bloom filters of changed paths in the commit cache')
+    parser.add_argument('-j', '--workers', type=int, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--chunksize', type=int, help='Commits handed to a worker at a time')
+    parser.add_argument('--max-files', type=int, default=DEFAULT_MAX_FILES,
+                        help='Files listed in a node label before the rest are summarised (0: all)')
+    parser.add_argument('--raw-labels', action='store_true',
+                        help='Put author and file names into labels without escaping quotes and backslashes')
     args = parser.parse_args()
     main(args)
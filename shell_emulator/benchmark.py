@@ -0,0 +1,32 @@
+import argparse
+import os
+import tempfile
+import time
+
+from xml_log import XmlLogWriter, parse_flush_policy
+
+
+def bench_log_writer(counts, flush_policy):
+    print(f"log writer, flush={flush_policy}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'log.xml')
+        for count in counts:
+            log = XmlLogWriter(path, flush_policy)
+            start = time.perf_counter()
+            for i in range(count):
+                log.write_entry('user', f'cd dir{i}', '2024-01-01T00:00:00.000000')
+            log.close()
+            elapsed = time.perf_counter() - start
+            print(f"  {count:>8} commands: {elapsed * 1e6 / count:8.2f} us/command")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shell emulator benchmarks')
+    parser.add_argument('--counts', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--flush', default='entry', help="entry, exit or N")
+    args = parser.parse_args()
+    bench_log_writer(args.counts, parse_flush_policy(args.flush))
+
+
+if __name__ == '__main__':
+    main()
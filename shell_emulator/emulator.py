@@ -1,111 +1,437 @@
 import os
-import tarfile
+import re
+import sys
+import itertools
+import time
+import atexit
+import argparse
+import cProfile
+import pstats
+import posixpath
+from collections import namedtuple
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
 import datetime
-import shutil
+from stats import CommandStats
+from vfs import TarImage, VirtualFileSystem
+from xml_log import XmlLogWriter, parse_flush_policy, FLUSH_ENTRY
+
+BATCH_LOG_FLUSH = 1000
+BATCH_OUTPUT_LINES = 1 << 14
+
+
+# reads_stdin: команда читает строки из предыдущей стадии конвейера
+CommandSpec = namedtuple('CommandSpec', 'method min_args max_args options reads_stdin',
+                         defaults=({}, False))
+
+PIPELINE_TOKENS = re.compile(r'>>|[|>]|[^\s|>]+')
+
+
+def read_config(config_path):
+    root = ET.parse(config_path).getroot()
+    vfs_path = root.find('vfs_path').text
+    return {
+        'username': root.find('username').text,
+        'vfs_path': vfs_path,
+        'log_path': root.find('log_path').text,
+        'startup_script': root.find('startup_script').text,
+        'vfs_index': root.findtext('vfs_index', vfs_path + '.idx'),
+        'log_flush': parse_flush_policy(root.findtext('log_flush')),
+        'log_fsync': root.findtext('log_fsync', 'false').strip().lower() == 'true',
+    }
+
+
+class Pipeline:
+    __slots__ = ('text', 'stages', 'redirect', 'append', 'error', 'parse_seconds')
+
+    def __init__(self, text, stages, redirect=None, append=False, error=None):
+        self.text = text
+        self.stages = stages
+        self.redirect = redirect
+        self.append = append
+        self.error = error
+        self.parse_seconds = 0.0
+
+
 class ShellEmulator:
-    def __init__(self, config_path):
+    # команда -> метод, мин. и макс. число аргументов, ключи: ключ -> (параметр, есть ли значение)
+    COMMANDS = {
+        'ls': CommandSpec('iter_ls', 0, 0),
+        'cd': CommandSpec('iter_cd', 1, 1),
+        'cp': CommandSpec('iter_cp', 2, 2, {'-r': ('recursive', False), '-R': ('recursive', False)}),
+        'find': CommandSpec('iter_find', 0, 1, {'-name': ('name', True)}),
+        'du': CommandSpec('iter_du', 0, 1, {'-s': ('summarize', False)}),
+        'date': CommandSpec('iter_date', 0, 0),
+        'cat': CommandSpec('iter_cat', 0, None, {}, True),
+        'grep': CommandSpec('iter_grep', 1, 1, {'-v': ('invert', False), '-i': ('ignore_case', False)}, True),
+        'head': CommandSpec('iter_head', 0, 0, {'-n': ('n', True)}, True),
+        'wc': CommandSpec('iter_wc', 0, 0, {'-l': ('lines', False), '-w': ('words', False),
+                                            '-c': ('chars', False)}, True),
+        'sort': CommandSpec('iter_sort', 0, 0, {'-r': ('reverse', False)}, True),
+        'sync': CommandSpec('iter_sync', 0, 1),
+        'stats': CommandSpec('iter_stats', 0, 0),
+        'exit': CommandSpec('exit', 0, 0, {'--save': ('save', False)}),
+    }
+
+    def __init__(self, config_path, image=None, log_path=None):
+        # image — общий неизменяемый образ (режим сервера), сеанс держит только свой overlay
+        self.shared_image = image
         self.load_config(config_path)
+        if log_path is not None:
+            self.log_path = log_path
         self.current_path = '/'
+        self.stats = CommandStats()
+        self.output_seconds = 0.0
+        # Куда выводятся строки: None — print в sys.stdout, список — буфер вызывающего
+        # (сервер и пакетный режим собирают вывод сеанса без перехвата общего stdout)
+        self.output = None
+        self.profiler = None
         self.clear_log()
 
     def clear_log(self):
-        with open(self.log_path, 'w') as f:
-            f.write('<log></log>')
+        self.log = XmlLogWriter(self.log_path, self.log_flush, self.log_fsync)
+
+    def close(self):
+        if not self.log.closed and self.stats.commands:
+            self.log.write_raw(self.stats.to_xml())
+        self.log.close()
+        if self.vfs.image is not self.shared_image:
+            self.vfs.image.close()
 
     def load_config(self, config_path):
-        tree = ET.parse(config_path)
-        root = tree.getroot()
-        self.username = root.find('username').text
-        self.vfs_path = root.find('vfs_path').text
-        self.log_path = root.find('log_path').text
-        self.startup_script = root.find('startup_script').text
-        self.extract_vfs()
-
-    def extract_vfs(self):
-        with tarfile.open(self.vfs_path, 'r') as tar:
-            tar.extractall(path='vfs')
-
-    def log_command(self, command):
-        entry = ET.Element('entry')
-        user_elem = ET.SubElement(entry, 'user')
-        user_elem.text = self.username
-        command_elem = ET.SubElement(entry, 'command')
-        command_elem.text = command
-        timestamp_elem = ET.SubElement(entry, 'timestamp')
-        timestamp_elem.text = datetime.datetime.now().isoformat()
-
-        if os.path.exists(self.log_path):
-            tree = ET.parse(self.log_path)
-            root = tree.getroot()
-            root.append(entry)
+        for name, value in read_config(config_path).items():
+            setattr(self, name, value)
+        self.load_vfs()
+
+    def load_vfs(self):
+        if self.shared_image is not None:
+            self.vfs = VirtualFileSystem(self.shared_image)
         else:
-            root = ET.Element('log')
-            root.append(entry)
+            self.vfs = VirtualFileSystem(TarImage(self.vfs_path, self.vfs_index))
 
-        xml_str = minidom.parseString(ET.tostring(root)).toprettyxml(indent="    ")
-        xml_str = "\n".join(line for line in xml_str.splitlines() if line.strip())
-        with open(self.log_path, 'w') as f:
-            f.write(xml_str)
+    def log_command(self, command, timing=None):
+        self.log.write_entry(self.username, command, datetime.datetime.now().isoformat(), timing)
 
     def ls(self):
-        files = os.listdir('vfs' + self.current_path)
-        for f in files:
-            print(f)
+        self._print(self.iter_ls())
         self.log_command('ls')
 
     def cd(self, path):
-        new_path = os.path.join(self.current_path, path)
-        if os.path.isdir('vfs' + new_path):
-            self.current_path = new_path
-        else:
-            print(f"No such directory: {path}")
+        self._print(self.iter_cd(path))
         self.log_command(f'cd {path}')
 
-    def cp(self, src, dest):
-        if os.path.isdir(dest):
-            src_path = 'vfs' + os.path.join(self.current_path, src)
-            dest_path= dest
-            if os.path.isfile(src_path):
-                shutil.copy(src_path, dest_path)
-                print(f"Copied {src} to {dest}")
-            else:
-                print(f"No such file: {src}")
+    def cp(self, src, dest, recursive=False):
+        self._print(self.iter_cp(src, dest, recursive))
+        self.log_command(f'cp -r {src} {dest}' if recursive else f'cp {src} {dest}')
+
+    def find(self, path='.', name=None):
+        self._print(self.iter_find(path, name))
+        self.log_command(f'find {path} -name {name}' if name else f'find {path}')
+
+    def du(self, path='.', summarize=False):
+        self._print(self.iter_du(path, summarize))
+        self.log_command(f'du -s {path}' if summarize else f'du {path}')
+
+    def date(self):
+        self._print(self.iter_date())
+        self.log_command('date')
+
+    def _print(self, lines):
+        output = 0.0
+        if self.output is None:
+            for line in lines:
+                start = time.perf_counter()
+                print(line)
+                output += time.perf_counter() - start
         else:
-            if dest.find('/')==-1:
-                src_path ='vfs'+os.path.join(self.current_path, src)
-                dest_path ='vfs'+os.path.join(self.current_path, dest)
-                # cd привет/документы
-                # cp документ.txt документ1.txt
-                if os.path.isfile(src_path):
-                    shutil.copy(src_path, dest_path)
-                    print(f" {src} is copied with name {dest}")
+            append = self.output.append
+            for line in lines:
+                start = time.perf_counter()
+                append(line)
+                output += time.perf_counter() - start
+        self.output_seconds += output
+
+    def iter_ls(self):
+        return iter(self.vfs.listdir(self.current_path))
+
+    def iter_cd(self, path):
+        new_path = self.vfs.resolve(self.current_path, path)
+        if self.vfs.is_dir(new_path):
+            # как cd -P: текущий каталог хранится без символических ссылок
+            self.current_path = self.vfs.realpath(new_path)
+            return []
+        return [f"No such directory: {path}"]
+
+    def iter_cp(self, src, dest, recursive=False):
+        src_path = self.vfs.resolve(self.current_path, src)
+        dest_path = self.vfs.resolve(self.current_path, dest)
+        copyable = self.vfs.is_file(src_path) or (recursive and self.vfs.is_dir(src_path))
+        if self.vfs.is_dir(dest_path) or os.path.isdir(dest):
+            if copyable:
+                name = posixpath.basename(src_path)
+                if self.vfs.is_dir(dest_path):
+                    error = self._copy(src_path, posixpath.join(dest_path, name))
                 else:
-                    print(f"No such file: {src}")
+                    error = None
+                    if self.vfs.is_dir(src_path):
+                        self.vfs.export_tree(src_path, os.path.join(dest, name))
+                    else:
+                        self.vfs.export(src_path, os.path.join(dest, name))
+                return [error or f"Copied {src} to {dest}"]
+            return [f"No such file: {src}"]
+        if dest.find('/')==-1:
+            # cd привет/документы
+            # cp документ.txt документ1.txt
+            if copyable:
+                return [self._copy(src_path, dest_path) or f" {src} is copied with name {dest}"]
+            return [f"No such file: {src}"]
+        return [f"No such directory: {dest}"]
+
+    def _copy(self, src_path, dest_path):
+        if not self.vfs.is_dir(src_path):
+            self.vfs.copy(src_path, dest_path)
+        elif dest_path == src_path or dest_path.startswith(src_path.rstrip('/') + '/'):
+            return f"Cannot copy {src_path} into itself"
+        else:
+            self.vfs.copytree(src_path, dest_path)
+        return None
+
+    def iter_find(self, path='.', name=None):
+        root = self.vfs.resolve(self.current_path, path)
+        if not self.vfs.exists(root):
+            yield f"No such file or directory: {path}"
+            return
+        for found in self.vfs.find(root, name):
+            rel = found[len(root):].lstrip('/')
+            yield posixpath.join(path, rel) if rel else path
+
+    def iter_du(self, path='.', summarize=False):
+        root = self.vfs.resolve(self.current_path, path)
+        if not self.vfs.exists(root):
+            yield f"No such file or directory: {path}"
+        elif summarize or not self.vfs.is_dir(root):
+            yield f"{self.vfs.disk_usage(root)}\t{path}"
+        else:
+            dirs = [found for found, entry in self.vfs.walk(root) if entry.is_dir]
+            for found in reversed(dirs):
+                rel = found[len(root):].lstrip('/')
+                yield f"{self.vfs.disk_usage(found)}\t{posixpath.join(path, rel) if rel else path}"
+
+    def iter_date(self):
+        yield str(datetime.datetime.now())
+
+    def iter_cat(self, *paths, stdin=()):
+        if not paths:
+            yield from stdin
+        for path in paths:
+            file_path = self.vfs.resolve(self.current_path, path)
+            if self.vfs.is_file(file_path):
+                yield from self.vfs.iter_lines(file_path)
             else:
-                print(f"No such directory: {dest}")
-        self.log_command(f'cp {src} {dest}')
+                yield f"No such file: {path}"
 
-    def date(self):
-        print(datetime.datetime.now())
-        self.log_command('date')
+    def iter_grep(self, pattern, stdin=(), invert=False, ignore_case=False):
+        try:
+            regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        except re.error as e:
+            yield f"grep: invalid pattern: {e}"
+            return
+        search = regex.search
+        for line in stdin:
+            if (search(line) is None) == invert:
+                yield line
 
-    def run_command(self, command):
-        parts = command.split()
+    def iter_head(self, stdin=(), n='10'):
+        if not n.isdigit():
+            return iter([f"head: invalid number of lines: {n}"])
+        return itertools.islice(stdin, int(n))
+
+    def iter_wc(self, stdin=(), lines=False, words=False, chars=False):
+        line_count = word_count = char_count = 0
+        for line in stdin:
+            line_count += 1
+            word_count += len(line.split())
+            char_count += len(line) + 1
+        if not (lines or words or chars):
+            lines = words = chars = True
+        counts = [count for count, wanted in ((line_count, lines), (word_count, words),
+                                             (char_count, chars)) if wanted]
+        yield ' '.join(map(str, counts))
+
+    def iter_sort(self, stdin=(), reverse=False):
+        return iter(sorted(stdin, reverse=reverse))
+
+    def iter_stats(self):
+        return self.stats.lines()
+
+    def iter_sync(self, path=None):
+        target = self.vfs_path if path is None else path
+        if self.shared_image is not None and os.path.abspath(target) == os.path.abspath(self.vfs_path):
+            return ["sync: the shared image is read-only, give another archive path"]
+        try:
+            copied, written = self.vfs.save(target)
+        except OSError as e:
+            return [f"sync: {e}"]
+        if os.path.abspath(target) == os.path.abspath(self.vfs_path):
+            self.vfs.image.close()
+            self.load_vfs()
+        return [f"Saved {written} changed entries ({copied} unchanged) to {target}"]
+
+    def exit(self, save=False):
+        if save:
+            self._print(self.iter_sync())
+        self.close()
+        sys.exit()
+
+    def compile_command(self, command):
+        start = time.perf_counter()
+        pipeline = self._compile(command)
+        if pipeline is not None:
+            pipeline.parse_seconds = time.perf_counter() - start
+        return pipeline
+
+    def _compile(self, command):
+        tokens = PIPELINE_TOKENS.findall(command)
+        if not tokens:
+            return None
+        text = ' '.join(tokens)
+        redirect, append = None, False
+        if '>' in tokens or '>>' in tokens:
+            pos = tokens.index('>>') if '>>' in tokens else tokens.index('>')
+            if pos != len(tokens) - 2 or tokens[-1] in ('|', '>', '>>') or '|' in tokens[pos:]:
+                return Pipeline(text, [], error=f"Syntax error: {command.strip()}")
+            redirect, append = tokens[-1], tokens[pos] == '>>'
+            tokens = tokens[:pos]
+        stages = []
+        segment = []
+        for token in tokens + ['|']:
+            if token != '|':
+                segment.append(token)
+            elif not segment:
+                return Pipeline(text, [], error=f"Syntax error: {command.strip()}")
+            else:
+                stages.append(self.compile_stage(segment))
+                segment = []
+        return Pipeline(text, stages, redirect, append)
+
+    def compile_stage(self, parts):
         cmd = parts[0]
-        if cmd == 'ls':
-            self.ls()
-        elif cmd == 'cd' and len(parts) > 1:
-            self.cd(parts[1])
-        elif cmd == 'cp' and len(parts) > 2:
-            self.cp(parts[1], parts[2])
-        elif cmd == 'date':
-            self.date()
-        elif cmd == 'exit':
-            exit()
+        spec = self.COMMANDS.get(cmd)
+        if spec is None:
+            return cmd, None, parts[1:], None, False
+        args, kwargs = [], {}
+        words = iter(parts[1:])
+        for word in words:
+            option = spec.options.get(word)
+            if option is None:
+                args.append(word)
+            elif option[1]:
+                kwargs[option[0]] = next(words, None)
+            else:
+                kwargs[option[0]] = True
+        if len(args) < spec.min_args or None in kwargs.values():
+            return cmd, None, args, None, False
+        if spec.max_args is not None:
+            args = args[:spec.max_args]
+        return cmd, getattr(self, spec.method), args, kwargs, spec.reads_stdin
+
+    def enable_profiling(self, stats_path=None):
+        self.profiler = cProfile.Profile()
+        atexit.register(self.dump_profile, stats_path)
+
+    def dump_profile(self, stats_path=None):
+        if stats_path is not None:
+            self.profiler.dump_stats(stats_path)
+        else:
+            pstats.Stats(self.profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+
+    def execute(self, pipeline):
+        if self.profiler is not None:
+            return self.profiler.runcall(self._execute, pipeline)
+        return self._execute(pipeline)
+
+    def _execute(self, pipeline):
+        if pipeline.error:
+            self._print([pipeline.error])
+            return
+        for cmd, handler, args, kwargs, reads_stdin in pipeline.stages:
+            if handler is None:
+                self._print([f"Unknown command: {cmd}"])
+                return
+        vfs = self.vfs
+        vfs_before = vfs.lookup_seconds
+        self.output_seconds = 0.0
+        start = time.perf_counter()
+        lines = iter(())
+        for cmd, handler, args, kwargs, reads_stdin in pipeline.stages:
+            if reads_stdin:
+                lines = handler(*args, stdin=lines, **kwargs)
+            else:
+                lines = handler(*args, **kwargs)
+        if pipeline.redirect is None:
+            self._print(lines)
         else:
-            print(f"Unknown command: {cmd}")
+            self._print(self.redirect(lines, pipeline.redirect, pipeline.append))
+        executed = time.perf_counter()
+        timing = {
+            'parse': pipeline.parse_seconds,
+            'vfs': vfs.lookup_seconds - vfs_before,
+            'output': self.output_seconds,
+        }
+        timing['command'] = max(executed - start - timing['vfs'] - timing['output'], 0.0)
+        self.log_command(pipeline.text, timing)
+        timing['log'] = time.perf_counter() - executed
+        timing['total'] = sum(timing.values())
+        self.stats.record(pipeline.stages[0][0], timing)
+
+    def redirect(self, lines, target, append=False):
+        path = self.vfs.resolve(self.current_path, target)
+        if self.vfs.is_dir(path):
+            return [f"Is a directory: {target}"]
+        if not self.vfs.is_dir(posixpath.dirname(path)):
+            return [f"No such directory: {posixpath.dirname(target)}"]
+        data = ''.join(line + '\n' for line in lines).encode('utf-8')
+        if append and self.vfs.is_file(path):
+            data = self.vfs.read(path) + data
+        self.vfs.write(path, data)
+        return []
+
+    def run_command(self, command):
+        compiled = self.compile_command(command)
+        if compiled is not None:
+            self.execute(compiled)
+
+    def run_batch(self, lines):
+        commands = [c for c in map(self.compile_command, lines) if c is not None]
+        flush_policy = self.log.flush_policy
+        if flush_policy == FLUSH_ENTRY:
+            self.log.set_flush_policy(BATCH_LOG_FLUSH)
+        # Обработчики дописывают строки в список, в stdout он уходит одной записью на порцию
+        buffer = self.output = []
+        executed = 0
+        start = time.perf_counter()
+        try:
+            for compiled in commands:
+                self.execute(compiled)
+                executed += 1
+                if len(buffer) >= BATCH_OUTPUT_LINES:
+                    self._flush_output(buffer)
+        except SystemExit:
+            pass
+        finally:
+            self.output = None
+            self._flush_output(buffer)
+            sys.stdout.flush()
+            if not self.log.closed:
+                self.log.set_flush_policy(flush_policy)
+        elapsed = time.perf_counter() - start
+        rate = executed / elapsed if elapsed > 0 else float('inf')
+        print(f"{executed} commands in {elapsed:.3f} s ({rate:.0f} commands/sec)", file=sys.stderr)
+        return executed
+
+    def _flush_output(self, buffer):
+        if buffer:
+            sys.stdout.write('\n'.join(buffer) + '\n')
+            buffer.clear()
 
     def run(self):
         if os.path.exists(self.startup_script):
@@ -119,5 +445,22 @@ class ShellEmulator:
 
 
 if __name__ == '__main__':
-    emulator = ShellEmulator('config.xml')
-    emulator.run()
+    parser = argparse.ArgumentParser(description='Shell emulator')
+    parser.add_argument('-c', '--config', default='config.xml', help='Path to the XML config')
+    parser.add_argument('--batch', nargs='?', const='-', metavar='FILE',
+                        help='Run commands from FILE (or stdin) non-interactively')
+    parser.add_argument('--profile', nargs='?', const='', metavar='FILE',
+                        help='Profile command execution with cProfile; dump stats to FILE or stderr on exit')
+    args = parser.parse_args()
+    emulator = ShellEmulator(args.config)
+    if args.profile is not None:
+        emulator.enable_profiling(args.profile or None)
+    if args.batch is None:
+        emulator.run()
+    else:
+        if args.batch == '-':
+            emulator.run_batch(sys.stdin.read().splitlines())
+        else:
+            with open(args.batch) as f:
+                emulator.run_batch(f.read().splitlines())
+        emulator.close()
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import os
+
+from emulator import ShellEmulator, read_config
+from vfs import TarImage
+
+
+class ShellServer:
+    """Сервер сеансов эмулятора поверх TCP или Unix-сокета.
+
+    Все сеансы разделяют один разобранный образ TarImage; у каждого сеанса
+    свой copy-on-write overlay, текущий каталог, журнал и буфер вывода.
+    Команды выполняются в пуле потоков, так что долгая команда одного
+    сеанса не останавливает цикл событий и остальные сеансы.
+    """
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        config = read_config(config_path)
+        self.image = TarImage(config['vfs_path'], config['vfs_index'])
+        # mmap архива открывается заранее, а не лениво из потоков сеансов
+        self.image.raw(0, 0)
+        self.log_root, self.log_ext = os.path.splitext(config['log_path'])
+        self.session_ids = itertools.count(1)
+        self.sessions = {}
+
+    def open_session(self):
+        session_id = next(self.session_ids)
+        log_path = f"{self.log_root}.{session_id}{self.log_ext}"
+        session = ShellEmulator(self.config_path, image=self.image, log_path=log_path)
+        session.output = []
+        self.sessions[session_id] = session
+        return session_id, session
+
+    def close_session(self, session_id):
+        session = self.sessions.pop(session_id)
+        session.close()
+
+    def execute(self, session, command):
+        alive = True
+        try:
+            session.run_command(command)
+        except SystemExit:
+            alive = False
+        output = ''.join(line + '\n' for line in session.output)
+        session.output.clear()
+        return output, alive
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        session_id, session = self.open_session()
+        try:
+            alive = True
+            while alive:
+                writer.write(f"{session.username}@shell:{session.current_path}$ ".encode('utf-8'))
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    break
+                output, alive = await loop.run_in_executor(
+                    None, self.execute, session, line.decode('utf-8', errors='replace'))
+                writer.write(output.encode('utf-8'))
+        finally:
+            if session_id in self.sessions:
+                self.close_session(session_id)
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def serve(self, host='127.0.0.1', port=8022, unix_path=None):
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        for session_id in list(self.sessions):
+            self.close_session(session_id)
+        self.image.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-session shell emulator server')
+    parser.add_argument('-c', '--config', default='config.xml', help='Path to the XML config')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8022)
+    parser.add_argument('--unix', metavar='PATH', help='Listen on a Unix socket instead of TCP')
+    args = parser.parse_args()
+    server = ShellServer(args.config)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import math
+from collections import Counter
+
+PHASES = ('parse', 'vfs', 'command', 'output', 'log', 'total')
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с логарифмическими корзинами (шаг 4%).
+
+    Запись — O(1), память — по числу занятых корзин, перцентили с точностью до шага.
+    """
+    BASE = 1.04
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        nanoseconds = max(seconds * 1e9, 1.0)
+        self.buckets[int(math.log(nanoseconds, self.BASE))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Верхняя граница корзины, в которую попадает p-й перцентиль, в секундах."""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.BASE ** (bucket + 1) / 1e9, self.max)
+        return self.max
+
+
+class CommandStats:
+    """Счётчики команд и гистограммы задержек по фазам выполнения."""
+
+    def __init__(self):
+        self.commands = Counter()
+        self.phases = {phase: LatencyHistogram() for phase in PHASES}
+
+    def record(self, command, timings):
+        self.commands[command] += 1
+        for phase, seconds in timings.items():
+            self.phases[phase].record(seconds)
+
+    def lines(self):
+        total = sum(self.commands.values())
+        counts = ', '.join(f"{name} {count}" for name, count in self.commands.most_common())
+        yield f"commands: {total}" + (f" ({counts})" if counts else '')
+        yield f"{'phase':<8}{'p50_us':>10}{'p95_us':>10}{'p99_us':>10}{'max_us':>10}"
+        for phase, histogram in self.phases.items():
+            yield (f"{phase:<8}" + ''.join(f"{histogram.percentile(p) * 1e6:>10.1f}" for p in (50, 95, 99))
+                   + f"{histogram.max * 1e6:>10.1f}")
+
+    def to_xml(self):
+        lines = [f'    <stats commands="{sum(self.commands.values())}">\n']
+        for phase, histogram in self.phases.items():
+            lines.append(
+                f'        <phase name="{phase}" count="{histogram.count}"'
+                + ''.join(f' p{p}_us="{histogram.percentile(p) * 1e6:.1f}"' for p in (50, 95, 99))
+                + f' max_us="{histogram.max * 1e6:.1f}"/>\n'
+            )
+        lines.append('    </stats>\n')
+        return ''.join(lines)
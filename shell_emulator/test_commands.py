@@ -1,12 +1,23 @@
 import unittest
 from unittest.mock import patch
 from emulator import ShellEmulator
+from server import ShellServer
+from vfs import TarImage, archive_fingerprint
+from xml_log import XmlLogWriter, recover_log
+import xml.etree.ElementTree as ET
+import tempfile
+import tarfile
+import io
+import asyncio
 import os
 
 class TestShellEmulatorCommands(unittest.TestCase):
     def setUp(self):
         self.emulator = ShellEmulator('config.xml')
 
+    def tearDown(self):
+        self.emulator.close()
+
     def test_ls(self):
         with patch('builtins.print') as mock_print:
             self.emulator.ls()
@@ -25,9 +36,22 @@ class TestShellEmulatorCommands(unittest.TestCase):
 
     def test_cp_file(self):
         self.emulator.cd('hello/documents')
-        self.emulator.cp('file.txt', 'vfs/my_folder')
-        self.assertTrue(os.path.isfile('vfs/my_folder/file.txt'))
-        os.remove('vfs/my_folder/file.txt')
+        self.emulator.cp('file.txt', '/my_folder')
+        self.assertTrue(self.emulator.vfs.is_file('/my_folder/file.txt'))
+        self.assertEqual(self.emulator.vfs.read('/my_folder/file.txt'),
+                         self.emulator.vfs.read('/hello/documents/file.txt'))
+
+    def test_cp_file_to_host(self):
+        self.emulator.cd('hello/documents')
+        with tempfile.TemporaryDirectory() as tmp:
+            self.emulator.cp('file.txt', tmp)
+            with open(os.path.join(tmp, 'file.txt'), 'rb') as f:
+                self.assertEqual(f.read(), self.emulator.vfs.read('/hello/documents/file.txt'))
+
+    def test_cd_parent(self):
+        self.emulator.cd('hello/documents')
+        self.emulator.cd('..')
+        self.assertEqual(self.emulator.current_path, '/hello')
 
     def test_cp_file_not_found(self):
         with patch('builtins.print') as mock_print:
@@ -35,10 +59,312 @@ class TestShellEmulatorCommands(unittest.TestCase):
             self.emulator.cp('nonexistent.txt', 'destination.txt')
             mock_print.assert_called_once_with('No such file: nonexistent.txt')
 
+    def test_cp_recursive(self):
+        self.emulator.run_command('cp -r hello/documents my_folder')
+        self.assertTrue(self.emulator.vfs.is_dir('/my_folder/documents'))
+        self.assertTrue(self.emulator.vfs.is_file('/my_folder/documents/file.txt'))
+        with patch('builtins.print') as mock_print:
+            self.emulator.run_command('cp -r hello hello/documents')
+            mock_print.assert_called_once_with('Cannot copy /hello into itself')
+
+    def test_find(self):
+        with patch('builtins.print') as mock_print:
+            self.emulator.run_command('find . -name *.txt')
+            self.assertEqual([c.args[0] for c in mock_print.call_args_list],
+                             ['./hello/documents/._file.txt', './hello/documents/file.txt'])
+
+    def test_find_missing_path(self):
+        with patch('builtins.print') as mock_print:
+            self.emulator.find('nowhere')
+            mock_print.assert_called_once_with('No such file or directory: nowhere')
+
+    def test_du(self):
+        vfs = self.emulator.vfs
+        total = vfs.disk_usage('/')
+        self.assertEqual(total, 6148 + 670 + 54 + 120 + 6148)
+        with patch('builtins.print') as mock_print:
+            self.emulator.du('hello', summarize=True)
+            mock_print.assert_called_once_with(f'{total}\thello')
+        self.emulator.cp('hello/documents/file.txt', '/my_folder')
+        self.assertEqual(vfs.disk_usage('/'), total + 54)
+        self.assertEqual(vfs.disk_usage('/hello'), total)
+        self.assertNotIn('/hello', vfs.dirty)
+
     def test_date(self):
         with patch('builtins.print') as mock_print:
             self.emulator.date()
             mock_print.assert_called_once()
 
+    def test_vfs_chunks_are_views(self):
+        chunks = list(self.emulator.vfs.iter_chunks('/hello/documents/file.txt', chunk_size=16))
+        self.assertTrue(all(isinstance(chunk, memoryview) and len(chunk) <= 16 for chunk in chunks))
+        self.assertEqual(b''.join(chunks), self.emulator.vfs.read('/hello/documents/file.txt'))
+
+    def test_vfs_index_cache(self):
+        image = TarImage(self.emulator.vfs_path, self.emulator.vfs_index)
+        self.assertTrue(os.path.isfile(self.emulator.vfs_index))
+        with patch.object(TarImage, 'scan') as mock_scan:
+            cached = TarImage(self.emulator.vfs_path, self.emulator.vfs_index)
+            mock_scan.assert_not_called()
+        self.assertEqual(cached.children, image.children)
+        entry = cached.entries['/hello/documents/file.txt']
+        self.assertEqual(cached.read(entry), image.read(image.entries['/hello/documents/file.txt']))
+        image.close()
+        cached.close()
+
+    def test_vfs_index_rebuilt_on_change(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = os.path.join(tmp, 'vfs.idx')
+            with open(index_path, 'wb') as f:
+                f.write(b'stale index')
+            image = TarImage(self.emulator.vfs_path, index_path)
+            self.assertIn('/hello/documents', image.entries)
+            fingerprint = archive_fingerprint(self.emulator.vfs_path)
+            self.assertTrue(image.load_index(index_path, fingerprint))
+            self.assertFalse(image.load_index(index_path, (0, 0, fingerprint[2])))
+            image.close()
+
+    def test_pipeline(self):
+        with patch('builtins.print') as mock_print:
+            self.emulator.run_command('find / -name *.txt | grep -v /\\._ | wc -l')
+            mock_print.assert_called_once_with('1')
+        with patch('builtins.print') as mock_print:
+            self.emulator.run_command('ls|sort -r|head -n 1')
+            mock_print.assert_called_once_with('my_folder')
+
+    def test_pipeline_head_stops_upstream(self):
+        walked = []
+        walk = self.emulator.vfs.walk
+
+        def tracking_walk(path):
+            for item in walk(path):
+                walked.append(item[0])
+                yield item
+
+        with patch.object(self.emulator.vfs, 'walk', tracking_walk), patch('builtins.print'):
+            self.emulator.run_command('find / | head -n 2')
+        self.assertEqual(len(walked), 2)
+
+    def test_redirect(self):
+        self.emulator.run_command('ls > /my_folder/listing.txt')
+        self.emulator.run_command('date >> /my_folder/listing.txt')
+        with patch('builtins.print') as mock_print:
+            self.emulator.run_command('cat /my_folder/listing.txt | head -n 2')
+            self.assertEqual([c.args[0] for c in mock_print.call_args_list], ['my_folder', 'hello'])
+        self.assertEqual(len(list(self.emulator.vfs.iter_lines('/my_folder/listing.txt'))), 3)
+
+    def test_sync_to_new_archive(self):
+        self.emulator.cp('hello/documents/file.txt', 'copy.txt')
+        self.emulator.run_command('ls > hello/documents/file.txt')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'saved.tar')
+            with patch('builtins.print') as mock_print:
+                self.emulator.run_command(f'sync {path}')
+                mock_print.assert_called_once_with(f'Saved 2 changed entries (7 unchanged) to {path}')
+            with tarfile.open(path) as tar:
+                names = tar.getnames()
+                self.assertEqual(tar.extractfile('copy.txt').read(),
+                                 self.emulator.vfs.image.read(
+                                     self.emulator.vfs.image.entries['/hello/documents/file.txt']))
+                self.assertEqual(tar.extractfile('hello/documents/file.txt').read(), b'my_folder\nhello\ncopy.txt\n')
+            self.assertEqual(names.count('hello/documents/file.txt'), 1)
+            self.assertEqual(names[-1], 'copy.txt')
+            saved = TarImage(path)
+            self.assertEqual(saved.children['/hello/documents'],
+                             self.emulator.vfs.image.children['/hello/documents'])
+            prefix = self.emulator.vfs.image.entries['/hello/documents/file.txt'].header_offset
+            self.assertEqual(saved.raw(0, prefix), self.emulator.vfs.image.raw(0, prefix))
+            saved.close()
+
+    def make_links_archive(self, tmp):
+        path = os.path.join(tmp, 'links.tar')
+        with tarfile.open(path, 'w', format=tarfile.PAX_FORMAT, pax_headers={'comment': 'links'}) as tar:
+            for name, kind, target in [('d', tarfile.DIRTYPE, ''), ('d/sub', tarfile.DIRTYPE, ''),
+                                       ('d/sub/file.txt', tarfile.REGTYPE, ''),
+                                       ('d/link', tarfile.SYMTYPE, 'sub'),
+                                       ('d/hard.txt', tarfile.LNKTYPE, 'd/sub/file.txt'),
+                                       ('d/fifo', tarfile.FIFOTYPE, '')]:
+                info = tarfile.TarInfo(name)
+                info.type = kind
+                info.linkname = target
+                data = b'linked\n' if kind == tarfile.REGTYPE else b''
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return path
+
+    def test_links(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self.make_links_archive(tmp)
+            index_path = os.path.join(tmp, 'links.idx')
+            image = TarImage(path, index_path)
+            cached = TarImage(path, index_path)
+            self.assertEqual(cached.entries['/d/link'].link, 'sub')
+            self.assertTrue(cached.entries['/d/hard.txt'].hardlink)
+            emulator = ShellEmulator('config.xml', image=cached)
+            try:
+                emulator.cd('d')
+                with patch('builtins.print') as mock_print:
+                    emulator.ls()
+                    self.assertEqual([c.args[0] for c in mock_print.call_args_list], ['sub', 'link', 'hard.txt'])
+                emulator.cd('link')
+                self.assertEqual(emulator.current_path, '/d/sub')
+                with patch('builtins.print') as mock_print:
+                    emulator.run_command('cat /d/link/file.txt /d/hard.txt')
+                    self.assertEqual([c.args[0] for c in mock_print.call_args_list], ['linked', 'linked'])
+                emulator.cp('/d/hard.txt', '/')
+                self.assertEqual(emulator.vfs.read('/hard.txt'), b'linked\n')
+                emulator.run_command('ls > /d/link/listing.txt')
+                self.assertTrue(emulator.vfs.is_file('/d/sub/listing.txt'))
+            finally:
+                emulator.close()
+                image.close()
+                cached.close()
+
+    def test_find_du_through_link(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            image = TarImage(self.make_links_archive(tmp))
+            emulator = ShellEmulator('config.xml', image=image)
+            try:
+                with patch('builtins.print') as mock_print:
+                    emulator.run_command('find /d/link/file.txt')
+                    emulator.run_command('find /d/link')
+                    emulator.run_command('du /d/link/file.txt')
+                    emulator.run_command('du /d/link')
+                    self.assertEqual([c.args[0] for c in mock_print.call_args_list],
+                                     ['/d/link/file.txt', '/d/link', '/d/link/file.txt',
+                                      '7\t/d/link/file.txt', '7\t/d/link'])
+            finally:
+                emulator.close()
+                image.close()
+
+    def test_sync_keeps_links(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self.make_links_archive(tmp)
+            image = TarImage(path)
+            emulator = ShellEmulator('config.xml', image=image)
+            try:
+                emulator.run_command('ls / > /d/sub/file.txt')
+                saved_path = os.path.join(tmp, 'saved.tar')
+                with patch('builtins.print') as mock_print:
+                    emulator.run_command(f'sync {saved_path}')
+                    mock_print.assert_called_once_with(f'Saved 1 changed entries (4 unchanged) to {saved_path}')
+            finally:
+                emulator.close()
+                image.close()
+            with tarfile.open(saved_path) as tar:
+                self.assertEqual(tar.pax_headers, {'comment': 'links'})
+                members = {member.name: member for member in tar}
+                self.assertEqual(list(members), ['d', 'd/sub', 'd/sub/file.txt', 'd/link', 'd/hard.txt', 'd/fifo'])
+                self.assertTrue(members['d/link'].issym())
+                self.assertEqual(members['d/link'].linkname, 'sub')
+                self.assertTrue(members['d/hard.txt'].islnk())
+                self.assertTrue(members['d/fifo'].isfifo())
+                self.assertEqual(tar.extractfile('d/hard.txt').read(), b'd\n')
+
+    def test_server_sessions_are_isolated(self):
+        server = ShellServer('config.xml')
+        try:
+            first_id, first = server.open_session()
+            second_id, second = server.open_session()
+            self.assertIs(first.vfs.image, second.vfs.image)
+            server.execute(first, 'cp hello/documents/file.txt copy.txt')
+            server.execute(first, 'cd hello')
+            self.assertTrue(first.vfs.is_file('/copy.txt'))
+            self.assertFalse(second.vfs.is_file('/copy.txt'))
+            self.assertEqual(second.current_path, '/')
+            with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+                self.assertEqual(server.execute(second, 'ls')[0], 'my_folder\nhello\n')
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertEqual(server.execute(first, 'sync'),
+                             ('sync: the shared image is read-only, give another archive path\n', True))
+            self.assertEqual(server.execute(second, 'exit'), ('', False))
+            self.assertNotEqual(first.log_path, second.log_path)
+        finally:
+            server.close()
+        for session in (first, second):
+            os.remove(session.log_path)
+
+    def test_server_over_socket(self):
+        async def client(path):
+            reader, writer = await asyncio.open_unix_connection(path)
+            await reader.readuntil(b'$ ')
+            writer.write(b'cd hello\nls\nexit\n')
+            data = await reader.read()
+            writer.close()
+            return data.decode('utf-8')
+
+        async def scenario(server, path):
+            task = asyncio.ensure_future(server.serve(unix_path=path))
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+            try:
+                return await client(path)
+            finally:
+                task.cancel()
+
+        server = ShellServer('config.xml')
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                output = asyncio.run(scenario(server, os.path.join(tmp, 'shell.sock')))
+            finally:
+                server.close()
+        os.remove(f'{server.log_root}.1{server.log_ext}')
+        self.assertEqual(output, 'user@shell:/hello$ .DS_Store\ndocuments\nuser@shell:/hello$ ')
+
+    def test_run_batch(self):
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                patch('sys.stderr', new_callable=io.StringIO) as stderr, \
+                patch('builtins.print', wraps=print) as mock_print:
+            executed = self.emulator.run_batch(['cd hello/documents', '', 'ls', 'cd', 'exit', 'date'])
+        self.assertEqual(executed, 3)
+        # вывод команд идёт через буфер, print — только итоговая строка в stderr
+        mock_print.assert_called_once()
+        self.assertEqual(self.emulator.current_path, '/hello/documents')
+        self.assertIn('file.txt\n', stdout.getvalue())
+        self.assertIn('Unknown command: cd\n', stdout.getvalue())
+        self.assertIn('commands/sec', stderr.getvalue())
+
+    def test_log_is_valid_xml(self):
+        self.emulator.ls()
+        self.emulator.date()
+        self.emulator.close()
+        entries = ET.parse(self.emulator.log_path).getroot().findall('entry')
+        self.assertEqual([e.find('command').text for e in entries], ['ls', 'date'])
+
+    def test_log_records_timings(self):
+        self.emulator.run_command('cd hello')
+        self.emulator.run_command('find . | wc -l')
+        self.emulator.close()
+        root = ET.parse(self.emulator.log_path).getroot()
+        timing = root.find('entry').find('timing')
+        self.assertEqual(set(timing.attrib), {'parse_us', 'vfs_us', 'command_us', 'output_us'})
+        phases = {phase.get('name'): phase for phase in root.find('stats')}
+        self.assertEqual(phases['total'].get('count'), '2')
+        self.assertLessEqual(float(phases['total'].get('p50_us')), float(phases['total'].get('max_us')))
+
+    def test_stats_command(self):
+        self.emulator.run_command('ls')
+        with patch('builtins.print') as mock_print:
+            self.emulator.run_command('stats')
+        lines = [c.args[0] for c in mock_print.call_args_list]
+        self.assertEqual(lines[0], 'commands: 1 (ls 1)')
+        self.assertEqual(lines[1].split(), ['phase', 'p50_us', 'p95_us', 'p99_us', 'max_us'])
+        self.assertEqual([line.split()[0] for line in lines[2:]],
+                         ['parse', 'vfs', 'command', 'output', 'log', 'total'])
+
+    def test_log_recover_after_crash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'log.xml')
+            with open(path, 'w') as f:
+                f.write('<?xml version="1.0" ?>\n<log>\n    <entry>\n'
+                        '        <user>user</user>\n        <command>cd &lt;dir&gt;</command>\n'
+                        '        <timestamp>2024-01-01T00:00:00</timestamp>\n    </entry>\n')
+            self.assertTrue(recover_log(path))
+            log = XmlLogWriter(path, append=True)
+            log.write_entry('user', 'date', '2024-01-01T00:00:01')
+            log.close()
+            entries = ET.parse(path).getroot().findall('entry')
+            self.assertEqual([e.find('command').text for e in entries], ['cd <dir>', 'date'])
+
     if __name__ == '__main__':
         unittest.main()
\ No newline at end of file
@@ -0,0 +1,511 @@
+import fnmatch
+import hashlib
+import mmap
+import os
+import posixpath
+import struct
+import tarfile
+import time
+from time import perf_counter
+
+INDEX_MAGIC = b'VFSIDX04'
+INDEX_HEADER = struct.Struct('<8sQq16sQI')
+INDEX_RECORD = struct.Struct('<qqQIdBII')
+FINGERPRINT_SAMPLE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = tarfile.BLOCKSIZE
+# Тип записи в индексе
+KIND_FILE, KIND_DIR, KIND_SYMLINK, KIND_HARDLINK = range(4)
+# Предел переходов по символическим ссылкам при разрешении пути, как MAXSYMLINKS в Linux
+MAX_LINK_HOPS = 40
+
+
+class VfsEntry:
+    """Файл, каталог или ссылка виртуальной файловой системы.
+
+    Для файлов из архива хранится смещение содержимого (offset) и размер,
+    для изменённых файлов — сами данные (data). У ссылок link — цель в том
+    виде, как она записана в архиве: у символических относительно каталога
+    ссылки, у жёстких — от корня архива.
+    """
+    __slots__ = ('path', 'is_dir', 'mode', 'mtime', 'size', 'offset', 'header_offset', 'data',
+                 'link', 'hardlink')
+
+    def __init__(self, path, is_dir, mode, mtime, size=0, offset=-1, header_offset=-1, data=None,
+                 link=None, hardlink=False):
+        self.path = path
+        self.is_dir = is_dir
+        self.mode = mode
+        self.mtime = mtime
+        self.size = size
+        self.offset = offset
+        self.header_offset = header_offset
+        self.data = data
+        self.link = link
+        self.hardlink = hardlink
+
+    @property
+    def kind(self):
+        if self.link is not None:
+            return KIND_HARDLINK if self.hardlink else KIND_SYMLINK
+        return KIND_DIR if self.is_dir else KIND_FILE
+
+    def link_target(self):
+        """Абсолютный путь цели ссылки внутри образа."""
+        if self.hardlink:
+            return normalize(self.link)
+        return normalize(posixpath.join(posixpath.dirname(self.path), self.link))
+
+
+def normalize(path):
+    path = posixpath.normpath('/' + path)
+    if path.startswith('//'):
+        path = '/' + path.lstrip('/')
+    return path
+
+
+def archive_fingerprint(tar_path):
+    """Размер, mtime и хеш начала и конца архива — ключ кеша индекса."""
+    stat = os.stat(tar_path)
+    digest = hashlib.blake2b(str(stat.st_size).encode(), digest_size=16)
+    with open(tar_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_SAMPLE))
+        if stat.st_size > FINGERPRINT_SAMPLE:
+            f.seek(max(FINGERPRINT_SAMPLE, stat.st_size - FINGERPRINT_SAMPLE))
+            digest.update(f.read())
+    return stat.st_size, stat.st_mtime_ns, digest.digest()
+
+
+def _padded(size):
+    return (size + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+
+class TarImage:
+    """Неизменяемый индекс tar-архива: заголовки читаются один раз, архив не распаковывается."""
+
+    def __init__(self, tar_path, index_path=None):
+        self.tar_path = tar_path
+        self.entries = {'/': VfsEntry('/', True, 0o755, 0)}
+        self.children = {'/': []}
+        self.file = None
+        self.map = None
+        self.du_cache = {}
+        # есть ли в образе ссылки: без них пути разрешаются простым поиском
+        self.has_links = False
+        # конец последнего члена архива, до блоков-терминаторов
+        self.data_end = 0
+        if index_path is None:
+            self.scan()
+            return
+        fingerprint = archive_fingerprint(tar_path)
+        if not self.load_index(index_path, fingerprint):
+            self.scan()
+            self.save_index(index_path, fingerprint)
+
+    def scan(self):
+        with tarfile.open(self.tar_path, 'r') as tar:
+            for member in tar:
+                if member.isdir():
+                    entry = VfsEntry(normalize(member.name), True, member.mode, member.mtime,
+                                     0, member.offset_data, member.offset)
+                elif member.isreg():
+                    entry = VfsEntry(normalize(member.name), False, member.mode, member.mtime,
+                                     member.size, member.offset_data, member.offset)
+                elif member.issym() or member.islnk():
+                    entry = VfsEntry(normalize(member.name), False, member.mode, member.mtime,
+                                     0, member.offset_data, member.offset,
+                                     link=member.linkname, hardlink=member.islnk())
+                else:
+                    continue
+                if entry.path != '/':
+                    self.add(entry)
+            # tarfile останавливается на блоках-терминаторах
+            self.data_end = tar.offset
+
+    def add(self, entry):
+        parent = posixpath.dirname(entry.path)
+        if parent not in self.entries:
+            self.add(VfsEntry(parent, True, 0o755, entry.mtime))
+        if entry.path not in self.entries:
+            self.children[parent].append(posixpath.basename(entry.path))
+        elif self.entries[entry.path].is_dir and not entry.is_dir:
+            del self.children[entry.path]
+        self.entries[entry.path] = entry
+        if entry.is_dir:
+            self.children.setdefault(entry.path, [])
+        elif entry.link is not None:
+            self.has_links = True
+
+    def load_index(self, index_path, fingerprint):
+        try:
+            with open(index_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, size, mtime_ns, digest, data_end, count = INDEX_HEADER.unpack_from(mm)
+                if magic != INDEX_MAGIC or (size, mtime_ns, digest) != fingerprint:
+                    return False
+                self.data_end = data_end
+                records_end = INDEX_HEADER.size + count * INDEX_RECORD.size
+                paths = mm[records_end:].decode('utf-8')
+                records = INDEX_RECORD.iter_unpack(mm[INDEX_HEADER.size:records_end])
+                start = 0
+                for header_offset, offset, size, mode, mtime, kind, path_len, link_len in records:
+                    path = paths[start:start + path_len]
+                    start += path_len
+                    link = None
+                    if kind == KIND_SYMLINK or kind == KIND_HARDLINK:
+                        link = paths[start:start + link_len]
+                        start += link_len
+                    self.add(VfsEntry(path, kind == KIND_DIR, mode, mtime, size, offset, header_offset,
+                                      link=link, hardlink=kind == KIND_HARDLINK))
+        except (OSError, ValueError, struct.error):
+            self.entries = {'/': VfsEntry('/', True, 0o755, 0)}
+            self.children = {'/': []}
+            return False
+        return True
+
+    def save_index(self, index_path, fingerprint):
+        entries = [entry for entry in self.entries.values() if entry.path != '/']
+        # за путём ссылки сразу следует её цель
+        paths = [entry.path + (entry.link or '') for entry in entries]
+        records = b''.join(
+            INDEX_RECORD.pack(entry.header_offset, entry.offset, entry.size, entry.mode,
+                              entry.mtime, entry.kind, len(entry.path), len(entry.link or ''))
+            for entry in entries
+        )
+        tmp_path = index_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, *fingerprint, self.data_end, len(entries)))
+                f.write(records)
+                f.write(''.join(paths).encode('utf-8'))
+            os.replace(tmp_path, index_path)
+        except OSError:
+            pass
+
+    def disk_usage(self, path):
+        size = self.du_cache.get(path)
+        if size is None:
+            entry = self.entries[path]
+            if entry.is_dir:
+                size = sum(self.disk_usage(posixpath.join(path, name)) for name in self.children[path])
+                self.du_cache[path] = size
+            else:
+                size = entry.size
+        return size
+
+    def view(self, entry):
+        """memoryview содержимого файла поверх mmap архива, без копирования."""
+        return self.raw(entry.offset, entry.offset + entry.size)
+
+    def raw(self, start, end):
+        if self.map is None:
+            self.file = open(self.tar_path, 'rb')
+            if os.fstat(self.file.fileno()).st_size:
+                self.map = memoryview(mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ))
+            else:
+                self.map = memoryview(b'')
+        return self.map[start:end]
+
+    def members(self):
+        """Записи, имеющие собственный заголовок в архиве, в порядке следования.
+
+        Для каждой возвращается (запись, конец её байтового диапазона).
+        """
+        members = [entry for entry in self.entries.values() if entry.header_offset >= 0]
+        members.sort(key=lambda entry: entry.header_offset)
+        for entry in members:
+            yield entry, entry.offset + _padded(entry.size)
+
+    def read(self, entry):
+        return bytes(self.view(entry))
+
+    def close(self):
+        if self.map is not None:
+            mapped = self.map.obj
+            self.map.release()
+            self.map = None
+            if isinstance(mapped, mmap.mmap):
+                try:
+                    mapped.close()
+                except BufferError:
+                    # Остались живые срезы — mmap закроется вместе с ними.
+                    pass
+            self.file.close()
+            self.file = None
+
+
+class VirtualFileSystem:
+    """Представление образа с copy-on-write слоем для изменений текущего сеанса."""
+
+    def __init__(self, image):
+        self.image = image
+        self.overlay = {}
+        self.overlay_children = {}
+        # каталоги, в поддереве которых есть изменения сеанса
+        self.dirty = set()
+        self.du_cache = {}
+        # суммарное время поиска путей, для статистики команд
+        self.lookup_seconds = 0.0
+        self.has_links = image.has_links
+
+    def resolve(self, cwd, path):
+        return normalize(posixpath.join(cwd, path))
+
+    def lookup(self, path):
+        start = perf_counter()
+        entry = self.overlay.get(path)
+        if entry is None:
+            entry = self.image.entries.get(path)
+        self.lookup_seconds += perf_counter() - start
+        return entry
+
+    def realpath(self, path):
+        """Путь без символических ссылок ни в одном компоненте; None, если его нет."""
+        if not self.has_links:
+            return path if self.lookup(path) is not None else None
+        parts = path.strip('/').split('/')
+        parts.reverse()
+        resolved = '/'
+        hops = 0
+        while parts:
+            name = parts.pop()
+            if not name or name == '.':
+                continue
+            if name == '..':
+                resolved = posixpath.dirname(resolved)
+                continue
+            candidate = posixpath.join(resolved, name)
+            entry = self.lookup(candidate)
+            if entry is None:
+                return None
+            if entry.link is not None:
+                hops += 1
+                if hops > MAX_LINK_HOPS:
+                    return None
+                # остаток пути разрешается от цели ссылки
+                parts.extend(reversed(entry.link_target().strip('/').split('/')))
+                resolved = '/'
+                continue
+            resolved = candidate
+        return resolved
+
+    def stat(self, path):
+        """Запись по пути с переходом по ссылкам, как stat(2); None, если пути нет."""
+        entry = self.lookup(path)
+        if entry is not None and entry.link is None or not self.has_links:
+            return entry
+        real = self.realpath(path)
+        return None if real is None else self.lookup(real)
+
+    def exists(self, path):
+        return self.lookup(path) is not None or self.stat(path) is not None
+
+    def is_dir(self, path):
+        entry = self.stat(path)
+        return entry is not None and entry.is_dir
+
+    def is_file(self, path):
+        entry = self.stat(path)
+        return entry is not None and not entry.is_dir
+
+    def listdir(self, path):
+        if self.has_links and path not in self.image.children and path not in self.overlay_children:
+            # каталог, в пути к которому есть символическая ссылка
+            path = self.realpath(path) or path
+        names = list(self.image.children.get(path, ()))
+        added = self.overlay_children.get(path)
+        if added:
+            names.extend(added)
+        return names
+
+    def walk(self, path):
+        """Обход поддерева в прямом порядке: (путь, запись).
+
+        Ссылки в пути к корню и сам корень разрешаются, пути выдаются от переданного корня;
+        ссылки внутри поддерева не раскрываются.
+        """
+        root = self.realpath(path) if self.has_links else path
+        if root is None:
+            return
+        if root != path:
+            for found, entry in self.walk(root):
+                rel = found[len(root):].lstrip('/')
+                yield (posixpath.join(path, rel) if rel else path), entry
+            return
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            entry = self.lookup(path)
+            yield path, entry
+            if entry.is_dir:
+                stack.extend(posixpath.join(path, name) for name in reversed(self.listdir(path)))
+
+    def find(self, path, pattern=None):
+        for found, entry in self.walk(path):
+            if pattern is None or fnmatch.fnmatchcase(posixpath.basename(found), pattern):
+                yield found
+
+    def disk_usage(self, path):
+        """Размер поддерева; для неизменённых каталогов берётся из кеша образа.
+
+        Ссылки разрешаются только в пути к корню, внутри поддерева они занимают 0 байт.
+        """
+        if self.has_links:
+            path = self.realpath(path)
+        return self._disk_usage(path)
+
+    def _disk_usage(self, path):
+        entry = self.lookup(path)
+        if not entry.is_dir:
+            return entry.size
+        if path not in self.dirty:
+            return self.image.disk_usage(path)
+        size = self.du_cache.get(path)
+        if size is None:
+            size = sum(self._disk_usage(posixpath.join(path, name)) for name in self.listdir(path))
+            self.du_cache[path] = size
+        return size
+
+    def view(self, path):
+        entry = self.stat(path)
+        if entry.data is not None:
+            return memoryview(entry.data)
+        return self.image.view(entry)
+
+    def read(self, path):
+        return bytes(self.view(path))
+
+    def iter_chunks(self, path, chunk_size=CHUNK_SIZE):
+        view = self.view(path)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+
+    def iter_lines(self, path, encoding='utf-8'):
+        tail = b''
+        for chunk in self.iter_chunks(path):
+            lines = (tail + chunk).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line.decode(encoding, errors='replace')
+        if tail:
+            yield tail.decode(encoding, errors='replace')
+
+    def export(self, path, host_path):
+        with open(host_path, 'wb') as f:
+            for chunk in self.iter_chunks(path):
+                f.write(chunk)
+
+    def export_tree(self, path, host_path):
+        path = self.realpath(path) or path
+        for found, entry in list(self.walk(path)):
+            target = os.path.join(host_path, *found[len(path):].split('/'))
+            if entry.link is not None:
+                # ссылки на файлы выгружаются содержимым цели, на каталоги и висячие пропускаются
+                if self.is_file(found):
+                    self.export(found, target)
+            elif entry.is_dir:
+                os.makedirs(target, exist_ok=True)
+            else:
+                self.export(found, target)
+
+    def write(self, path, data, mode=0o644):
+        entry = self.stat(path)
+        if entry is not None:
+            mode = entry.mode
+        self._put(VfsEntry(path, False, mode, int(time.time()), len(data), data=data))
+
+    def copy(self, src, dest):
+        entry = self.stat(src)
+        self._put(VfsEntry(dest, False, entry.mode, int(time.time()), entry.size,
+                           entry.offset, data=entry.data))
+
+    def save(self, tar_path):
+        """Записывает образ с изменениями сеанса в tar-архив.
+
+        Всё, что не заменено изменениями сеанса, копируется из исходного
+        архива сырыми диапазонами байт — в том числе члены, которых нет в
+        индексе (глобальные заголовки pax, устройства, FIFO). Изменённые члены
+        сериализуются на своём месте, новые — в конце. Возвращает
+        (скопировано, записано).
+        """
+        copied = written = 0
+        tmp_path = tar_path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            position = 0
+            for entry, end in self.image.members():
+                if entry.path not in self.overlay:
+                    copied += 1
+                    continue
+                if position < entry.header_offset:
+                    out.write(self.image.raw(position, entry.header_offset))
+                self._write_member(out, self.overlay[entry.path])
+                written += 1
+                position = end
+            if position < self.image.data_end:
+                out.write(self.image.raw(position, self.image.data_end))
+            for path, entry in self.overlay.items():
+                image_entry = self.image.entries.get(path)
+                if image_entry is None or image_entry.header_offset < 0:
+                    self._write_member(out, entry)
+                    written += 1
+            out.write(b'\0' * (2 * BLOCK_SIZE))
+        os.replace(tmp_path, tar_path)
+        return copied, written
+
+    def _write_member(self, out, entry):
+        info = tarfile.TarInfo(entry.path.lstrip('/'))
+        if entry.link is not None:
+            info.type = tarfile.LNKTYPE if entry.hardlink else tarfile.SYMTYPE
+            info.linkname = entry.link
+        else:
+            info.type = tarfile.DIRTYPE if entry.is_dir else tarfile.REGTYPE
+        info.mode = entry.mode
+        info.mtime = entry.mtime
+        info.size = 0 if entry.is_dir or entry.link is not None else entry.size
+        out.write(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+        if not entry.is_dir and entry.link is None:
+            for chunk in self.iter_chunks(entry.path):
+                out.write(chunk)
+            out.write(b'\0' * (_padded(entry.size) - entry.size))
+
+    def mkdir(self, path, mode=0o755):
+        self._put(VfsEntry(path, True, mode, int(time.time())))
+
+    def copytree(self, src, dest):
+        src = self.realpath(src) or src
+        for found, entry in list(self.walk(src)):
+            target = dest + found[len(src):]
+            if entry.link is not None and not entry.hardlink:
+                # символические ссылки копируются как ссылки, как cp -R без -L
+                self._put(VfsEntry(target, False, entry.mode, int(time.time()), link=entry.link))
+            elif entry.is_dir:
+                if not self.is_dir(target):
+                    self.mkdir(target, entry.mode)
+            else:
+                self.copy(found, target)
+
+    def _put(self, entry):
+        if self.has_links:
+            entry.path = self._write_path(entry)
+        else:
+            self.has_links = entry.link is not None
+        parent = posixpath.dirname(entry.path)
+        if entry.path not in self.overlay and entry.path not in self.image.entries:
+            self.overlay_children.setdefault(parent, []).append(posixpath.basename(entry.path))
+        self.overlay[entry.path] = entry
+        path = entry.path if entry.is_dir else parent
+        while True:
+            self.dirty.add(path)
+            self.du_cache.pop(path, None)
+            if path == '/':
+                break
+            path = posixpath.dirname(path)
+
+    def _write_path(self, entry):
+        # Запись через ссылки: каталог берётся по настоящему пути, а существующая
+        # ссылка на месте файла заменяется записью в её цель
+        parent = self.realpath(posixpath.dirname(entry.path))
+        path = entry.path if parent is None else posixpath.join(parent, posixpath.basename(entry.path))
+        current = self.lookup(path)
+        if current is not None and current.link is not None and entry.link is None and not entry.is_dir:
+            path = self.realpath(path) or path
+        return path
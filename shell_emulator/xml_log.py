@@ -0,0 +1,119 @@
+import os
+import atexit
+from xml.sax.saxutils import escape
+
+XML_HEADER = '<?xml version="1.0" ?>\n<log>\n'
+XML_FOOTER = '</log>\n'
+
+FLUSH_ENTRY = 'entry'
+FLUSH_EXIT = 'exit'
+
+
+def parse_flush_policy(value):
+    """'entry', 'exit' или число N (сбрасывать буфер каждые N записей)."""
+    if value is None:
+        return FLUSH_ENTRY
+    value = value.strip().lower()
+    if value in (FLUSH_ENTRY, FLUSH_EXIT):
+        return value
+    try:
+        every = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid log flush policy: {value}")
+    if every < 1:
+        raise ValueError(f"Invalid log flush policy: {value}")
+    return every
+
+
+def recover_log(path):
+    """Дописывает закрывающий </log> в журнал, оборванный аварийным завершением."""
+    with open(path, 'rb+') as f:
+        if _find_footer(f) is None:
+            f.seek(0, os.SEEK_END)
+            f.write(XML_FOOTER.encode('utf-8'))
+            return True
+    return False
+
+
+def _find_footer(f):
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    tail_start = max(0, size - 64)
+    f.seek(tail_start)
+    tail = f.read()
+    pos = tail.rfind(b'</log>')
+    if pos == -1 or tail[pos + len(b'</log>'):].strip():
+        return None
+    return tail_start + pos
+
+
+class XmlLogWriter:
+    """Журнал сеанса, который дописывается по одной записи <entry> за O(1).
+
+    Файл держится открытым, закрывающий </log> пишется в close() (а также
+    при выходе из интерпретатора), поэтому журнал всегда остаётся корректным XML.
+    """
+
+    def __init__(self, path, flush_policy=FLUSH_ENTRY, fsync=False, append=False):
+        self.path = path
+        self.flush_policy = flush_policy
+        self.fsync = fsync
+        self.pending = 0
+        self.closed = False
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            self.file = open(path, 'r+b')
+            footer = _find_footer(self.file)
+            if footer is not None:
+                self.file.truncate(footer)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(XML_HEADER.encode('utf-8'))
+        self._flush()
+        atexit.register(self.close)
+
+    def write_entry(self, user, command, timestamp, timing=None):
+        if timing:
+            # длительности фаз команды в микросекундах
+            attributes = ''.join(f' {phase}_us="{seconds * 1e6:.1f}"' for phase, seconds in timing.items())
+            timing_line = f'        <timing{attributes}/>\n'
+        else:
+            timing_line = ''
+        self.write_raw(
+            '    <entry>\n'
+            f'        <user>{escape(user)}</user>\n'
+            f'        <command>{escape(command)}</command>\n'
+            f'        <timestamp>{escape(timestamp)}</timestamp>\n'
+            f'{timing_line}'
+            '    </entry>\n'
+        )
+
+    def write_raw(self, text):
+        self.file.write(text.encode('utf-8'))
+        self.pending += 1
+        if self.flush_policy == FLUSH_ENTRY:
+            self._flush()
+        elif self.flush_policy != FLUSH_EXIT and self.pending >= self.flush_policy:
+            self._flush()
+
+    def set_flush_policy(self, flush_policy):
+        self.flush_policy = flush_policy
+        if self.pending:
+            self._flush()
+
+    def _flush(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.file.write(XML_FOOTER.encode('utf-8'))
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.file.close()